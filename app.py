@@ -2,7 +2,8 @@ import os
 
 from flask import Flask
 
-from config import SECRET_KEY
+from config import SECRET_KEY, WARMUP_ENABLED
+from storage import store
 from blueprints.auth import auth
 from blueprints.dashboard import dashboard_bp
 from blueprints.sets import sets
@@ -11,6 +12,7 @@ from blueprints.test import test
 from blueprints.profile import profile_bp
 from blueprints.pwa import pwa
 from blueprints.notifications import notifications
+from blueprints.warmup import warmup
 
 app = Flask(__name__)
 app.secret_key = SECRET_KEY
@@ -23,6 +25,16 @@ app.register_blueprint(test, url_prefix='/zestawy')
 app.register_blueprint(profile_bp)
 app.register_blueprint(pwa)
 app.register_blueprint(notifications)
+if WARMUP_ENABLED:
+    app.register_blueprint(warmup)
+
+
+@app.teardown_request
+def release_snapshots(exc):
+    # Snapshoty shardów są przypięte do żądania (wątku) - zwolnij je po odpowiedzi
+    if store.loaded:
+        store.end_request()
+
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8080))
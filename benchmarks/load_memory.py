@@ -0,0 +1,99 @@
+"""Szczytowa pamięć (RSS) przy wczytywaniu dużego shardu: parsowanie całości vs strumieniowe.
+
+Generuje syntetyczny shard (jak benchmarks/storage_format.py, domyślnie ~2000 zestawów)
+w każdym formacie i wczytuje go w osobnym procesie na dwa sposoby:
+
+- całość: f.read() + decode_document + walidacja (stara ścieżka),
+- strumieniowo: open_document_stream + StreamingJsonList, zestaw po zestawie.
+
+    python benchmarks/load_memory.py [--sets 2000] [--cards 150] [--formats json gzip]
+
+Wynik to przyrost szczytowego RSS (VmHWM, Linux) ponad stan po imporcie modułów.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+if not os.environ.get('ENCRYPTION_KEY'):
+    from cryptography.fernet import Fernet
+    os.environ['ENCRYPTION_KEY'] = Fernet.generate_key().decode()
+
+from storage import encode_document, _zstd  # noqa: E402
+from storage_format import make_shard  # noqa: E402
+
+PROBE = r"""
+import json, sys, time
+import storage
+
+
+def high_water_kb():
+    # VmHWM jest per proces (ru_maxrss dziedziczy szczyt po procesie rodzica)
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+
+
+mode, path = sys.argv[1], sys.argv[2]
+before = high_water_kb()
+started = time.perf_counter()
+with open(path, 'rb') as f:
+    if mode == 'full':
+        sets_data = storage._decode_sets_blob(f.read())
+    else:
+        sets_data = storage._stream_sets(f)
+elapsed = time.perf_counter() - started
+peak = high_water_kb()
+print(json.dumps({'sets': len(sets_data), 'peak_mb': (peak - before) / 1024, 'ms': elapsed * 1000}))
+"""
+
+
+def probe(mode, path):
+    proc = subprocess.run([sys.executable, '-c', PROBE, mode, path], cwd=ROOT,
+                          env=os.environ, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr[-2000:])
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sets', type=int, default=2000)
+    parser.add_argument('--cards', type=int, default=150)
+    parser.add_argument('--formats', nargs='+', default=['json', 'compact', 'gzip', 'zstd'])
+    args = parser.parse_args()
+
+    formats = [fmt for fmt in args.formats if fmt != 'zstd' or _zstd() is not None]
+    document = make_shard(args.sets, args.cards)
+    work = tempfile.mkdtemp()
+    try:
+        paths = {}
+        for fmt in formats:
+            payload, _ = encode_document(document, fmt)
+            paths[fmt] = os.path.join(work, f'shard.{fmt}')
+            with open(paths[fmt], 'wb') as f:
+                f.write(payload)
+        del document
+
+        print(f"Shard: {args.sets} zestawów x {args.cards} kart\n")
+        print(f"{'format':<8} {'plik MB':>8} {'całość MB':>10} {'strumień MB':>12} {'całość ms':>10} {'strumień ms':>12}")
+        for fmt in formats:
+            full = probe('full', paths[fmt])
+            stream = probe('stream', paths[fmt])
+            assert full['sets'] == stream['sets'], (full, stream)
+            size_mb = os.path.getsize(paths[fmt]) / 1024 / 1024
+            print(f"{fmt:<8} {size_mb:>8.1f} {full['peak_mb']:>10.1f} {stream['peak_mb']:>12.1f} "
+                  f"{full['ms']:>10.0f} {stream['ms']:>12.0f}")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Czas przeliczenia harmonogramu SM-2 dla sesji na dużym zestawie.
+
+Mierzy samo srs.review_batch (kolumny) oraz srs.schedule_cards (z przeniesieniem
+stanu z/do obiektów Card) dla zestawu z syntetycznymi statystykami.
+
+    python benchmarks/srs_batch.py [--cards 20000] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cards import Card  # noqa: E402
+from srs import ensure_state, review_batch, schedule_cards  # noqa: E402
+
+
+def make_cards(count, rng):
+    karty = []
+    for i in range(count):
+        karta = Card(f'pytanie {i}', f'odpowiedź {i}')
+        stats = karta.statystyki
+        stats.pokazane = rng.randint(0, 30)
+        stats.nie_rozumiem = rng.randint(0, stats.pokazane)
+        stats.sessions_ok_streak = rng.randint(0, 5)
+        ensure_state(stats)
+        karty.append(karta)
+    return karty
+
+
+def best_of(repeat, func):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cards', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    karty = make_cards(args.cards, rng)
+    grades = [rng.choice((None, 2, 3, 4, 5)) for _ in karty]
+    stats = [karta.statystyki for karta in karty]
+    eases = [s.ease_factor for s in stats]
+    intervals = [s.interval_days for s in stats]
+    repetitions = [s.sessions_ok_streak for s in stats]
+    today = date.today()
+
+    batch = best_of(args.repeat, lambda: review_batch(eases, intervals, repetitions, grades))
+    cards = best_of(args.repeat, lambda: schedule_cards([k.copy() for k in karty], grades, today))
+    copy_only = best_of(args.repeat, lambda: [k.copy() for k in karty])
+
+    print(f"{args.cards} kart, {sum(g is not None for g in grades)} ocenionych")
+    print(f"review_batch:   {batch * 1000:8.2f} ms")
+    print(f"schedule_cards: {(cards - copy_only) * 1000:8.2f} ms (bez kopiowania kart)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Czas startu: import aplikacji i pierwsze żądanie korzystające ze store.
+
+Każdy pomiar to osobny proces Pythona uruchomiony w kopii drzewa z danymi
+testowymi (tryb lokalny, wygenerowany ENCRYPTION_KEY). Opcjonalnie porównuje
+bieżące drzewo z wcześniejszą rewizją gita:
+
+    python benchmarks/startup.py [--baseline HEAD~1] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r"""
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.test_client()
+# Nieudane logowanie - wymaga listy użytkowników, czyli utworzenia store
+client.post('/login', data={'username': 'nikt', 'password': 'x'})
+first_request = time.perf_counter()
+client.post('/login', data={'username': 'nikt', 'password': 'x'})
+second_request = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_request_ms': (first_request - imported) * 1000,
+    'second_request_ms': (second_request - first_request) * 1000,
+}))
+"""
+
+
+def copy_tree(revision, target):
+    if revision is None:
+        shutil.copytree(ROOT, target, ignore=shutil.ignore_patterns('.git', '__pycache__', '*.db*'))
+        return
+    os.makedirs(target)
+    archive = subprocess.run(['git', '-C', ROOT, 'archive', revision], check=True, capture_output=True).stdout
+    subprocess.run(['tar', '-x', '-C', target], input=archive, check=True)
+    # Te same dane wejściowe co w bieżącym drzewie (sets.json jest w repo)
+    for name in ('sets.json',):
+        if os.path.exists(os.path.join(ROOT, name)):
+            shutil.copy(os.path.join(ROOT, name), target)
+
+
+def measure(revision, repeat, env):
+    results = []
+    for _ in range(repeat):
+        work = tempfile.mkdtemp()
+        tree = os.path.join(work, 'tree')
+        copy_tree(revision, tree)
+        # users.json jest szyfrowany kluczem z repo - start bez niego
+        for name in ('users.json',):
+            path = os.path.join(tree, name)
+            if os.path.exists(path):
+                os.remove(path)
+        proc = subprocess.run([sys.executable, '-c', PROBE], cwd=tree, env=env, capture_output=True, text=True)
+        shutil.rmtree(work, ignore_errors=True)
+        if proc.returncode != 0:
+            raise RuntimeError(proc.stderr[-2000:])
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    return {key: statistics.median(r[key] for r in results) for key in results[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--baseline', help='rewizja gita do porównania (np. HEAD~1)')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    from cryptography.fernet import Fernet
+    env = dict(os.environ, USE_CLOUD_STORAGE='false', ENCRYPTION_KEY=Fernet.generate_key().decode())
+
+    trees = [('bieżące drzewo', None)]
+    if args.baseline:
+        trees.insert(0, (args.baseline, args.baseline))
+
+    print(f"Mediana z {args.repeat} uruchomień (ms)\n")
+    print(f"{'wersja':<16} {'import app':>11} {'1. żądanie':>11} {'2. żądanie':>11} {'razem':>9}")
+    for label, revision in trees:
+        r = measure(revision, args.repeat, env)
+        total = r['import_ms'] + r['first_request_ms']
+        print(f"{label:<16} {r['import_ms']:>11.1f} {r['first_request_ms']:>11.1f} "
+              f"{r['second_request_ms']:>11.1f} {total:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
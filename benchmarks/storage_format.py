@@ -0,0 +1,109 @@
+"""Porównanie formatów zapisu shardów: rozmiar, czas serializacji i parsowania.
+
+Generuje syntetyczny shard (domyślnie 200 zestawów x 150 kart z pełnymi statystykami
+i historią) i mierzy każdy format z STORAGE_FORMAT:
+
+    python benchmarks/storage_format.py [--sets 200] [--cards 150] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# config wymaga klucza szyfrowania; store nie jest tworzony (ładuje się dopiero przy użyciu)
+if not os.environ.get('ENCRYPTION_KEY'):
+    from cryptography.fernet import Fernet
+    os.environ['ENCRYPTION_KEY'] = Fernet.generate_key().decode()
+
+from storage import encode_document, decode_document, _zstd  # noqa: E402
+
+
+def make_shard(set_count, card_count, seed=0):
+    rng = random.Random(seed)
+    sets_data = []
+    for i in range(set_count):
+        karty = []
+        for j in range(card_count):
+            pokazane = rng.randint(0, 40)
+            rozumiem = rng.randint(0, pokazane)
+            karty.append({
+                'tekst': f'Pytanie {i}-{j} ' + 'lorem ipsum ' * rng.randint(1, 4),
+                'odpowiedz': f'Odpowiedź {i}-{j} ' + 'dolor sit ' * rng.randint(1, 3),
+                'statystyki': {
+                    'pokazane': pokazane,
+                    'rozumiem': rozumiem,
+                    'nie_rozumiem': pokazane - rozumiem,
+                    'procent_sukcesu': round(rozumiem / pokazane * 100) if pokazane else 0,
+                    'streak_rozumiem': rng.randint(0, 5),
+                    'streak_nie_rozumiem': rng.randint(0, 3),
+                    'opanowana': rng.random() < 0.3,
+                    'sessions_ok_streak': rng.randint(0, 4),
+                    'fail_streak_sessions': rng.randint(0, 2),
+                    'last_seen_date': f'2025-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}',
+                    'total_sessions_ok': rng.randint(0, 10),
+                    'next_due': f'2025-1{rng.randint(0, 2)}-0{rng.randint(1, 9)}',
+                    'leech': False,
+                },
+            })
+        sets_data.append({
+            'id': f'{i:032x}',
+            'autor': 'bench',
+            'nazwa': f'Zestaw {i}',
+            'data_utworzenia': '2025-01-01T12:00:00+00:00',
+            'karty': karty,
+            'historia_nauki': [
+                {'data': f'2025-02-{d:02d}', 'timestamp': f'2025-02-{d:02d}T10:00:00+00:00',
+                 'zrozumiane': rng.randint(0, card_count), 'niezrozumiane': rng.randint(0, 10)}
+                for d in range(1, 21)
+            ],
+            'historia_testow': [
+                {'data': f'2025-03-{d:02d}', 'timestamp': f'2025-03-{d:02d}T10:00:00+00:00',
+                 'poprawne': 8, 'lacznie': 10, 'procent': 80.0}
+                for d in range(1, 11)
+            ],
+            'days_completed': [f'2025-02-{d:02d}' for d in range(1, 21)],
+            'next_review_date': '2025-04-01',
+        })
+    return {'sets': sets_data}
+
+
+def best_of(repeat, fn):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sets', type=int, default=200)
+    parser.add_argument('--cards', type=int, default=150)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    document = make_shard(args.sets, args.cards)
+    formats = ['json', 'compact', 'gzip']
+    if _zstd() is not None:
+        formats.append('zstd')
+
+    print(f"Shard: {args.sets} zestawów x {args.cards} kart, najlepszy z {args.repeat} pomiarów\n")
+    print(f"{'format':<8} {'rozmiar':>12} {'vs json':>8} {'zapis ms':>10} {'odczyt ms':>10}")
+    baseline = None
+    for fmt in formats:
+        payload, _ = encode_document(document, fmt)
+        assert decode_document(payload) == document
+        baseline = baseline or len(payload)
+        encode_time = best_of(args.repeat, lambda: encode_document(document, fmt))
+        decode_time = best_of(args.repeat, lambda: decode_document(payload))
+        print(f"{fmt:<8} {len(payload):>12,} {len(payload) / baseline:>7.0%} "
+              f"{encode_time * 1000:>10.1f} {decode_time * 1000:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -16,11 +16,8 @@ def login():
             flash('Nazwa użytkownika i hasło są wymagane.', 'error')
             return render_template('login.html')
 
-        # Przeładuj dane użytkowników z Cloud Storage
-        store.reload_users()
-
-        # Znajdź użytkownika po loginie w liście
-        user = next((u for u in store.users if u.get('login') == username), None)
+        # Wczytaj rekord użytkownika (jeden mały odczyt, niezależnie od liczby kont)
+        user = store.get_user(username)
         if user and check_password_hash(user.get('haslo', ''), password):
             session['username'] = username
             flash('Logowanie pomyślne!', 'success')
@@ -46,11 +43,8 @@ def register():
             flash('Hasło nie może być puste.', 'error')
             return redirect(url_for('auth.register'))
 
-        # Przeładuj dane użytkowników z Cloud Storage
-        store.reload_users()
-
         # Sprawdź, czy login już istnieje
-        if any(u.get('login') == username for u in store.users):
+        if store.get_user(username) is not None:
             flash('Nazwa użytkownika już istnieje', 'error')
         elif password != confirm_password:
             flash('Hasła nie pasują do siebie', 'error')
@@ -62,8 +56,12 @@ def register():
                 'haslo': generate_password_hash(password),
                 'data_utworzenia': datetime.now(timezone.utc).isoformat()
             }
-            store.users.append(new_user)
-            store.save_and_reload_users()
+            if not store.add_user(new_user):
+                if store.get_user(username) is not None:
+                    flash('Nazwa użytkownika już istnieje', 'error')
+                else:
+                    flash('Nie udało się zapisać konta. Spróbuj ponownie.', 'error')
+                return redirect(url_for('auth.register'))
             flash('Rejestracja zakończona sukcesem! Zaloguj się.', 'success')
             return redirect(url_for('auth.login'))
 
@@ -9,6 +9,7 @@ from helpers import (
     compute_next_review_date,
     POLISH_MONTHS,
 )
+from history import completed_day_count, has_activity
 from storage import store
 
 dashboard_bp = Blueprint('dashboard', __name__)
@@ -22,46 +23,34 @@ def index():
 @dashboard_bp.route('/dashboard')
 @login_required
 def dashboard():
-    # Przeładuj dane z Cloud Storage, aby mieć świeże dane
-    store.reload_sets()
-
-    # Pokaż zestawy użytkownika na stronie głównej
-    user_sets = [s for s in store.sets if s.get('autor') == session['username']]
+    # Zestawy użytkownika (przy watcherze generacji z pamięci, bez odpytywania Cloud Storage)
+    user_sets = store.read_sets(session['username'])
 
     # Wzbogacenie: oblicz procent opanowania (ostrzejsze kryteria)
     enriched_sets = []
     for s in user_sets:
-        karty = s.get('karty', []) or []
+        karty = s['karty']
         total_cards = len(karty)
         mastered = 0
 
-        # Wyczyść błędną datę powtórki dla nowych zestawów bez aktywności
-        try:
-            if s.get('next_review_date'):
-                if not (s.get('days_completed') or []) and not (s.get('historia_nauki') or []):
-                    s['next_review_date'] = None
-        except Exception as e:
-            print(f'Warning: could not clear next_review_date for set {s.get("id", "?")}: {e}')
+        # Snapshot ze store jest tylko do odczytu - wyznaczona data trafia do enriched_sets
+        next_review_date = s['next_review_date']
 
         if total_cards > 0:
             for karta in karty:
-                stats = karta.get('statystyki') or {}
-                stats.setdefault('opanowana', False)
-                pokazane = stats.get('pokazane', 0)
-                procent = stats.get('procent_sukcesu', 0)
-                if stats.get('opanowana'):
+                stats = karta.statystyki
+                if stats.opanowana:
                     mastered += 1
-                elif pokazane >= 5 and procent >= 85:
+                elif stats.pokazane >= 5 and stats.procent_sukcesu >= 85:
                     mastered += 1
 
         # Fallback: wyznacz next_review_date jeśli brak, na podstawie ukończonych dni
         try:
-            if not s.get('next_review_date'):
-                completed_days = set(s.get('days_completed') or [])
-                completed_count = len(completed_days)
+            if not next_review_date:
+                completed_count = completed_day_count(s)
                 if completed_count > 0:
                     now_date = datetime.now(timezone.utc).date()
-                    s['next_review_date'] = compute_next_review_date(
+                    next_review_date = compute_next_review_date(
                         completed_count, now_date
                     )
         except Exception as e:
@@ -78,10 +67,12 @@ def dashboard():
 
         enriched_sets.append({
             **s,
+            'next_review_date': next_review_date,
             'mastery_percent': mastery_percent,
             'mastered_count': mastered,
             'total_cards': total_cards,
             'mastery_class': mastery_class,
+            'is_new': not has_activity(s),
         })
 
     # Oblicz codzienny streak (kolejne dni z aktywnością, licząc od dziś)
@@ -91,15 +82,14 @@ def dashboard():
     # Przygotuj kalendarz bieżącego miesiąca do podglądu (popover)
     month_rows, month_name_pl, year = build_month_grid(activity_dates, streak_dates)
 
-    # Wyznacz zestawy do powtórki dzisiaj
-    today_str = datetime.now(timezone.utc).date().isoformat()
-    due_today_sets = []
-    for s in enriched_sets:
-        next_date = s.get('next_review_date')
-        is_new = not (s.get('days_completed') or []) and not (s.get('historia_nauki') or [])
-        # Dodaj zestawy z datą <= dzisiaj (również przeterminowane) lub nowe zestawy
-        if (next_date and next_date <= today_str) or is_new:
-            due_today_sets.append(s)
+    # Wyznacz zestawy do powtórki dzisiaj: z datą <= dzisiaj (również przeterminowane) lub nowe
+    # zestawy - z indeksu terminów, razem z liczbą fiszek do powtórki w najbliższym tygodniu
+    today = datetime.now(timezone.utc).date()
+    today_str = today.isoformat()
+    due_index = store.due_index(session['username'])
+    due_ids = set(due_index.sets_due(today))
+    due_today_sets = [s for s in enriched_sets if s['id'] in due_ids]
+    due_cards_week = due_index.due_counts(today, 7)
 
     # Dodaj dzisiejszą datę do wszystkich zestawów dla porównania w szablonie
     for s in enriched_sets:
@@ -112,6 +102,7 @@ def dashboard():
         username=session['username'],
         zestawy=enriched_sets,
         due_today_sets=due_today_sets,
+        due_cards_week=due_cards_week,
         daily_streak=streak,
         month_rows=month_rows,
         month_name=month_name_pl,
@@ -1,23 +1,29 @@
-import random
-import time
+from itertools import takewhile
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify
-from datetime import datetime, timezone, timedelta
+from datetime import date, datetime, timedelta, timezone
+from config import LEARN_CHUNK_SIZE, LEARN_SYNC_MAX_AGE_DAYS
 from storage import store
 from helpers import login_required, find_user_set, compute_next_review_date
+from history import compact_history, completed_day_count
+from session_state import bit, bits_from_str, bits_to_str, fingerprint, new_seed, shuffled
+from srs import earliest_due, grade_of, schedule_cards, PASS_THRESHOLD
 
 learn = Blueprint('learn', __name__, url_prefix='/zestawy')
 
+# Ile ostatnich identyfikatorów zsynchronizowanych sesji pamięta zestaw (ochrona przed powtórkami)
+SYNC_LOG_SIZE = 100
+
 
 @learn.route('/<set_id>/ucz-sie')
 @login_required
 def learn_set(set_id):
-    store.reload_sets()
+    store.reload_sets(session['username'])
 
     zestaw, err = find_user_set(store, set_id)
     if err:
         return err
 
-    if not zestaw.get('karty') or len(zestaw['karty']) == 0:
+    if not zestaw['karty']:
         flash('Ten zestaw nie zawiera żadnych fiszek.', 'error')
         return redirect(url_for('sets.view_set', set_id=set_id))
 
@@ -26,57 +32,31 @@ def learn_set(set_id):
     random_order = False if random_param is None else random_param == '1'
     review_mode = request.args.get('review') == '1'
 
-    # Przygotuj kolejność indeksów kart do nauki (przechowujemy tylko indeksy, nie całe karty)
-    total_cards = len(zestaw.get('karty', []))
-    order = list(range(total_cards))
-
-    # Tryb powtórki - tylko fiszki oznaczone jako trudne na podstawie statystyk i terminowości
-    if review_mode:
-        # Znajdź karty:
-        # - Nieopanowane i (procent < 70 lub pokazane < 3)
-        # - Opanowane, ale termin powtórki (next_due <= dziś) lub długa nieaktywność (>14 dni)
-        difficult_indices = []
-        for i, karta in enumerate(zestaw['karty']):
-            stats = karta.get('statystyki', {})
-            pokazane = stats.get('pokazane', 0)
-            procent = stats.get('procent_sukcesu', 0)
-            opanowana = stats.get('opanowana', False)
-            next_due = stats.get('next_due')
-            last_seen = stats.get('last_seen_date')
-            due = False
-            inactive = False
-            try:
-                if next_due:
-                    due = datetime.fromisoformat(next_due).date() <= datetime.now(timezone.utc).date()
-                if last_seen:
-                    inactive = (datetime.now(timezone.utc).date() - datetime.fromisoformat(last_seen).date()).days > 14
-            except Exception:
-                pass
-
-            if (not opanowana and (pokazane < 3 or procent < 70)) or (opanowana and (due or inactive)):
-                difficult_indices.append(i)
-
-        if difficult_indices:
-            order = difficult_indices
-        else:
-            flash('Brak trudnych fiszek do powtórki! Wszystkie fiszki mają ≥70% sukcesu lub są opanowane (3× z rzędu). 🎉', 'success')
-            return redirect(url_for('sets.view_set', set_id=set_id))
-
-    # Losowa kolejność
-    if random_order:
-        rng = random.Random(time.time_ns())  # świeże losowanie przy każdym uruchomieniu
-        rng.shuffle(order)
-
-    # Nie zapisujemy wyników per karta w sesji (obsługa po stronie klienta)
+    # Tryb powtórki - tylko fiszki oznaczone jako trudne na podstawie statystyk i terminowości:
+    # - Nieopanowane i (procent < 70 lub pokazane < 3)
+    # - Opanowane, ale termin powtórki (next_due <= dziś) lub długa nieaktywność (>14 dni)
+    # (z indeksu terminów snapshotu - bez parsowania dat wszystkich kart w każdym żądaniu)
+    # Losowa kolejność - świeże ziarno przy każdym uruchomieniu
+    state = _new_state(zestaw,
+                       seed=new_seed() if random_order else 0,
+                       review_day=datetime.now(timezone.utc).date().isoformat() if review_mode else '')
+    order = _session_order(zestaw, state)
+    if review_mode and not order:
+        flash('Brak trudnych fiszek do powtórki! Wszystkie fiszki mają ≥70% sukcesu lub są opanowane (3× z rzędu). 🎉', 'success')
+        return redirect(url_for('sets.view_set', set_id=set_id))
 
-    # Stwórz tymczasowy zestaw z kartami w odpowiedniej kolejności
-    zestaw_temp = zestaw.copy()
-    zestaw_temp['karty'] = [zestaw['karty'][i] for i in order]
+    # W sesji tylko ziarno, tryb i odcisk zestawu - kolejność odtwarzana przy każdym żądaniu
+    session[f'learn_{set_id}'] = state
+    session.modified = True
 
+    # W HTML tylko pierwsza porcja kart; kolejne klient pobiera z learn_cards_chunk
     return render_template(
         'learn_set.html',
         username=session['username'],
-        zestaw=zestaw_temp,
+        zestaw=zestaw,
+        cards=_template_cards(zestaw['karty'], order[:LEARN_CHUNK_SIZE]),
+        cards_start=0,
+        chunk_size=LEARN_CHUNK_SIZE,
         current_index=0,
         order=order,
         random_order=random_order,
@@ -84,13 +64,41 @@ def learn_set(set_id):
     )
 
 
+@learn.route('/<set_id>/ucz-sie/karty')
+@login_required
+def learn_cards_chunk(set_id):
+    """Porcja kart sesji nauki (JSON) dla indeksów ?indices=3,0,7 w kolejności sesji."""
+    # Indeksy odnoszą się do kolejności zbudowanej przez learn_set ze świeżego snapshotu -
+    # odczyt z pamięci (read_sets) mógłby dać starszą listę kart
+    store.reload_sets(session['username'])
+
+    zestaw = store.get_set(set_id)
+    if not zestaw:
+        return jsonify({'error': 'set_not_found'}), 404
+    if zestaw.get('autor') != session['username']:
+        return jsonify({'error': 'forbidden'}), 403
+    # Zestaw zmienił się od startu sesji (inny odcisk) - indeksy wskazywałyby inne karty
+    if f'learn_{set_id}' in session and _load_state(set_id, zestaw) is None:
+        return jsonify({'error': 'set_changed'}), 409
+
+    try:
+        indices = [int(x) for x in request.args.get('indices', '').split(',') if x.strip()]
+    except ValueError:
+        return jsonify({'error': 'invalid_indices'}), 400
+    num_cards = len(zestaw['karty'])
+    if len(indices) > LEARN_CHUNK_SIZE or not all(0 <= i < num_cards for i in indices):
+        return jsonify({'error': 'invalid_indices'}), 400
+
+    return jsonify({'cards': _template_cards(zestaw['karty'], indices)})
+
+
 @learn.route('/<set_id>/ucz-sie/submit', methods=['POST'])
 @login_required
 def learn_submit(set_id):
-    store.reload_sets()
+    store.reload_sets(session['username'])
 
     # Znajdź zestaw
-    zestaw = next((s for s in store.sets if s.get('id') == set_id), None)
+    zestaw = store.get_set(set_id)
     if not zestaw:
         return jsonify({'error': 'set_not_found'}), 404
     if zestaw.get('autor') != session['username']:
@@ -101,98 +109,181 @@ def learn_submit(set_id):
     order = data.get('order') or []
     mode = data.get('mode') or {'random': False, 'review': False}
 
-    if not isinstance(results, list) or not isinstance(order, list):
+    if not isinstance(results, list) or not isinstance(order, list) or not isinstance(mode, dict):
         return jsonify({'error': 'invalid_payload'}), 400
 
     # Walidacja order: musi być listą unikalnych intów w zakresie 0..len(karty)-1
-    karty = zestaw.get('karty') or []
-    num_cards = len(karty)
+    num_cards = len(zestaw['karty'])
     if order:
         if (not all(isinstance(x, int) for x in order)
                 or not all(0 <= x < num_cards for x in order)
                 or len(set(order)) != len(order)):
             return jsonify({'error': 'invalid_order'}), 400
 
-    # Upewnij się, że długości wyników i kolejności są spójne
     if len(order) == 0:
-        order = list(range(len(zestaw.get('karty', []) or [])))
-    if len(results) != len(order):
-        normalized = [None] * len(order)
-        for i, value in enumerate(results[:len(order)]):
-            normalized[i] = value
-        results = normalized
-
-    # Zapisz wyniki do sesji, aby użyć istniejącego podsumowania
-    session[f'learn_{set_id}_results'] = results
-    session[f'learn_{set_id}_order'] = order
-    session[f'learn_{set_id}_mode'] = mode
-    session.modified = True
+        order = list(range(num_cards))
+
+    # Wyniki przychodzą w komplecie - zapis od razu, w sesji tylko liczniki do podsumowania
+    full_results = [None] * num_cards
+    for card_index, value in zip(order, results):
+        if grade_of(value) is not None:
+            full_results[card_index] = value
+    grades = [g for g in map(grade_of, full_results) if g is not None]
+    understood = sum(1 for g in grades if g >= PASS_THRESHOLD)
+    if grades:
+        now_ts = datetime.now(timezone.utc)
+
+        def apply_results(zestaw):
+            _apply_learn_results(zestaw, full_results, understood, len(grades) - understood, now_ts)
+
+        if store.update_set(session['username'], set_id, apply_results) is None:
+            return jsonify({'error': 'save_failed'}), 503
+
+    _clear_session(set_id)
+    session[f'learn_{set_id}_synced'] = {'understood': understood, 'not_understood': len(grades) - understood,
+                                         'unsolved': num_cards - len(grades), 'mode': mode}
 
     return jsonify({'redirect': url_for('learn.learn_summary', set_id=set_id)})
 
 
+@learn.route('/<set_id>/ucz-sie/sync', methods=['POST'])
+@login_required
+def learn_sync(set_id):
+    """Idempotentny zapis całej sesji nauki jednym commitem.
+
+    Payload: {"session_id": "...", "items": [{"card_id", "result", "timestamp"}], "mode": {...}}.
+    Sesja o znanym session_id (ponowienie po zerwanym połączeniu, kolejka offline) nie jest
+    nakładana drugi raz. Wyniki kart usuniętych od startu sesji są pomijane.
+    """
+    username = session['username']
+    store.reload_sets(username)
+
+    zestaw = store.get_set(set_id)
+    if not zestaw:
+        return jsonify({'error': 'set_not_found'}), 404
+    if zestaw.get('autor') != username:
+        return jsonify({'error': 'forbidden'}), 403
+
+    data = request.get_json(silent=True) or {}
+    session_id = data.get('session_id')
+    items = data.get('items')
+    mode = data.get('mode') or {'random': False, 'review': False}
+    if not isinstance(session_id, str) or not 0 < len(session_id) <= 64:
+        return jsonify({'error': 'invalid_session_id'}), 400
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        return jsonify({'error': 'invalid_payload'}), 400
+
+    # card_id -> wynik (przy powtórzonej karcie liczy się ostatni wpis)
+    results_by_card = {}
+    session_ts = None
+    for item in items:
+        grade = grade_of(item.get('result'))
+        if not isinstance(item.get('card_id'), str) or grade is None:
+            continue
+        results_by_card[item['card_id']] = item.get('result')
+        item_ts = _parse_timestamp(item.get('timestamp'))
+        if item_ts is not None and (session_ts is None or item_ts > session_ts):
+            session_ts = item_ts
+    # Sesja offline liczy się do dnia, w którym się odbyła - znacznik klienta tylko w oknie
+    # LEARN_SYNC_MAX_AGE_DAYS dni do teraz; starszy (lub brak) to czas serwera, aby nie cofać
+    # historii ani terminów SM-2
+    now_ts = datetime.now(timezone.utc)
+    if session_ts is None or session_ts < now_ts - timedelta(days=LEARN_SYNC_MAX_AGE_DAYS):
+        session_ts = now_ts
+    session_ts = min(session_ts, now_ts)
+
+    outcome = {}
+
+    def apply_session(sets_data):
+        current = next((s for s in sets_data if s.get('id') == set_id), None)
+        if current is None or session_id in current['sesje_zsynchronizowane']:
+            return False
+        zestaw = sets_data.edit(set_id)
+        full_results = [results_by_card.get(karta.id) for karta in zestaw['karty']]
+        grades = [g for g in map(grade_of, full_results) if g is not None]
+        understood = sum(1 for g in grades if g >= PASS_THRESHOLD)
+        _apply_learn_results(zestaw, full_results, understood, len(grades) - understood, session_ts)
+        log = zestaw['sesje_zsynchronizowane']
+        log.append(session_id)
+        del log[:-SYNC_LOG_SIZE]
+        outcome.update(understood=understood, not_understood=len(grades) - understood,
+                       unsolved=len(full_results) - len(grades))
+        return True
+
+    if not store.update_sets(username, apply_session):
+        return jsonify({'error': 'save_failed'}), 503
+
+    duplicate = not outcome
+    if duplicate:
+        # Ponowienie już zapisanej sesji - podsumowanie z samego payloadu
+        known = {karta.id for karta in zestaw['karty']}
+        grades = [grade_of(r) for card_id, r in results_by_card.items() if card_id in known]
+        understood = sum(1 for g in grades if g >= PASS_THRESHOLD)
+        outcome.update(understood=understood, not_understood=len(grades) - understood,
+                       unsolved=max(0, len(zestaw['karty']) - len(grades)))
+    session[f'learn_{set_id}_synced'] = dict(outcome, mode=mode)
+    session.modified = True
+
+    return jsonify({
+        'status': 'duplicate' if duplicate else 'applied',
+        'redirect': url_for('learn.learn_summary', set_id=set_id),
+    })
+
+
 @learn.route('/<set_id>/ucz-sie/<int:card_index>', methods=['GET', 'POST'])
 @login_required
 def learn_card(set_id, card_index):
-    store.reload_sets()
+    store.reload_sets(session['username'])
 
     zestaw, err = find_user_set(store, set_id)
     if err:
         return err
 
-    # Pobierz kolejność indeksów kart z sesji i zbuduj listę kart w tej kolejności
-    order = session.get(f'learn_{set_id}_order')
-    if order is None:
-        order = list(range(len(zestaw.get('karty', []))))
-    ordered_cards = [zestaw['karty'][i] for i in order] if zestaw.get('karty') else []
+    # Odtwórz kolejność kart ze stanu sesji (karty budowane tylko dla porcji wokół card_index)
+    state = _load_state(set_id, zestaw)
+    if state is None:
+        if session.pop(f'learn_{set_id}', None) is not None:
+            flash('Zestaw zmienił się w trakcie nauki - sesja zaczyna się od nowa.', 'info')
+        state = _new_state(zestaw, seed=0, review_day='')
+    order = _session_order(zestaw, state)
 
     # Walidacja card_index
-    if card_index < 0 or card_index >= len(ordered_cards):
+    if card_index < 0 or card_index >= len(order):
         flash('Nieprawidłowy indeks fiszki.', 'error')
         return redirect(url_for('sets.view_set', set_id=set_id))
 
     if request.method == 'POST':
         # Zapisz wynik (czy rozumie czy nie)
         understood = request.form.get('understood') == 'true'
-        results_key = f'learn_{set_id}_results'
-
-        if results_key not in session:
-            session[results_key] = []
-
-        session[results_key].append(understood)
-
-        order = session.get(f'learn_{set_id}_order') or list(range(len(zestaw.get('karty', []))))
-        original_index = order[card_index] if card_index < len(order) else card_index
-
-        # Jeśli nie rozumie, dodaj do listy trudnych fiszek w sesji (dla starych użytkowników)
-        if not understood:
-            difficult_key = f'learn_{set_id}_difficult'
-            if difficult_key not in session:
-                session[difficult_key] = []
-            if original_index not in session[difficult_key]:
-                session[difficult_key].append(original_index)
-
+        original_index = order[card_index]
+        state['answered'] = bits_to_str(bits_from_str(state['answered']) | 1 << original_index)
+        understood_bits = bits_from_str(state['understood'])
+        if understood:
+            understood_bits |= 1 << original_index
+        else:
+            understood_bits &= ~(1 << original_index)
+        state['understood'] = bits_to_str(understood_bits)
+        session[f'learn_{set_id}'] = state
         session.modified = True
 
         # Sprawdź czy to była ostatnia fiszka
-        if card_index >= len(ordered_cards) - 1:
+        if card_index >= len(order) - 1:
             # Przekieruj do podsumowania
             return redirect(url_for('learn.learn_summary', set_id=set_id))
         else:
             # Następna fiszka
             return redirect(url_for('learn.learn_card', set_id=set_id, card_index=card_index + 1))
 
-    # GET - pokaż fiszkę
-    if card_index >= len(ordered_cards):
-        return redirect(url_for('learn.learn_summary', set_id=set_id))
-
-    # Stwórz tymczasowy zestaw z kartami w kolejności ustalonej w sesji
-    zestaw_temp = zestaw.copy()
-    zestaw_temp['karty'] = ordered_cards
-
+    # GET - pokaż fiszkę (porcja kart od bieżącej pozycji, reszta dociągana przez klienta)
+    num_cards = len(zestaw['karty'])
+    # Karty usunięte od startu sesji kończą porcję (pozycje muszą odpowiadać kolejności)
+    window = list(takewhile(lambda i: 0 <= i < num_cards, order[card_index:card_index + LEARN_CHUNK_SIZE]))
     return render_template('learn_set.html',
                          username=session['username'],
-                         zestaw=zestaw_temp,
+                         zestaw=zestaw,
+                         cards=_template_cards(zestaw['karty'], window),
+                         cards_start=card_index,
+                         chunk_size=LEARN_CHUNK_SIZE,
                          current_index=card_index,
                          order=order)
 
@@ -200,162 +291,218 @@ def learn_card(set_id, card_index):
 @learn.route('/<set_id>/podsumowanie')
 @login_required
 def learn_summary(set_id):
-    store.reload_sets()
+    username = session['username']
+    store.reload_sets(username)
 
     # Znajdź zestaw
-    zestaw = next((s for s in store.sets if s.get('id') == set_id), None)
-    if not zestaw:
+    zestaw = store.get_set(set_id)
+    if not zestaw or zestaw.get('autor') != username:
         flash('Zestaw nie został znaleziony.', 'error')
         return redirect(url_for('dashboard.dashboard'))
 
-    # Pobierz wyniki
-    results_key = f'learn_{set_id}_results'
-    results = session.get(results_key, [])
-    order = session.get(f'learn_{set_id}_order') or list(range(len(zestaw.get('karty', []))))
-    last_mode = session.get(f'learn_{set_id}_mode', {'random': False, 'review': False})
-
-    answered_results = [r for r in results if r is True or r is False]
-    understood_count = sum(1 for r in answered_results if r)
-    not_understood_count = sum(1 for r in answered_results if not r)
-    solved_total = len(answered_results)
-    total_cards = len(zestaw.get('karty', []))
-    unsolved_count = max(0, total_cards - solved_total)
+    # Pobierz wyniki (bitsety stanu sesji; po zmianie zestawu indeksy kart są nieaktualne)
+    state = _load_state(set_id, zestaw)
+    stale = session.get(f'learn_{set_id}')
+    if state is None and isinstance(stale, dict) and stale.get('answered'):
+        flash('Zestaw zmienił się w trakcie nauki - wyniki tej sesji nie zostały zapisane.', 'error')
+    answered = bits_from_str(state['answered']) if state else 0
+
+    # Sesja zapisana już przez learn_sync lub learn_submit - tylko podsumowanie
+    synced = session.pop(f'learn_{set_id}_synced', None)
+    if synced is not None and not answered:
+        _clear_session(set_id)
+        return render_template('learn_summary.html',
+                             username=username,
+                             zestaw=zestaw,
+                             understood=synced.get('understood', 0),
+                             not_understood=synced.get('not_understood', 0),
+                             unsolved=synced.get('unsolved', 0),
+                             total=len(zestaw['karty']),
+                             last_mode=synced.get('mode') or {'random': False, 'review': False})
+    last_mode = {'random': bool(state and state['seed']), 'review': bool(state and state['review'])}
+
+    # Wyniki per oryginalny indeks karty: True/False lub None (bez odpowiedzi)
+    total_cards = len(zestaw['karty'])
+    understood_bits = bits_from_str(state['understood']) if state else 0
+    full_results = [bit(understood_bits, i) if bit(answered, i) else None for i in range(total_cards)]
+    understood_count = sum(1 for r in full_results if r is True)
+    not_understood_count = sum(1 for r in full_results if r is False)
+    unsolved_count = total_cards - understood_count - not_understood_count
 
     # Zapisz wyniki do zestawu przed wyczyszczeniem sesji i zaktualizuj sesyjne statystyki
-    if results:
-        # Odwzoruj wyniki na oryginalne indeksy kart (ważne przy losowej kolejności)
-        full_results = [None] * total_cards
-        for idx, res in enumerate(results):
-            orig_idx = order[idx] if idx < len(order) else idx
-            if 0 <= orig_idx < total_cards:
-                full_results[orig_idx] = res
-        zestaw['ostatnie_wyniki'] = full_results
-        unsolved_count = sum(1 for r in full_results if r is None)
+    if answered:
         now_ts = datetime.now(timezone.utc)
-        today = now_ts.date().isoformat()
-        zestaw['data_ostatniej_nauki'] = now_ts.isoformat()
-
-        # Aktualizacja per-karta: sesje, degradacja tolerancyjna, due scheduling
-        for i in range(total_cards):
-            session_res = full_results[i]
-            karta = zestaw['karty'][i]
-            stats = karta.setdefault('statystyki', {})
-            # Uzupełnij brakujące klucze
-            stats.setdefault('pokazane', 0)
-            stats.setdefault('rozumiem', 0)
-            stats.setdefault('nie_rozumiem', 0)
-            stats.setdefault('procent_sukcesu', 0)
-            stats.setdefault('sessions_ok_streak', 0)
-            stats.setdefault('fail_streak_sessions', 0)
-            stats.setdefault('last_seen_date', None)
-            stats.setdefault('total_sessions_ok', 0)
-            stats.setdefault('next_due', None)
-            stats.setdefault('leech', False)
-            stats.setdefault('opanowana', False)
-
-            if session_res is not None:
-                stats['pokazane'] = stats.get('pokazane', 0) + 1
-                stats['last_seen_date'] = today
-                if session_res is True:
-                    stats['rozumiem'] = stats.get('rozumiem', 0) + 1
-                    stats['sessions_ok_streak'] = stats.get('sessions_ok_streak', 0) + 1
-                    stats['fail_streak_sessions'] = 0
-                    stats['total_sessions_ok'] = stats.get('total_sessions_ok', 0) + 1
-                    # Proste odstępy powtórek (SM-2 light) zależne od streak sesji
-                    streak = stats['sessions_ok_streak']
-                    if streak >= 3:
-                        interval_days = 16
-                    elif streak == 2:
-                        interval_days = 6
-                    else:
-                        interval_days = 1
-                    stats['next_due'] = (now_ts.date() + timedelta(days=interval_days)).isoformat()
-                else:
-                    stats['nie_rozumiem'] = stats.get('nie_rozumiem', 0) + 1
-                    stats['fail_streak_sessions'] = stats.get('fail_streak_sessions', 0) + 1
-                    stats['sessions_ok_streak'] = 0
-                    # Tolerancja błędu: degraduj dopiero po 2 kolejnych sesjach z błędem
-                    if stats.get('opanowana') and stats['fail_streak_sessions'] >= 2:
-                        stats['opanowana'] = False
-
-                # Przelicz procent sukcesu po aktualizacji liczników
-                pokazane = stats.get('pokazane', 0)
-                rozumiem = stats.get('rozumiem', 0)
-                if pokazane > 0:
-                    stats['procent_sukcesu'] = round((rozumiem / pokazane) * 100, 1)
-                else:
-                    stats['procent_sukcesu'] = 0
-
-                # Nadanie opanowania wg sesji lub prób + skuteczność
-                procent = stats.get('procent_sukcesu', 0)
-                if not stats.get('opanowana') and (
-                    stats.get('sessions_ok_streak', 0) >= 3 or (pokazane >= 5 and procent >= 85)
-                ):
-                    stats['opanowana'] = True
-
-                # Wykrywanie szczególnie trudnych fiszek
-                if stats.get('nie_rozumiem', 0) >= 6 and procent < 60:
-                    stats['leech'] = True
-                elif procent >= 70:
-                    stats['leech'] = False
-
-        # Dodaj wpis do historii nauki
-        if 'historia_nauki' not in zestaw:
-            zestaw['historia_nauki'] = []
-        zestaw['historia_nauki'].append({
-            'data': today,
-            'timestamp': now_ts.isoformat(),
-            'zrozumiane': understood_count,
-            'niezrozumiane': not_understood_count
-        })
-
-        # Oznacz zestaw jako ukończony dziś, jeśli wszystkie fiszki były dziś przerobione
-        all_seen_today = False
-        try:
-            zestaw.setdefault('days_completed', [])
-            all_seen_today = True
-            for karta in zestaw.get('karty', []) or []:
-                stats = karta.get('statystyki') or {}
-                if stats.get('last_seen_date') != today:
-                    all_seen_today = False
-                    break
-            if all_seen_today and today not in zestaw['days_completed']:
-                zestaw['days_completed'].append(today)
-        except Exception:
-            pass
-
-        # Ustal termin kolejnej powtórki zestawu wg harmonogramu, tylko jeśli ukończony dziś:
-        # - pierwsze 5 dni ukończeń: codziennie
-        # - potem 3 ukończenia co 3 dni
-        # - potem co tydzień
-        try:
-            if all_seen_today:
-                completed_days = set(zestaw.get('days_completed') or [])
-                completed_count = len(completed_days)
-                zestaw['next_review_date'] = compute_next_review_date(completed_count, now_ts.date())
-        except Exception:
-            pass
-
-        store.save_and_reload_sets()
+
+        def apply_results(zestaw):
+            # Mutacja nakładana na świeży snapshot - po konflikcie zapisu stosowana ponownie
+            _apply_learn_results(zestaw, full_results, understood_count, not_understood_count, now_ts)
+
+        saved = store.update_set(username, set_id, apply_results)
+        if saved is None:
+            flash('Nie udało się zapisać wyników nauki. Odśwież stronę, aby spróbować ponownie.', 'error')
+            return render_template('learn_summary.html',
+                                 username=username,
+                                 zestaw=zestaw,
+                                 understood=understood_count,
+                                 not_understood=not_understood_count,
+                                 unsolved=unsolved_count,
+                                 total=total_cards,
+                                 last_mode=last_mode)
+        zestaw = saved
 
     # Wyczyść sesję
-    if results_key in session:
-        del session[results_key]
-    if f'learn_{set_id}_current' in session:
-        del session[f'learn_{set_id}_current']
-    if f'learn_{set_id}_order' in session:
-        del session[f'learn_{set_id}_order']
-    if f'learn_{set_id}_mode' in session:
-        del session[f'learn_{set_id}_mode']
-    if f'learn_{set_id}_difficult' in session:
-        del session[f'learn_{set_id}_difficult']
-    session.modified = True
+    _clear_session(set_id)
 
     return render_template('learn_summary.html',
-                         username=session['username'],
+                         username=username,
                          zestaw=zestaw,
                          understood=understood_count,
                          not_understood=not_understood_count,
                          unsolved=unsolved_count,
                          total=total_cards,
                          last_mode=last_mode)
+
+
+def _new_state(zestaw, seed, review_day):
+    """Stan sesji nauki: ziarno kolejności (0 - kolejno), dzień trybu powtórki ('' - wszystkie
+    karty), odcisk zestawu i bitsety odpowiedzi (answered) oraz "rozumiem" (understood)."""
+    return {
+        'seed': seed,
+        'review': review_day,
+        'fp': fingerprint([karta.id for karta in zestaw['karty']]),
+        'answered': '',
+        'understood': '',
+    }
+
+
+def _load_state(set_id, zestaw):
+    """Stan sesji nauki zestawu lub None (brak sesji albo zestaw zmienił się od jej startu)."""
+    state = session.get(f'learn_{set_id}')
+    if not isinstance(state, dict) or state.get('fp') != fingerprint([karta.id for karta in zestaw['karty']]):
+        return None
+    return state
+
+
+def _session_order(zestaw, state):
+    """Kolejność indeksów kart sesji odtworzona deterministycznie ze stanu.
+
+    Karty trybu powtórki wybierane są dla dnia startu sesji; statystyki kart zmieniają się
+    dopiero po zapisie wyników, więc w trakcie sesji lista jest taka sama jak na starcie.
+    """
+    if state['review']:
+        base = store.due_index(zestaw['autor']).review_cards(zestaw['id'], date.fromisoformat(state['review']))
+    else:
+        base = range(len(zestaw['karty']))
+    return shuffled(base, state['seed'])
+
+
+def _clear_session(set_id):
+    """Usuń stan sesji nauki zestawu (także klucze starszego formatu z list kolejności/wyników)."""
+    for suffix in ('', '_results', '_order', '_mode', '_current', '_difficult'):
+        session.pop(f'learn_{set_id}{suffix}', None)
+    session.modified = True
+
+
+def _template_cards(karty, order):
+    """Karty w kolejności nauki jako słowniki dla szablonu (serializowane do JS przez tojson)."""
+    return [{'id': karty[i].id, 'tekst': karty[i].tekst, 'odpowiedz': karty[i].odpowiedz} for i in order]
+
+
+def _parse_timestamp(value):
+    """Znacznik czasu ISO 8601 od klienta -> datetime UTC lub None."""
+    if not isinstance(value, str):
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def _apply_learn_results(zestaw, full_results, understood_count, not_understood_count, now_ts):
+    """Nanieś wyniki sesji nauki (per oryginalny indeks karty) na zestaw."""
+    today = now_ts.date().isoformat()
+    karty = zestaw['karty']
+    # Karty mogły się zmienić od startu sesji - dopasuj wyniki do bieżącej liczby kart
+    full_results = [full_results[i] if i < len(full_results) else None for i in range(len(karty))]
+    zestaw['ostatnie_wyniki'] = full_results
+    zestaw['data_ostatniej_nauki'] = now_ts.isoformat()
+
+    # Harmonogram SM-2 całej sesji jednym wywołaniem (łatwość, odstęp, seria, next_due)
+    grades = [grade_of(r) for r in full_results]
+    schedule_cards(karty, grades, now_ts.date())
+
+    # Aktualizacja per-karta: liczniki, degradacja tolerancyjna, opanowanie
+    for i in range(len(karty)):
+        grade = grades[i]
+        stats = karty[i].statystyki
+
+        if grade is not None:
+            stats.pokazane += 1
+            stats.last_seen_date = today
+            if grade >= PASS_THRESHOLD:
+                stats.rozumiem += 1
+                stats.fail_streak_sessions = 0
+                stats.total_sessions_ok += 1
+            else:
+                stats.nie_rozumiem += 1
+                stats.fail_streak_sessions += 1
+                # Tolerancja błędu: degraduj dopiero po 2 kolejnych sesjach z błędem
+                if stats.opanowana and stats.fail_streak_sessions >= 2:
+                    stats.opanowana = False
+
+            # Przelicz procent sukcesu po aktualizacji liczników
+            pokazane = stats.pokazane
+            if pokazane > 0:
+                stats.procent_sukcesu = round((stats.rozumiem / pokazane) * 100, 1)
+            else:
+                stats.procent_sukcesu = 0
+
+            # Nadanie opanowania wg sesji lub prób + skuteczność
+            procent = stats.procent_sukcesu
+            if not stats.opanowana and (
+                stats.sessions_ok_streak >= 3 or (pokazane >= 5 and procent >= 85)
+            ):
+                stats.opanowana = True
+
+            # Wykrywanie szczególnie trudnych fiszek
+            if stats.nie_rozumiem >= 6 and procent < 60:
+                stats.leech = True
+            elif procent >= 70:
+                stats.leech = False
+
+    # Dodaj wpis do historii nauki
+    zestaw['historia_nauki'].append({
+        'data': today,
+        'timestamp': now_ts.isoformat(),
+        'zrozumiane': understood_count,
+        'niezrozumiane': not_understood_count
+    })
+
+    # Oznacz zestaw jako ukończony dziś, jeśli wszystkie fiszki były dziś przerobione
+    all_seen_today = False
+    try:
+        all_seen_today = True
+        for karta in karty:
+            if karta.statystyki.last_seen_date != today:
+                all_seen_today = False
+                break
+        if all_seen_today and today not in zestaw['days_completed']:
+            zestaw['days_completed'].append(today)
+    except Exception:
+        pass
+
+    # Ustal termin kolejnej powtórki zestawu, tylko jeśli ukończony dziś: najwcześniejszy
+    # termin karty wg SM-2 (awaryjnie stały harmonogram wg liczby dni ukończeń)
+    try:
+        if all_seen_today:
+            completed_count = completed_day_count(zestaw)
+            zestaw['next_review_date'] = (earliest_due(karty)
+                                          or compute_next_review_date(completed_count, now_ts.date()))
+    except Exception:
+        pass
+
+    # Zwiń historię starszą niż HISTORY_HOT_DAYS do agregatów dziennych
+    compact_history(zestaw, now_ts.date())
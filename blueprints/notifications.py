@@ -2,7 +2,6 @@ import json
 import copy
 from datetime import datetime, timezone
 from flask import Blueprint, request, jsonify, session
-from pywebpush import webpush, WebPushException
 from config import VAPID_PUBLIC_KEY, VAPID_PRIVATE_KEY, VAPID_CLAIMS, SCHEDULER_SECRET
 from helpers import login_required
 from storage import store
@@ -18,16 +17,11 @@ def vapid_public_key():
 @notifications.route('/push/subscribe', methods=['POST'])
 @login_required
 def subscribe():
-    store.reload_users()
     data = request.get_json()
     if not data or not data.get('endpoint'):
         return jsonify({'error': 'invalid'}), 400
 
     username = session['username']
-    user = next((u for u in store.users if u.get('login') == username), None)
-    if not user:
-        return jsonify({'error': 'user not found'}), 404
-
     subscription = {
         'endpoint': data['endpoint'],
         'keys': data.get('keys') or {},
@@ -35,44 +29,43 @@ def subscribe():
         'last_sent_date': None,
     }
 
-    # Replace existing subscription for same endpoint, or append
-    subs = user.setdefault('push_subscriptions', [])
-    subs = [s for s in subs if s.get('endpoint') != data['endpoint']]
-    subs.append(subscription)
-    user['push_subscriptions'] = subs
-    store.save_and_reload_users()
+    def add_subscription(user):
+        # Replace existing subscription for same endpoint, or append
+        subs = user.get('push_subscriptions') or []
+        subs = [s for s in subs if s.get('endpoint') != data['endpoint']]
+        subs.append(subscription)
+        user['push_subscriptions'] = subs
+
+    # update_user wczytuje rekord sam - brak konta też kończy się None
+    if store.update_user(username, add_subscription) is None:
+        return jsonify({'error': 'save failed'}), 500
     return jsonify({'ok': True})
 
 
 @notifications.route('/push/unsubscribe', methods=['POST'])
 @login_required
 def unsubscribe():
-    store.reload_users()
     data = request.get_json()
     endpoint = data.get('endpoint') if data else None
     username = session['username']
-    user = next((u for u in store.users if u.get('login') == username), None)
-    if not user or not endpoint:
+    if not endpoint:
+        return jsonify({'ok': False})
+
+    def remove_subscription(user):
+        user['push_subscriptions'] = [
+            s for s in user.get('push_subscriptions', [])
+            if s.get('endpoint') != endpoint
+        ]
+
+    if store.update_user(username, remove_subscription) is None:
         return jsonify({'ok': False})
-    user['push_subscriptions'] = [
-        s for s in user.get('push_subscriptions', [])
-        if s.get('endpoint') != endpoint
-    ]
-    store.save_and_reload_users()
     return jsonify({'ok': True})
 
 
 def _count_due_sets(username):
     """Count sets due for review today for a given user."""
-    today_str = datetime.now(timezone.utc).date().isoformat()
-    user_sets = [s for s in store.sets if s.get('autor') == username]
-    count = 0
-    for s in user_sets:
-        next_date = s.get('next_review_date')
-        is_new = not (s.get('days_completed') or []) and not (s.get('historia_nauki') or [])
-        if (next_date and next_date <= today_str) or is_new:
-            count += 1
-    return count
+    store.reload_sets(username)
+    return len(store.due_index(username).sets_due(datetime.now(timezone.utc).date()))
 
 
 @notifications.route('/push/debug-subs', methods=['POST'])
@@ -117,24 +110,31 @@ def send_daily_notifications(force=False):
     """Called once daily by Cloud Scheduler. Sends push to all subscribers.
     Deduplication via last_sent_date prevents double sends.
     If force=True, bypasses last_sent_date check."""
+    # pywebpush (i jego zależności kryptograficzne) ładowany dopiero przy wysyłce
+    from pywebpush import webpush, WebPushException
+
     result = {'ok': True, 'sent': 0, 'skipped_already_sent': 0, 'errors': 0, 'expired': 0}
     try:
-        store.reload_sets()
         store.reload_users()
         today_str = datetime.now(timezone.utc).date().isoformat()
 
-        changed = False
+        # (login, endpoint) -> wynik wysyłki; stosowane na świeżych rekordach przy zapisie
+        sent = set()
+        expired = set()
         for user in store.users:
             subs = user.get('push_subscriptions', [])
             if not subs:
                 continue
             username = user.get('login', '')
+            due_count = None
             for sub in subs:
                 if not force and sub.get('last_sent_date') == today_str:
                     result['skipped_already_sent'] += 1
                     continue
 
-                due_count = _count_due_sets(username)
+                # Shard zestawów użytkownika pobierany raz, tylko gdy jest komu wysłać
+                if due_count is None:
+                    due_count = _count_due_sets(username)
                 if due_count == 0:
                     body = 'Dzisiaj nie masz zestawów do powtórki. Dobra robota! 🎉'
                 elif due_count == 1:
@@ -149,7 +149,7 @@ def send_daily_notifications(force=False):
                     keys = sub.get('keys') or {}
                     if not keys.get('p256dh') or not keys.get('auth'):
                         print(f'Push skip {username}: missing keys p256dh/auth, endpoint={endpoint[:80]}')
-                        sub['_expired'] = True
+                        expired.add((username, endpoint))
                         result['errors'] += 1
                         result['expired'] += 1
                         continue
@@ -167,8 +167,7 @@ def send_daily_notifications(force=False):
                         vapid_claims=claims,
                         content_encoding='aes128gcm',
                     )
-                    sub['last_sent_date'] = today_str
-                    changed = True
+                    sent.add((username, endpoint))
                     result['sent'] += 1
                     print(f'Push sent to {username} endpoint={endpoint[:80]}')
                 except WebPushException as e:
@@ -181,22 +180,26 @@ def send_daily_notifications(force=False):
                         pass
                     print(f'Push error for {username}: status={status_code} body={resp_body} endpoint={sub.get("endpoint", "")[:80]}')
                     if status_code in (400, 401, 403, 404, 410):
-                        sub['_expired'] = True
+                        expired.add((username, sub.get('endpoint')))
                         result['expired'] += 1
                     elif status_code == 429:
                         print(f'Push rate-limited for {username}, skipping')
                         continue
 
-        # Remove expired subscriptions
-        for user in store.users:
-            subs_before = user.get('push_subscriptions', [])
-            cleaned = [s for s in subs_before if not s.get('_expired')]
-            if len(cleaned) != len(subs_before):
-                user['push_subscriptions'] = cleaned
-                changed = True
-
-        if changed:
-            store.save_and_reload_users()
+        def apply_results(user):
+            username = user.get('login', '')
+            # Remove expired subscriptions
+            cleaned = [s for s in user.get('push_subscriptions', []) if (username, s.get('endpoint')) not in expired]
+            for s in cleaned:
+                if (username, s.get('endpoint')) in sent:
+                    s['last_sent_date'] = today_str
+            user['push_subscriptions'] = cleaned
+
+        # Jeden zapis na konto, którego subskrypcje się zmieniły
+        for username in sorted({login for login, _ in sent | expired}):
+            if store.update_user(username, apply_results) is None:
+                result['ok'] = False
+                result['error'] = 'save failed'
     except Exception as e:
         print(f'send_daily_notifications error: {e}')
         result['ok'] = False
@@ -9,6 +9,7 @@ from helpers import (
     compute_streak,
     POLISH_MONTHS,
 )
+from history import learn_days, learn_session_count, test_dates
 from storage import store
 
 profile_bp = Blueprint('profile', __name__)
@@ -17,11 +18,9 @@ profile_bp = Blueprint('profile', __name__)
 @profile_bp.route('/profil')
 @login_required
 def profile():
-    # Przeładuj dane z Cloud Storage
-    store.reload_sets()
-
+    # Zestawy użytkownika (przy watcherze generacji z pamięci, bez odpytywania Cloud Storage)
     username = session['username']
-    user_sets = [s for s in store.sets if s.get('autor') == username]
+    user_sets = store.read_sets(username)
 
     tab = request.args.get('tab', 'statystyki')
 
@@ -45,8 +44,7 @@ def profile():
     for s in user_sets:
         sid = s['id']
         nazwa = s.get('nazwa', '')
-        karty = s.get('karty', [])
-        historia_nauki = s.get('historia_nauki', []) or []
+        karty = s['karty']
 
         # Karty
         total_c = 0
@@ -54,37 +52,32 @@ def profile():
         leech_c = 0
         for k in karty:
             total_c += 1
-            stats_k = k.get('statystyki', {})
-            if stats_k.get('opanowana') == True:
+            stats_k = k.statystyki
+            if stats_k.opanowana == True:
                 mastered_c += 1
-            if stats_k.get('leech') == True:
+            if stats_k.leech == True:
                 leech_c += 1
         total_cards += total_c
         mastered_cards += mastered_c
         leech_cards += leech_c
 
-        # Historia nauki
-        total_sess = len(historia_nauki)
+        # Historia nauki (świeże wpisy i agregaty dzienne starszych dni)
+        total_sess = learn_session_count(s)
         lifetime_sessions += total_sess
         last_sess = None
-        for wpis in historia_nauki:
-            data = wpis.get('data')
-            if data:
-                if data == today:
-                    sessions_today += 1
-                weekly_stats[data] += 1
-                set_solve_counts[sid] += 1
-                activity_dates.add(data)
-                learn_counts_by_date[data] += 1
-                daily_set_counts[data][nazwa] += 1
-                if last_sess is None or data > last_sess:
-                    last_sess = data
+        for data, count in learn_days(s):
+            if data == today:
+                sessions_today += count
+            weekly_stats[data] += count
+            set_solve_counts[sid] += count
+            activity_dates.add(data)
+            learn_counts_by_date[data] += count
+            daily_set_counts[data][nazwa] += count
+            if last_sess is None or data > last_sess:
+                last_sess = data
 
         # Historia testów (tylko dla activity_dates)
-        for wpis in s.get('historia_testow', []) or []:
-            data = wpis.get('data')
-            if data:
-                activity_dates.add(data)
+        activity_dates.update(test_dates(s))
 
         mastered_pct = round(mastered_c * 100 / total_c) if total_c > 0 else 0
         set_stats.append({
@@ -121,7 +114,7 @@ def profile():
     sorted_sets = sorted(set_solve_counts.items(), key=lambda x: x[1], reverse=True)
     top_sets = []
     for set_id, count in sorted_sets[:3]:
-        zestaw = next((s for s in user_sets if s['id'] == set_id), None)
+        zestaw = store.get_set(set_id)
         if zestaw is not None:
             top_sets.append({'zestaw': zestaw, 'count': count})
 
@@ -219,8 +212,7 @@ def change_password():
     new_password = request.form.get('new_password', '')
     confirm_password = request.form.get('confirm_password', '')
 
-    store.reload_users()
-    user = next((u for u in store.users if u.get('login') == session['username']), None)
+    user = store.get_user(session['username'])
 
     if user is None:
         flash('Nie znaleziono użytkownika.', 'error')
@@ -238,7 +230,13 @@ def change_password():
         flash('Nowe hasło musi mieć co najmniej 6 znaków.', 'error')
         return redirect(url_for('profile.profile', tab='konto'))
 
-    user['haslo'] = generate_password_hash(new_password)
-    store.save_and_reload_users()
+    new_hash = generate_password_hash(new_password)
+
+    def set_password(user):
+        user['haslo'] = new_hash
+
+    if store.update_user(session['username'], set_password) is None:
+        flash('Nie udało się zmienić hasła. Spróbuj ponownie.', 'error')
+        return redirect(url_for('profile.profile', tab='konto'))
     flash('Hasło zostało zmienione.', 'success')
     return redirect(url_for('profile.profile', tab='konto'))
@@ -4,7 +4,9 @@ from flask import Blueprint, render_template, request, redirect, url_for, sessio
 from datetime import datetime, timezone
 from uuid import uuid4
 from storage import store
-from helpers import login_required, find_user_set, make_default_stats, ensure_card_stats, compute_next_review_date
+from cards import Card
+from helpers import login_required, find_user_set, compute_next_review_date
+from history import completed_day_count, has_activity
 
 sets = Blueprint('sets', __name__)
 
@@ -38,11 +40,7 @@ def create_set():
                         pytanie = row[0].strip()
                         odpowiedz = row[1].strip()
                         if pytanie or odpowiedz:
-                            karty.append({
-                                'tekst': pytanie,
-                                'odpowiedz': odpowiedz,
-                                'statystyki': make_default_stats()
-                            })
+                            karty.append(Card(pytanie, odpowiedz))
 
                 if not karty:
                     flash('Plik CSV jest pusty lub nieprawidłowy.', 'error')
@@ -61,11 +59,7 @@ def create_set():
                 t = (teksty[i].strip() if i < len(teksty) and teksty[i] is not None else '')
                 o = (odpowiedzi[i].strip() if i < len(odpowiedzi) and odpowiedzi[i] is not None else '')
                 if t and o:
-                    karty.append({
-                        'tekst': t,
-                        'odpowiedz': o,
-                        'statystyki': make_default_stats()
-                    })
+                    karty.append(Card(t, o))
 
         if not nazwa:
             flash('Podaj nazwę zestawu.', 'error')
@@ -83,8 +77,10 @@ def create_set():
             'karty': karty
         }
 
-        store.sets.append(new_set)
-        store.save_and_reload_sets()
+        store.reload_sets(session['username'])
+        if not store.add_set(new_set):
+            flash('Nie udało się zapisać zestawu. Spróbuj ponownie.', 'error')
+            return render_template('create_set.html', username=session['username'])
         flash('Zestaw został utworzony!', 'success')
         return redirect(url_for('sets.zestawy'))
 
@@ -94,43 +90,35 @@ def create_set():
 @sets.route('/<set_id>')
 @login_required
 def view_set(set_id):
-    # Przeładuj dane z Cloud Storage
-    store.reload_sets()
+    # Widok tylko do odczytu - przy watcherze generacji zestawy z pamięci
+    store.read_sets(session['username'])
 
     # Znajdź zestaw i zweryfikuj dostęp
     zestaw, err = find_user_set(store, set_id)
     if err:
         return err
-
-    # Wyczyść błędną datę powtórki dla nowych zestawów bez aktywności
-    try:
-        if zestaw.get('next_review_date'):
-            if not (zestaw.get('days_completed') or []) and not (zestaw.get('historia_nauki') or []):
-                zestaw['next_review_date'] = None
-    except Exception:
-        pass
+    # Poprawki poniżej służą tylko do wyświetlenia - snapshot ze store jest tylko do odczytu
+    # (zmieniane są tylko pola zestawu, karty pozostają współdzielone)
+    zestaw = dict(zestaw)
+    zestaw['is_new'] = not has_activity(zestaw)
 
     # Fallback: wyznacz next_review_date jeśli brak, na podstawie ukończonych dni (days_completed)
     try:
         if not zestaw.get('next_review_date'):
-            completed_days = set(zestaw.get('days_completed') or [])
-            completed_count = len(completed_days)
+            completed_count = completed_day_count(zestaw)
             if completed_count > 0:
                 now_date = datetime.now(timezone.utc).date()
                 zestaw['next_review_date'] = compute_next_review_date(completed_count, now_date)
     except Exception:
         pass
 
-    # Uzupełnij brakujące statystyki i Top 5 najtrudniejszych fiszek (najniższy procent sukcesu, tylko karty z historią)
-    for karta in zestaw.get('karty', []) or []:
-        ensure_card_stats(karta)
-
+    # Top 5 najtrudniejszych fiszek (najniższy procent sukcesu, tylko karty z historią)
     top_difficult_cards = []
-    for idx, karta in enumerate(zestaw.get('karty', []), start=1):
-        stats = karta.get('statystyki') or {}
-        shown = stats.get('pokazane', 0)
-        success = stats.get('procent_sukcesu', 0)
-        opanowana = stats.get('opanowana', False)
+    for idx, karta in enumerate(zestaw['karty'], start=1):
+        stats = karta.statystyki
+        shown = stats.pokazane
+        success = stats.procent_sukcesu
+        opanowana = stats.opanowana
 
         # Pokazuj tylko fiszki, które:
         # - były pokazane co najmniej 3 razy
@@ -139,8 +127,8 @@ def view_set(set_id):
         if shown >= 3 and success < 40 and not opanowana:
             top_difficult_cards.append({
                 'index': idx,
-                'tekst': karta.get('tekst', ''),
-                'odpowiedz': karta.get('odpowiedz', ''),
+                'tekst': karta.tekst,
+                'odpowiedz': karta.odpowiedz,
                 'pokazane': shown,
                 'procent_sukcesu': success
             })
@@ -160,7 +148,7 @@ def view_set(set_id):
 @login_required
 def edit_set(set_id):
     # Przeładuj dane z Cloud Storage
-    store.reload_sets()
+    store.reload_sets(session['username'])
 
     # Znajdź zestaw i zweryfikuj dostęp
     zestaw, err = find_user_set(store, set_id)
@@ -172,70 +160,68 @@ def edit_set(set_id):
         teksty = request.form.getlist('tekst[]')
         odpowiedzi = request.form.getlist('odpowiedz[]')
 
-        # Zbuduj listę kart - zachowaj istniejące statystyki jeśli są
-        karty = []
-        stare_karty = zestaw.get('karty', [])
-
-        # Buduj lookup po treści karty (tekst, odpowiedz) -> statystyki
-        stare_stats_lookup = {}
-        for karta in stare_karty:
-            key = (karta.get('tekst', ''), karta.get('odpowiedz', ''))
-            if key not in stare_stats_lookup:  # first occurrence wins
-                stare_stats_lookup[key] = karta.get('statystyki')
-
+        # Pary (tekst, odpowiedź) z formularza - puste pary są pomijane
+        pary = []
         for i in range(max(len(teksty), len(odpowiedzi))):
             t = (teksty[i].strip() if i < len(teksty) and teksty[i] is not None else '')
             o = (odpowiedzi[i].strip() if i < len(odpowiedzi) and odpowiedzi[i] is not None else '')
             if t and o:
-                # Zachowaj statystyki jeśli karta istniała (niezależnie od pozycji)
-                key = (t, o)
-                old_stats = stare_stats_lookup.get(key)
-
-                # Uzupełnij brakujące pola w starych statystykach
-                if not old_stats:
-                    old_stats = make_default_stats()
-                else:
-                    old_stats.setdefault('streak_rozumiem', 0)
-                    old_stats.setdefault('streak_nie_rozumiem', 0)
-                    old_stats.setdefault('opanowana', False)
-                    old_stats.setdefault('sessions_ok_streak', 0)
-                    old_stats.setdefault('fail_streak_sessions', 0)
-                    old_stats.setdefault('last_seen_date', None)
-                    old_stats.setdefault('total_sessions_ok', 0)
-                    old_stats.setdefault('next_due', None)
-                    old_stats.setdefault('leech', False)
-                karty.append({
-                    'tekst': t,
-                    'odpowiedz': o,
-                    'statystyki': old_stats
-                })
+                pary.append((t, o))
 
         if not nazwa:
             flash('Podaj nazwę zestawu.', 'error')
             return render_template('edit_set.html', username=session['username'], zestaw=zestaw)
 
-        if not karty:
+        if not pary:
             flash('Dodaj przynajmniej jedną fiszkę.', 'error')
             return render_template('edit_set.html', username=session['username'], zestaw=zestaw)
 
-        # Aktualizuj zestaw
-        zestaw['nazwa'] = nazwa
-        zestaw['karty'] = karty
-        store.save_and_reload_sets()
+        def apply_edit(zestaw):
+            # Statystyki bierzemy ze świeżego snapshotu, aby nie nadpisać równoległej sesji nauki
+            zestaw['nazwa'] = nazwa
+            zestaw['karty'] = _build_edited_cards(zestaw['karty'], pary)
+
+        if store.update_set(session['username'], set_id, apply_edit) is None:
+            flash('Nie udało się zapisać zmian. Spróbuj ponownie.', 'error')
+            return render_template('edit_set.html', username=session['username'], zestaw=zestaw)
         flash('Zestaw został zaktualizowany!', 'success')
         return redirect(url_for('sets.view_set', set_id=set_id))
 
     return render_template('edit_set.html', username=session['username'], zestaw=zestaw)
 
 
+def _build_edited_cards(stare_karty, pary):
+    """Zbuduj listę kart z par (tekst, odpowiedź), zachowując istniejące statystyki."""
+    # Buduj lookup po treści karty (tekst, odpowiedz) -> karta
+    stare_lookup = {}
+    for karta in stare_karty:
+        key = (karta.tekst, karta.odpowiedz)
+        if key not in stare_lookup:  # first occurrence wins
+            stare_lookup[key] = karta
+
+    karty = []
+    used_ids = set()
+    for t, o in pary:
+        # Zachowaj statystyki i identyfikator jeśli karta istniała (niezależnie od pozycji);
+        # kopia, bo powtórzona para nie może współdzielić obiektu statystyk ani identyfikatora
+        old = stare_lookup.get((t, o))
+        if old is None:
+            karty.append(Card(t, o))
+            continue
+        card_id = old.id if old.id not in used_ids else None
+        karty.append(Card(t, o, old.statystyki.copy(), card_id))
+        used_ids.add(karty[-1].id)
+    return karty
+
+
 @sets.route('/<set_id>/usun', methods=['POST'])
 @login_required
 def delete_set(set_id):
     # Przeładuj dane z Cloud Storage
-    store.reload_sets()
+    store.reload_sets(session['username'])
 
     # Znajdź zestaw
-    zestaw = next((s for s in store.sets if s.get('id') == set_id), None)
+    zestaw = store.get_set(set_id)
     if not zestaw:
         flash('Zestaw nie został znaleziony.', 'error')
         return redirect(url_for('dashboard.dashboard'))
@@ -246,8 +232,9 @@ def delete_set(set_id):
         return redirect(url_for('dashboard.dashboard'))
 
     # Usuń zestaw z listy
-    store.sets.remove(zestaw)
-    store.save_and_reload_sets()
+    if not store.remove_set(session['username'], set_id):
+        flash('Nie udało się usunąć zestawu. Spróbuj ponownie.', 'error')
+        return redirect(url_for('sets.view_set', set_id=set_id))
 
     flash(f'Zestaw "{zestaw["nazwa"]}" został usunięty.', 'success')
     return redirect(url_for('dashboard.dashboard'))
@@ -1,7 +1,9 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash
 from datetime import datetime, timezone
 from storage import store
-from helpers import login_required, find_user_set, get_valid_cards
+from helpers import login_required, find_user_set
+from history import compact_history
+from session_state import new_seed, permuted_index
 import random
 
 test = Blueprint('test', __name__, url_prefix='/zestawy')
@@ -10,14 +12,14 @@ test = Blueprint('test', __name__, url_prefix='/zestawy')
 @test.route('/<set_id>/test')
 @login_required
 def test_set(set_id):
-    store.reload_sets()
+    store.reload_sets(session['username'])
 
     zestaw, err = find_user_set(store, set_id)
     if err:
         return err
 
     # Sprawdź czy zestaw ma karty
-    if not zestaw.get('karty') or len(zestaw['karty']) == 0:
+    if not zestaw['karty']:
         flash('Ten zestaw nie zawiera żadnych fiszek.', 'error')
         return redirect(url_for('sets.view_set', set_id=set_id))
 
@@ -29,10 +31,9 @@ def test_set(set_id):
         count = int(request.args.get('count', 5))
     except ValueError:
         count = 5
-    karty = list(zestaw['karty'])
 
-    # Używaj tylko kart z niepustym pytaniem i odpowiedzią
-    valid_cards = get_valid_cards(zestaw)
+    # Używaj tylko kart z niepustym pytaniem i odpowiedzią (projekcja trzymana przez store dla opublikowanego snapshotu)
+    valid_cards = store.valid_cards(zestaw)
     if not valid_cards:
         flash('Brak odpowiednich fiszek do tworzenia testu (puste pytania lub odpowiedzi).', 'error')
         return redirect(url_for('sets.view_set', set_id=set_id))
@@ -44,42 +45,16 @@ def test_set(set_id):
         count = 5
     count = min(count, len(valid_cards))
 
-    # Losuj pytania (indeksy w valid_cards)
-    valid_indices = list(range(len(valid_cards)))
-    test_card_indices = valid_indices if count == len(valid_cards) else random.sample(valid_indices, count)
-
-    # Dla każdej karty generuj pytanie z wielokrotnym wyborem
-    # Zapisuj tylko indeksy, aby zmniejszyć payload sesji
-    questions = []
-    for i, card_index in enumerate(test_card_indices):
-        # Poprawna odpowiedź
-        correct_index = card_index
-
-        # Wygeneruj losowe niepoprawne odpowiedzi z innych kart (indeksy)
-        # Dynamicznie dostosuj liczbę opcji do dostępnych kart (max 4)
-        wrong_pool = [idx for idx in valid_indices if idx != correct_index]
-        num_wrong = min(3, len(wrong_pool))
-        if num_wrong > 0:
-            wrong_indices = random.sample(wrong_pool, num_wrong)
-        else:
-            wrong_indices = []
-
-        # Wszystkie opcje (poprawna + niepoprawne) i tasowanie
-        options_indices = [correct_index] + wrong_indices
-        random.shuffle(options_indices)
-        correct_option = options_indices.index(correct_index)
-
-        questions.append({
-            'number': i + 1,
-            'card_index': card_index,
-            'options': options_indices,
-            'correct_option': correct_option
-        })
-
-    # Zapisz pytania w sesji
-    session[f'test_{set_id}_questions'] = questions
-    session[f'test_{set_id}_current'] = 0
-    session[f'test_{set_id}_results'] = []
+    # Zapisz w sesji tylko ziarno, liczbę pytań i odcisk zestawu - pytania i opcje
+    # są odtwarzane deterministycznie przy każdym żądaniu
+    for key in (f'test_{set_id}_questions', f'test_{set_id}_current', f'test_{set_id}_results'):
+        session.pop(key, None)
+    session[f'test_{set_id}'] = {
+        'seed': new_seed(),
+        'count': count,
+        'fp': valid_cards.fingerprint,
+        'answers': '',
+    }
     session.modified = True
 
     # Przekieruj do pierwszego pytania
@@ -89,10 +64,10 @@ def test_set(set_id):
 @test.route('/<set_id>/test/<int:question_index>', methods=['GET', 'POST'])
 @login_required
 def test_question(set_id, question_index):
-    store.reload_sets()
+    store.reload_sets(session['username'])
 
     # Znajdź zestaw
-    zestaw = next((s for s in store.sets if s.get('id') == set_id), None)
+    zestaw = store.get_set(set_id)
     if not zestaw:
         flash('Zestaw nie został znaleziony.', 'error')
         return redirect(url_for('dashboard.dashboard'))
@@ -101,39 +76,26 @@ def test_question(set_id, question_index):
         flash('Nie masz dostępu do tego zestawu.', 'error')
         return redirect(url_for('dashboard.dashboard'))
 
-    # Pobierz pytania z sesji
-    questions = session.get(f'test_{set_id}_questions', [])
-
-    if not questions or question_index < 0 or question_index >= len(questions):
+    # Stan testu z sesji
+    state = session.get(f'test_{set_id}')
+    if not isinstance(state, dict) or question_index < 0 or question_index >= state.get('count', 0):
         return redirect(url_for('test.test_summary_route', set_id=set_id))
 
-    # Odbuduj listę poprawnych kart, aby odczytać treść i odpowiedzi
-    valid_cards = get_valid_cards(zestaw)
-
-    current_question = questions[question_index]
-    card_index = current_question.get('card_index')
-    options_indices = current_question.get('options', [])
-    correct_option = current_question.get('correct_option')
-
-    if card_index is None or card_index >= len(valid_cards):
+    # Poprawne karty (treść i odpowiedzi) z pamięci podręcznej - bez przeglądania kart w każdym żądaniu
+    valid_cards = store.valid_cards(zestaw)
+    if state.get('fp') != valid_cards.fingerprint:
+        session.pop(f'test_{set_id}', None)
         flash('Nieprawidłowe dane testu. Spróbuj uruchomić test ponownie.', 'error')
         return redirect(url_for('sets.view_set', set_id=set_id))
 
-    card = valid_cards[card_index]
-    rendered_options = []
-    for idx, option_index in enumerate(options_indices):
-        if option_index is None or option_index >= len(valid_cards):
-            option_text = '—'
-        else:
-            option_text = str(valid_cards[option_index].get('odpowiedz', '—'))
-        rendered_options.append({
-            'value': str(idx),
-            'text': option_text
-        })
+    # Odtwórz tylko bieżące pytanie
+    card_index, options_indices, correct_option = _question(state, question_index, len(valid_cards))
+    rendered_options = [{'value': str(idx), 'text': valid_cards.answers[option_index]}
+                        for idx, option_index in enumerate(options_indices)]
 
     question_payload = {
-        'number': current_question.get('number', question_index + 1),
-        'question': card.get('tekst', ''),
+        'number': question_index + 1,
+        'question': valid_cards.questions[card_index],
         'options': rendered_options,
         'correct_option': correct_option
     }
@@ -146,23 +108,17 @@ def test_question(set_id, question_index):
         except ValueError:
             selected_option = None
 
-        is_correct = (selected_option is not None and selected_option == question_payload['correct_option'])
-
-        results_key = f'test_{set_id}_results'
-        if results_key not in session:
-            session[results_key] = []
+        if selected_option is None or not 0 <= selected_option < len(options_indices):
+            selected_option = None
 
-        session[results_key].append({
-            'card_index': card_index,
-            'selected_option': selected_option,
-            'correct_option': question_payload['correct_option'],
-            'options': options_indices,
-            'is_correct': is_correct
-        })
+        # Odpowiedzi jako tekst: znak na pytanie - numer wybranej opcji lub '-' (brak wyboru)
+        answers = state['answers'][:question_index].ljust(question_index, '-')
+        state['answers'] = answers + ('-' if selected_option is None else str(selected_option))
+        session[f'test_{set_id}'] = state
         session.modified = True
 
         # Sprawdź czy to ostatnie pytanie
-        if question_index >= len(questions) - 1:
+        if question_index >= state['count'] - 1:
             # Ostatnie pytanie – pokaż podsumowanie testu
             return redirect(url_for('test.test_summary_route', set_id=set_id))
         else:
@@ -175,20 +131,20 @@ def test_question(set_id, question_index):
                          zestaw=zestaw,
                          question=question_payload,
                          question_index=question_index,
-                         total_questions=len(questions))
+                         total_questions=state['count'])
 
 
 @test.route('/<set_id>/test/summary')
 @login_required
 def test_summary_route(set_id):
-    store.reload_sets()
+    store.reload_sets(session['username'])
 
     def cleanup_test_session():
-        for key in [f'test_{set_id}_questions', f'test_{set_id}_current', f'test_{set_id}_results']:
+        for key in [f'test_{set_id}', f'test_{set_id}_questions', f'test_{set_id}_current', f'test_{set_id}_results']:
             session.pop(key, None)
 
     # Znajdź zestaw
-    zestaw = next((s for s in store.sets if s.get('id') == set_id), None)
+    zestaw = store.get_set(set_id)
     if not zestaw:
         cleanup_test_session()
         flash('Zestaw nie został znaleziony.', 'error')
@@ -199,46 +155,36 @@ def test_summary_route(set_id):
         flash('Nie masz dostępu do tego zestawu.', 'error')
         return redirect(url_for('dashboard.dashboard'))
 
-    # Pobierz wyniki z sesji
-    results = session.get(f'test_{set_id}_results', [])
+    # Pobierz odpowiedzi z sesji
+    state = session.get(f'test_{set_id}')
+    answers = state.get('answers') if isinstance(state, dict) else None
 
-    if not results:
+    if not answers:
         cleanup_test_session()
         flash('Brak wyników testu.', 'error')
         return redirect(url_for('sets.view_set', set_id=set_id))
 
-    # Odbuduj listę poprawnych kart, aby odczytać treść i odpowiedzi
-    valid_cards = get_valid_cards(zestaw)
+    # Poprawne karty (treść i odpowiedzi) z pamięci podręcznej - bez przeglądania kart w każdym żądaniu
+    valid_cards = store.valid_cards(zestaw)
+    if state.get('fp') != valid_cards.fingerprint:
+        cleanup_test_session()
+        flash('Nieprawidłowe dane testu. Spróbuj uruchomić test ponownie.', 'error')
+        return redirect(url_for('sets.view_set', set_id=set_id))
 
-    # Zbuduj wyniki do wyświetlenia
+    # Zbuduj wyniki do wyświetlenia (pytania odtwarzane z ziarna)
     display_results = []
-    for r in results:
-        card_index = r.get('card_index')
-        selected_option = r.get('selected_option')
-        correct_option = r.get('correct_option')
-        options_indices = r.get('options', [])
-        if card_index is None or card_index >= len(valid_cards):
-            continue
-        card = valid_cards[card_index]
-        question_text = card.get('tekst', '')
-        correct_answer = '—'
+    for question_index, answer in enumerate(answers[:state['count']]):
+        card_index, options_indices, correct_option = _question(state, question_index, len(valid_cards))
+        selected_option = int(answer) if answer.isdigit() else None
         user_answer = None
-
-        if isinstance(options_indices, list) and 0 <= correct_option < len(options_indices):
-            correct_idx = options_indices[correct_option]
-            if correct_idx is not None and correct_idx < len(valid_cards):
-                correct_answer = str(valid_cards[correct_idx].get('odpowiedz', '—'))
-
-        if isinstance(options_indices, list) and selected_option is not None and 0 <= selected_option < len(options_indices):
-            selected_idx = options_indices[selected_option]
-            if selected_idx is not None and selected_idx < len(valid_cards):
-                user_answer = str(valid_cards[selected_idx].get('odpowiedz', '—'))
+        if selected_option is not None and selected_option < len(options_indices):
+            user_answer = valid_cards.answers[options_indices[selected_option]]
 
         display_results.append({
-            'question': question_text,
-            'correct_answer': correct_answer,
+            'question': valid_cards.questions[card_index],
+            'correct_answer': valid_cards.answers[card_index],
             'user_answer': user_answer,
-            'is_correct': r.get('is_correct', False)
+            'is_correct': selected_option == correct_option
         })
 
     # Oblicz wynik
@@ -247,24 +193,27 @@ def test_summary_route(set_id):
     percentage = (correct_count / total * 100) if total > 0 else 0
 
     # Zapisz wynik do historii
-    if not isinstance(zestaw.get('historia_testow'), list):
-        zestaw['historia_testow'] = []
-
-    today = datetime.now(timezone.utc).date().isoformat()
-    zestaw['historia_testow'].append({
-        'data': today,
-        'timestamp': datetime.now(timezone.utc).isoformat(),
+    now_ts = datetime.now(timezone.utc)
+    entry = {
+        'data': now_ts.date().isoformat(),
+        'timestamp': now_ts.isoformat(),
         'poprawne': correct_count,
         'lacznie': total,
         'procent': round(percentage, 1)
-    })
+    }
+
+    def append_history(zestaw):
+        zestaw['historia_testow'].append(entry)
+        compact_history(zestaw, now_ts.date())
 
-    store.save_and_reload_sets()
+    saved = store.update_set(session['username'], set_id, append_history)
+    if saved is None:
+        flash('Nie udało się zapisać wyniku testu.', 'error')
+    else:
+        zestaw = saved
 
     # Wyczyść sesję testu
-    for key in [f'test_{set_id}_questions', f'test_{set_id}_current', f'test_{set_id}_results']:
-        if key in session:
-            del session[key]
+    cleanup_test_session()
     session.modified = True
 
     return render_template('test_summary.html',
@@ -274,3 +223,30 @@ def test_summary_route(set_id):
                          correct=correct_count,
                          total=total,
                          percentage=round(percentage, 1))
+
+
+def _question_card(state, question_index, num_valid):
+    """Indeks karty (w valid_cards) pytania testu - wszystkie karty po kolei albo element losowej próbki.
+
+    Próbka to pierwsze `count` pozycji permutacji wyznaczonej ziarnem, więc karta pytania
+    wynika wprost z ziarna i numeru pytania - bez losowania całej próbki w każdym żądaniu.
+    """
+    if state['count'] >= num_valid:
+        return question_index
+    return permuted_index(state['seed'], question_index, num_valid)
+
+
+def _question(state, question_index, num_valid):
+    """Pytanie testu odtworzone z ziarna: (indeks karty, indeksy opcji, numer poprawnej opcji).
+
+    Karta pytania, błędne odpowiedzi (do 3, z innych kart) i kolejność opcji zależą tylko
+    od ziarna testu i numeru pytania, więc każde pytanie można odtworzyć osobno,
+    bez generowania pozostałych.
+    """
+    correct_index = _question_card(state, question_index, num_valid)
+    rng = random.Random(f"{state['seed']}:{question_index}")
+    # Próbka z num_valid - 1 kart z pominięciem poprawnej (przesunięcie indeksów >= correct_index)
+    wrong_indices = [idx + (idx >= correct_index) for idx in rng.sample(range(num_valid - 1), min(3, num_valid - 1))]
+    options_indices = [correct_index] + wrong_indices
+    rng.shuffle(options_indices)
+    return correct_index, options_indices, options_indices.index(correct_index)
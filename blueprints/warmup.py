@@ -0,0 +1,22 @@
+import importlib
+import time
+
+from flask import Blueprint, jsonify
+
+import storage
+
+warmup = Blueprint('warmup', __name__)
+
+
+@warmup.route('/warmup')
+def warm_up():
+    """Pre-warm an instance (Cloud Run min-instances / startup probe): load the data store
+    and the heavy SDKs so the first user request doesn't pay for them."""
+    started = time.perf_counter()
+    importlib.import_module('pywebpush')
+    pywebpush_ms = round((time.perf_counter() - started) * 1000, 1)
+    return jsonify({
+        'ok': True,
+        'store_ms': storage.warm_up(),
+        'pywebpush_ms': pywebpush_ms,
+    })
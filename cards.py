@@ -0,0 +1,229 @@
+"""Model fiszki: Card i CardStats ze __slots__ zamiast słowników.
+
+Zestawy wczytywane ze storage mają w 'karty' listę obiektów Card; przy zapisie
+karty wracają do JSON przez to_dict(). Konwersja jest bezstratna: pola spoza
+modelu trafiają do `extra`, a to_dict() pomija statystyki, których nie było
+w danych źródłowych i które nadal mają wartość domyślną - niezmieniona karta
+zapisuje się dokładnie tak, jak została wczytana.
+"""
+import copy
+import hashlib
+import uuid
+
+# Statystyki karty i ich wartości domyślne (kolejność jak w zapisanym JSON)
+STATS_DEFAULTS = (
+    ('pokazane', 0),
+    ('rozumiem', 0),
+    ('nie_rozumiem', 0),
+    ('procent_sukcesu', 0),
+    ('streak_rozumiem', 0),
+    ('streak_nie_rozumiem', 0),
+    ('opanowana', False),
+    ('sessions_ok_streak', 0),
+    ('fail_streak_sessions', 0),
+    ('last_seen_date', None),
+    ('total_sessions_ok', 0),
+    ('next_due', None),
+    ('leech', False),
+    # Stan silnika SM-2 (srs.py); None - jeszcze nie wyznaczony
+    ('ease_factor', None),
+    ('interval_days', None),
+)
+STATS_FIELDS = tuple(name for name, _ in STATS_DEFAULTS)
+_STATS_FIELD_SET = frozenset(STATS_FIELDS)
+_ALL_PRESENT = (1 << len(STATS_DEFAULTS)) - 1
+
+
+class CardStats:
+    """Statystyki jednej karty. Brakujące pola mają wartości domyślne (jak dawne setdefault)."""
+
+    __slots__ = STATS_FIELDS + ('_present', 'extra')
+
+    def __init__(self):
+        for name, default in STATS_DEFAULTS:
+            setattr(self, name, default)
+        # Nowa karta zapisuje komplet pól (jak dawne make_default_stats)
+        self._present = _ALL_PRESENT
+        self.extra = None
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls.__new__(cls)
+        get = data.get
+        stats.pokazane = get('pokazane', 0)
+        stats.rozumiem = get('rozumiem', 0)
+        stats.nie_rozumiem = get('nie_rozumiem', 0)
+        stats.procent_sukcesu = get('procent_sukcesu', 0)
+        stats.streak_rozumiem = get('streak_rozumiem', 0)
+        stats.streak_nie_rozumiem = get('streak_nie_rozumiem', 0)
+        stats.opanowana = get('opanowana', False)
+        stats.sessions_ok_streak = get('sessions_ok_streak', 0)
+        stats.fail_streak_sessions = get('fail_streak_sessions', 0)
+        stats.last_seen_date = get('last_seen_date')
+        stats.total_sessions_ok = get('total_sessions_ok', 0)
+        stats.next_due = get('next_due')
+        stats.leech = get('leech', False)
+        stats.ease_factor = get('ease_factor')
+        stats.interval_days = get('interval_days')
+        if data.keys() == _STATS_FIELD_SET:
+            # Typowy przypadek: komplet pól, bez dodatkowych
+            stats._present = _ALL_PRESENT
+            stats.extra = None
+        else:
+            stats._present = sum(1 << bit for bit, name in enumerate(STATS_FIELDS) if name in data)
+            stats.extra = {key: value for key, value in data.items() if key not in _STATS_FIELD_SET} or None
+        return stats
+
+    def to_dict(self):
+        if self._present == _ALL_PRESENT:
+            data = {
+                'pokazane': self.pokazane,
+                'rozumiem': self.rozumiem,
+                'nie_rozumiem': self.nie_rozumiem,
+                'procent_sukcesu': self.procent_sukcesu,
+                'streak_rozumiem': self.streak_rozumiem,
+                'streak_nie_rozumiem': self.streak_nie_rozumiem,
+                'opanowana': self.opanowana,
+                'sessions_ok_streak': self.sessions_ok_streak,
+                'fail_streak_sessions': self.fail_streak_sessions,
+                'last_seen_date': self.last_seen_date,
+                'total_sessions_ok': self.total_sessions_ok,
+                'next_due': self.next_due,
+                'leech': self.leech,
+                'ease_factor': self.ease_factor,
+                'interval_days': self.interval_days,
+            }
+        else:
+            # Pola nieobecne w danych źródłowych zapisywane tylko, gdy zmieniły wartość
+            data = {}
+            for bit, (name, default) in enumerate(STATS_DEFAULTS):
+                value = getattr(self, name)
+                if self._present >> bit & 1 or value != default:
+                    data[name] = value
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def copy(self):
+        stats = CardStats.__new__(CardStats)
+        for name in STATS_FIELDS:
+            setattr(stats, name, getattr(self, name))
+        stats._present = self._present
+        stats.extra = copy.deepcopy(self.extra) if self.extra else None
+        return stats
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def __repr__(self):
+        return f"CardStats({self.to_dict()!r})"
+
+
+_CARD_KEYS = frozenset(('id', 'tekst', 'odpowiedz', 'statystyki'))
+
+
+def new_card_id():
+    """Losowy identyfikator nowej karty (unikalny w obrębie zestawu)."""
+    return uuid.uuid4().hex[:12]
+
+
+def derived_card_id(set_id, position):
+    """Identyfikator karty sprzed identyfikatorów - stały dla (zestaw, pozycja), aż zostanie zapisany."""
+    return hashlib.sha1(f'{set_id}:{position}'.encode()).hexdigest()[:12]
+
+
+class Card:
+    """Fiszka: stały identyfikator, pytanie, odpowiedź i statystyki (zawsze obecne jako CardStats)."""
+
+    __slots__ = ('id', 'tekst', 'odpowiedz', 'statystyki', '_has_stats', 'extra')
+
+    def __init__(self, tekst='', odpowiedz='', statystyki=None, card_id=None):
+        self.id = card_id or new_card_id()
+        self.tekst = tekst
+        self.odpowiedz = odpowiedz
+        self.statystyki = statystyki if statystyki is not None else CardStats()
+        self._has_stats = True
+        self.extra = None
+
+    @classmethod
+    def from_dict(cls, data):
+        card = cls.__new__(cls)
+        card.id = data.get('id')
+        card.tekst = data.get('tekst', '')
+        card.odpowiedz = data.get('odpowiedz', '')
+        raw_stats = data.get('statystyki')
+        card._has_stats = isinstance(raw_stats, dict)
+        card.statystyki = CardStats.from_dict(raw_stats if card._has_stats else {})
+        extra = None
+        if not data.keys() <= _CARD_KEYS:
+            extra = {key: value for key, value in data.items() if key not in _CARD_KEYS}
+        card.extra = extra or None
+        return card
+
+    def to_dict(self):
+        data = {'tekst': self.tekst, 'odpowiedz': self.odpowiedz}
+        if self.id is not None:
+            data['id'] = self.id
+        stats = self.statystyki.to_dict()
+        if stats or self._has_stats:
+            data['statystyki'] = stats
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def complete(self):
+        """Zapisuj komplet statystyk (także domyślnych) - rekord w bieżącej wersji schematu."""
+        self._has_stats = True
+        self.statystyki._present = _ALL_PRESENT
+
+    def test_pair(self):
+        """Przycięte (pytanie, odpowiedź) karty nadającej się do testu albo None, gdy któreś jest puste."""
+        question = str(self.tekst or '').strip()
+        answer = str(self.odpowiedz or '').strip()
+        if question and answer:
+            return question, answer
+        return None
+
+    def copy(self):
+        card = Card.__new__(Card)
+        card.id = self.id
+        card.tekst = self.tekst
+        card.odpowiedz = self.odpowiedz
+        card.statystyki = self.statystyki.copy()
+        card._has_stats = self._has_stats
+        card.extra = copy.deepcopy(self.extra) if self.extra else None
+        return card
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def __repr__(self):
+        return f"Card({self.tekst!r}, {self.odpowiedz!r})"
+
+
+def cards_from_json(karty):
+    """Lista kart z JSON -> lista Card; elementy niebędące słownikami są pomijane."""
+    result = []
+    for item in karty:
+        if isinstance(item, Card):
+            result.append(item)
+        elif isinstance(item, dict):
+            result.append(Card.from_dict(item))
+        else:
+            print(f"OSTRZEŻENIE: Nieprawidłowy format karty: {type(item)} - {item}")
+    return result
+
+
+def load_set_cards(zestaw):
+    """Zamień karty zestawu (wczytanego z JSON/bazy) na obiekty Card, w miejscu."""
+    karty = zestaw.get('karty')
+    if isinstance(karty, list):
+        zestaw['karty'] = cards_from_json(karty)
+    return zestaw
+
+
+def card_to_json(value):
+    """`default` dla json.dumps: Card/CardStats -> słownik."""
+    if isinstance(value, (Card, CardStats)):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
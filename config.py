@@ -1,4 +1,5 @@
 from cryptography.fernet import Fernet
+import hashlib
 import os
 
 
@@ -7,12 +8,62 @@ SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-change-this-in-produc
 ENCRYPTION_KEY = os.environ.get('ENCRYPTION_KEY', '').encode()
 cipher = Fernet(ENCRYPTION_KEY)
 
-USERS_FILE = 'users.json'
-SETS_FILE = 'sets.json'
+USERS_FILE = 'users.json'  # stary plik z całą listą użytkowników - tylko źródło jednorazowej migracji
+USERS_DIR = 'users'  # lokalny katalog z szyfrowanymi rekordami użytkowników (jeden plik na konto)
+SETS_FILE = 'sets.json'  # stary monolityczny plik - tylko źródło jednorazowej migracji
+SETS_DIR = 'sets'  # lokalny katalog z shardami zestawów (jeden plik na autora)
 
 BUCKET_NAME = os.environ.get("USERS_BUCKET_NAME", "python-fiszki-users")
 USERS_FILE_NAME = "users.json"
 SETS_FILE_NAME = "sets.json"
+SETS_PREFIX = "sets/"  # prefiks blobów z shardami zestawów w GCS
+USERS_PREFIX = "users/"  # prefiks blobów z rekordami użytkowników w GCS
+
+# Klucz HMAC do nazw rekordów użytkowników (domyślnie wyprowadzony z ENCRYPTION_KEY).
+# Zmiana klucza "gubi" istniejące rekordy - nazwy przestają pasować do loginów.
+LOGIN_HASH_KEY = (
+    os.environ.get('LOGIN_HASH_KEY', '').encode()
+    or hashlib.sha256(b'madra-nauka/user-record:' + ENCRYPTION_KEY).digest()
+)
+
+# Limity cache sparsowanych snapshotów (per worker): liczba wpisów i suma rozmiarów surowych danych
+SNAPSHOT_CACHE_MAX_ENTRIES = int(os.environ.get('SNAPSHOT_CACHE_MAX_ENTRIES', '256'))
+SNAPSHOT_CACHE_MAX_BYTES = int(os.environ.get('SNAPSHOT_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# Pliki/bloby z zestawami od tego rozmiaru są parsowane strumieniowo (zestaw po zestawie),
+# bez trzymania w pamięci naraz surowych bajtów, tekstu i całego drzewa obiektów
+STREAM_LOAD_MIN_BYTES = int(os.environ.get('STREAM_LOAD_MIN_BYTES', str(1024 * 1024)))
+
+# Liczba fiszek w jednej porcji trybu nauki (HTML zawiera pierwszą porcję, kolejne pobiera klient)
+LEARN_CHUNK_SIZE = max(1, int(os.environ.get('LEARN_CHUNK_SIZE', '50')))
+
+# Sesja nauki zsynchronizowana później (offline) liczy się do swojego dnia najwyżej tyle dni wstecz
+LEARN_SYNC_MAX_AGE_DAYS = max(0, int(os.environ.get('LEARN_SYNC_MAX_AGE_DAYS', '7')))
+
+# Historia nauki/testów starsza niż tyle dni jest zwijana do agregatów dziennych (0 = wyłączone)
+HISTORY_HOT_DAYS = int(os.environ.get('HISTORY_HOT_DAYS', '90'))
+
+# Ponawianie zapisów po konflikcie generacji (mutacja nakładana na świeży snapshot)
+WRITE_MAX_RETRIES = int(os.environ.get('WRITE_MAX_RETRIES', '5'))
+WRITE_BACKOFF_BASE = float(os.environ.get('WRITE_BACKOFF_BASE', '0.05'))  # sekundy
+
+# Write-behind: zapis zestawów w wątku w tle, mutacje z okna łączone w jeden upload na shard
+WRITE_BEHIND = os.environ.get('WRITE_BEHIND', 'false').lower() == 'true'
+WRITE_BEHIND_INTERVAL_MS = int(os.environ.get('WRITE_BEHIND_INTERVAL_MS', '500'))
+
+# Watcher generacji: wątek w tle odświeżający wczytane shardy co interwał (0 = wyłączony).
+# Widoki tylko do odczytu (dashboard, podgląd zestawu, profil) czytają wtedy z pamięci.
+SNAPSHOT_WATCH_INTERVAL_MS = int(os.environ.get('SNAPSHOT_WATCH_INTERVAL_MS', '0'))
+
+# Format zapisu plików/blobów JSON: 'json' (stary, z wcięciami), 'compact', 'gzip' lub 'zstd' (wymaga pakietu zstandard)
+STORAGE_FORMAT = os.environ.get('STORAGE_FORMAT', 'json').lower()
+
+# Endpoint /warmup do rozgrzewania instancji (Cloud Run min-instances, startup probe)
+WARMUP_ENABLED = os.environ.get('WARMUP_ENABLED', 'false').lower() == 'true'
+
+# Backend danych: 'json' (pliki lokalne lub GCS, patrz USE_CLOUD_STORAGE) albo 'sqlite'
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'json').lower()
+SQLITE_PATH = os.environ.get('SQLITE_PATH', 'madra_nauka.db')
 
 # Sprawdź czy używać Cloud Storage (produkcja) czy lokalnych plików (development)
 USE_CLOUD_STORAGE = os.environ.get("USE_CLOUD_STORAGE", "false").lower() == "true"
@@ -0,0 +1,169 @@
+"""Indeks terminów powtórek autora: karty i zestawy do powtórki bez skanowania wszystkich kart.
+
+Indeks jest budowany leniwie dla opublikowanego snapshotu sharda (DataStore.due_index)
+i trzymany do czasu publikacji nowego. Snapshoty są copy-on-write - zestaw, którego
+mutacja nie dotknęła, jest w nowym snapshocie tym samym obiektem - więc nowy indeks
+przelicza tylko zmienione zestawy, a wpisy pozostałych przejmuje z poprzedniego.
+
+Daty są trzymane jako posortowane ciągi ISO (porównanie tekstowe = porównanie dat),
+parsowane raz przy budowie wpisu zestawu, a nie w każdym żądaniu. Zapytania
+(bisect po datach) nie zależą od łącznej liczby kart:
+
+- review_cards(set_id, today) - karty trybu powtórki zestawu,
+- cards_due(set_id, today)    - karty z next_due <= dziś,
+- sets_due(today)             - zestawy do powtórki dziś (termin minął lub zestaw nowy),
+- due_counts(today, days)     - liczba kart do powtórki w kolejnych dniach.
+"""
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from history import has_activity
+
+# Opanowana karta niewidziana dłużej niż tyle dni wraca do trybu powtórki
+REVIEW_INACTIVE_DAYS = 14
+
+
+def _iso_date(value):
+    """Data ISO (YYYY-MM-DD) z daty/znacznika czasu lub None dla pustych i błędnych wartości."""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).date().isoformat()
+    except (TypeError, ValueError):
+        return None
+
+
+def _sorted_columns(pairs):
+    """[(data, indeks)] -> (posortowane daty, indeksy w tej samej kolejności)."""
+    pairs.sort()
+    return [day for day, _ in pairs], [i for _, i in pairs]
+
+
+class SetDue:
+    """Terminy jednego zestawu, wyliczone raz dla danego obiektu zestawu."""
+
+    __slots__ = ('zestaw', 'due_days', 'due_cards', 'weak', 'mastered_due_days', 'mastered_due_cards',
+                 'mastered_seen_days', 'mastered_seen_cards', 'day_counts')
+
+    def __init__(self, zestaw):
+        self.zestaw = zestaw
+        due = []            # (next_due, indeks) wszystkich kart z terminem
+        weak = []           # nieopanowane i (pokazane < 3 lub sukces < 70%)
+        mastered_due = []   # (next_due, indeks) kart opanowanych
+        mastered_seen = []  # (last_seen_date, indeks) kart opanowanych
+        day_counts = {}
+        for i, karta in enumerate(zestaw['karty']):
+            stats = karta.statystyki
+            next_due = _iso_date(stats.next_due)
+            if next_due:
+                due.append((next_due, i))
+                day_counts[next_due] = day_counts.get(next_due, 0) + 1
+            if stats.opanowana:
+                if next_due:
+                    mastered_due.append((next_due, i))
+                last_seen = _iso_date(stats.last_seen_date)
+                if last_seen:
+                    mastered_seen.append((last_seen, i))
+            elif stats.pokazane < 3 or stats.procent_sukcesu < 70:
+                weak.append(i)
+        self.due_days, self.due_cards = _sorted_columns(due)
+        self.mastered_due_days, self.mastered_due_cards = _sorted_columns(mastered_due)
+        self.mastered_seen_days, self.mastered_seen_cards = _sorted_columns(mastered_seen)
+        self.weak = weak
+        self.day_counts = day_counts
+
+
+class DueIndex:
+    """Indeks terminów wszystkich zestawów jednego snapshotu sharda."""
+
+    def __init__(self, sets_data, previous=None):
+        self.sets_data = sets_data
+        reuse = {}
+        if previous is not None:
+            reuse = {id(entry.zestaw): entry for entry in previous.by_set.values()}
+        self.by_set = {}
+        day_counts = {}
+        review_dates = []
+        new_sets = []
+        for zestaw in sets_data:
+            entry = reuse.get(id(zestaw))
+            if entry is None or entry.zestaw is not zestaw:
+                entry = SetDue(zestaw)
+            set_id = zestaw.get('id')
+            self.by_set[set_id] = entry
+            for day, count in entry.day_counts.items():
+                day_counts[day] = day_counts.get(day, 0) + count
+            next_review = _iso_date(zestaw.get('next_review_date'))
+            if next_review:
+                review_dates.append((next_review, set_id))
+            if not has_activity(zestaw):
+                new_sets.append(set_id)
+        self._review_days, self._review_sets = _sorted_columns(review_dates)
+        self._new_sets = new_sets
+        self._days = sorted(day_counts)
+        self._day_counts = day_counts
+        self._cumulative = list(accumulate(day_counts[day] for day in self._days))
+
+    def cards_due(self, set_id, today):
+        """Indeksy kart zestawu z terminem next_due <= today (rosnąco)."""
+        entry = self.by_set.get(set_id)
+        if entry is None:
+            return []
+        return sorted(entry.due_cards[:bisect_right(entry.due_days, today.isoformat())])
+
+    def review_cards(self, set_id, today):
+        """Indeksy kart trybu powtórki (rosnąco): nieopanowane słabe oraz opanowane,
+        których termin minął lub niewidziane dłużej niż REVIEW_INACTIVE_DAYS dni."""
+        entry = self.by_set.get(set_id)
+        if entry is None:
+            return []
+        result = set(entry.weak)
+        result.update(entry.mastered_due_cards[:bisect_right(entry.mastered_due_days, today.isoformat())])
+        cutoff = (today - timedelta(days=REVIEW_INACTIVE_DAYS)).isoformat()
+        result.update(entry.mastered_seen_cards[:bisect_left(entry.mastered_seen_days, cutoff)])
+        return sorted(result)
+
+    def sets_due(self, today):
+        """Id zestawów do powtórki dziś: termin zestawu <= today lub zestaw bez aktywności."""
+        due = set(self._review_sets[:bisect_right(self._review_days, today.isoformat())])
+        due.update(self._new_sets)
+        return [zestaw.get('id') for zestaw in self.sets_data if zestaw.get('id') in due]
+
+    def due_counts(self, today, days):
+        """Liczba kart do powtórki w kolejnych `days` dniach; pierwszy element obejmuje też zaległe."""
+        if days <= 0:
+            return []
+        end = bisect_right(self._days, today.isoformat())
+        counts = [self._cumulative[end - 1] if end else 0]
+        for offset in range(1, days):
+            counts.append(self._day_counts.get((today + timedelta(days=offset)).isoformat(), 0))
+        return counts
+
+
+class DueIndexes:
+    """autor -> DueIndex ostatnio pytanego snapshotu (wspólne dla wątków workera)."""
+
+    def __init__(self):
+        self._by_author = {}
+        self._lock = threading.Lock()
+
+    def get(self, author, sets_data):
+        with self._lock:
+            index = self._by_author.get(author)
+        if index is not None and index.sets_data is sets_data:
+            return index
+        # Budowa poza blokadą; równoległe budowy tego samego snapshotu dają ten sam wynik
+        index = DueIndex(sets_data, previous=index)
+        with self._lock:
+            self._by_author[author] = index
+        return index
+
+    def drop(self, author):
+        with self._lock:
+            self._by_author.pop(author, None)
+
+    def clear(self):
+        with self._lock:
+            self._by_author.clear()
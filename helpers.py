@@ -2,6 +2,8 @@ from functools import wraps
 from datetime import datetime, timezone, timedelta
 from flask import session, redirect, url_for, flash
 
+from history import learn_days, test_dates
+
 
 # ---------------------------------------------------------------------------
 # Constants
@@ -32,7 +34,7 @@ def login_required(f):
 
 def find_user_set(store, set_id):
     """Return (zestaw, None) on success or (None, redirect_response) on failure."""
-    zestaw = next((s for s in store.sets if s.get('id') == set_id), None)
+    zestaw = store.get_set(set_id)
     if not zestaw:
         flash('Zestaw nie został znaleziony.', 'error')
         return None, redirect(url_for('dashboard.dashboard'))
@@ -43,40 +45,7 @@ def find_user_set(store, set_id):
 
 
 # ---------------------------------------------------------------------------
-# 3. make_default_stats – 13-key default card statistics dict
-# ---------------------------------------------------------------------------
-
-def make_default_stats():
-    return {
-        'pokazane': 0,
-        'rozumiem': 0,
-        'nie_rozumiem': 0,
-        'procent_sukcesu': 0,
-        'streak_rozumiem': 0,
-        'streak_nie_rozumiem': 0,
-        'opanowana': False,
-        'sessions_ok_streak': 0,
-        'fail_streak_sessions': 0,
-        'last_seen_date': None,
-        'total_sessions_ok': 0,
-        'next_due': None,
-        'leech': False
-    }
-
-
-# ---------------------------------------------------------------------------
-# 4. ensure_card_stats – fill missing stats keys with defaults
-# ---------------------------------------------------------------------------
-
-def ensure_card_stats(karta):
-    stats = karta.setdefault('statystyki', {})
-    for key, default in make_default_stats().items():
-        stats.setdefault(key, default)
-    return stats
-
-
-# ---------------------------------------------------------------------------
-# 5. compute_next_review_date – review date scheduling
+# 3. compute_next_review_date – review date scheduling
 # ---------------------------------------------------------------------------
 
 def compute_next_review_date(completed_count, base_date):
@@ -96,7 +65,7 @@ def compute_next_review_date(completed_count, base_date):
 
 
 # ---------------------------------------------------------------------------
-# 6. compute_streak – consecutive-day activity streak
+# 4. compute_streak – consecutive-day activity streak
 # ---------------------------------------------------------------------------
 
 def compute_streak(activity_dates):
@@ -113,26 +82,20 @@ def compute_streak(activity_dates):
 
 
 # ---------------------------------------------------------------------------
-# 7. collect_activity_dates – unique activity dates across all user sets
+# 5. collect_activity_dates – unique activity dates across all user sets
 # ---------------------------------------------------------------------------
 
 def collect_activity_dates(user_sets):
     """Gather unique ISO date strings from all sets' learning and test history."""
     activity_dates = set()
     for zestaw in user_sets:
-        for wpis in zestaw.get('historia_nauki', []) or []:
-            data = wpis.get('data')
-            if data:
-                activity_dates.add(data)
-        for wpis in zestaw.get('historia_testow', []) or []:
-            data = wpis.get('data')
-            if data:
-                activity_dates.add(data)
+        activity_dates.update(data for data, _ in learn_days(zestaw))
+        activity_dates.update(test_dates(zestaw))
     return activity_dates
 
 
 # ---------------------------------------------------------------------------
-# 8. build_month_grid – calendar grid for the current month
+# 6. build_month_grid – calendar grid for the current month
 # ---------------------------------------------------------------------------
 
 def build_month_grid(activity_dates, streak_dates):
@@ -168,14 +131,3 @@ def build_month_grid(activity_dates, streak_dates):
     month_rows = [month_grid[i:i + 7] for i in range(0, len(month_grid), 7)]
     month_name_pl = POLISH_MONTHS[month - 1]
     return month_rows, month_name_pl, year
-
-
-# ---------------------------------------------------------------------------
-# 10. get_valid_cards – cards with non-empty tekst and odpowiedz
-# ---------------------------------------------------------------------------
-
-def get_valid_cards(zestaw):
-    return [
-        k for k in zestaw.get('karty', [])
-        if k.get('tekst', '').strip() and k.get('odpowiedz', '').strip()
-    ]
@@ -0,0 +1,91 @@
+"""Historia nauki i testów: świeże wpisy + dzienne agregaty starszych dni.
+
+Każda sesja nauki/testu dopisuje wpis do zestawu, więc bez kompaktowania listy rosłyby
+bez końca (a shard jest pobierany i zapisywany w całości). compact_history przenosi
+wpisy starsze niż HISTORY_HOT_DAYS do agregatów per dzień:
+
+- historia_nauki_dni:    {"YYYY-MM-DD": [sesje, zrozumiane, niezrozumiane]}
+- historia_testow_dni:   {"YYYY-MM-DD": [testy, poprawne, lacznie]}
+- dni_ukonczone_archiwum: liczba przeniesionych dni z days_completed
+
+Kalendarz, heatmapa, streak i rankingi liczone są z dni i liczby sesji, więc po
+kompaktowaniu dają te same wyniki - pod warunkiem, że czytają historię przez funkcje
+poniżej, a nie bezpośrednio z list.
+"""
+from datetime import timedelta
+
+from config import HISTORY_HOT_DAYS
+
+
+def _fold(entries, rollup, cutoff, fields):
+    """Przenieś wpisy sprzed cutoff do rollup; zwraca (świeże wpisy, czy coś przeniesiono)."""
+    hot = []
+    for wpis in entries:
+        data = wpis.get('data') if isinstance(wpis, dict) else None
+        if not data or data >= cutoff:
+            hot.append(wpis)
+            continue
+        day = rollup.setdefault(data, [0] * (len(fields) + 1))
+        day[0] += 1
+        for i, field in enumerate(fields, start=1):
+            value = wpis.get(field)
+            if isinstance(value, (int, float)):
+                day[i] += value
+    return hot, len(hot) != len(entries)
+
+
+def compact_history(zestaw, today, hot_days=None):
+    """Przenieś historię starszą niż hot_days dni do agregatów dziennych (w miejscu).
+
+    Zwraca True, jeśli zestaw się zmienił. hot_days <= 0 wyłącza kompaktowanie.
+    """
+    hot_days = HISTORY_HOT_DAYS if hot_days is None else hot_days
+    if hot_days <= 0:
+        return False
+    cutoff = (today - timedelta(days=hot_days)).isoformat()
+
+    zestaw['historia_nauki'], learn_changed = _fold(
+        zestaw['historia_nauki'], zestaw['historia_nauki_dni'], cutoff, ('zrozumiane', 'niezrozumiane'))
+    zestaw['historia_testow'], test_changed = _fold(
+        zestaw['historia_testow'], zestaw['historia_testow_dni'], cutoff, ('poprawne', 'lacznie'))
+
+    cold_days = {d for d in zestaw['days_completed'] if d < cutoff}
+    if cold_days:
+        zestaw['days_completed'] = [d for d in zestaw['days_completed'] if d >= cutoff]
+        zestaw['dni_ukonczone_archiwum'] += len(cold_days)
+    return learn_changed or test_changed or bool(cold_days)
+
+
+def learn_days(zestaw):
+    """Pary (data, liczba sesji nauki) - agregaty dzienne i świeże wpisy (data może się powtarzać)."""
+    for data, day in zestaw['historia_nauki_dni'].items():
+        yield data, day[0]
+    for wpis in zestaw['historia_nauki']:
+        data = wpis.get('data')
+        if data:
+            yield data, 1
+
+
+def test_dates(zestaw):
+    """Daty testów (agregaty dzienne i świeże wpisy)."""
+    yield from zestaw['historia_testow_dni']
+    for wpis in zestaw['historia_testow']:
+        data = wpis.get('data')
+        if data:
+            yield data
+
+
+def learn_session_count(zestaw):
+    """Liczba wszystkich sesji nauki zestawu."""
+    return sum(day[0] for day in zestaw['historia_nauki_dni'].values()) + len(zestaw['historia_nauki'])
+
+
+def completed_day_count(zestaw):
+    """Liczba różnych dni, w których zestaw został ukończony."""
+    return zestaw['dni_ukonczone_archiwum'] + len(set(zestaw['days_completed']))
+
+
+def has_activity(zestaw):
+    """Czy zestaw był kiedykolwiek uczony lub ukończony (zestaw bez aktywności jest 'nowy')."""
+    return bool(zestaw['days_completed'] or zestaw['dni_ukonczone_archiwum']
+                or zestaw['historia_nauki'] or zestaw['historia_nauki_dni'])
@@ -0,0 +1,123 @@
+"""Wersjonowany schemat zestawów: normalizacja raz przy wczytaniu snapshotu.
+
+Shard jest zapisywany jako {"schema_version": SCHEMA_VERSION, "sets": [...]}. Dokument
+w starszej wersji (bez pola schema_version - wersja 0) przechodzi przy wczytaniu kolejne
+kroki MIGRATIONS, a przy najbliższym zapisie trafia na dysk/GCS już w bieżącej wersji.
+Zestawy w pamięci mają więc zawsze komplet pól i widoki nie uzupełniają ich w każdym
+żądaniu. Kroki muszą być idempotentne (dokument może zostać zmigrowany ponownie).
+
+Jednorazowa migracja wszystkich shardów (backend JSON, lokalnie lub GCS), razem
+z kompaktowaniem starej historii (history.compact_history):
+
+    python schema.py migrate
+"""
+import argparse
+from datetime import datetime, timezone
+
+from cards import derived_card_id, load_set_cards
+from history import compact_history
+from srs import ensure_state
+
+SCHEMA_VERSION = 4
+
+# Pola zestawu będące listami - po migracji zawsze obecne
+SET_LIST_FIELDS = ('karty', 'historia_nauki', 'historia_testow', 'days_completed')
+
+
+def _v1_complete_records(zestaw):
+    """v0 -> v1: komplet pól zestawu i statystyk kart, bez błędnej daty powtórki."""
+    for key in SET_LIST_FIELDS:
+        if not isinstance(zestaw.get(key), list):
+            zestaw[key] = []
+    # Nowy zestaw bez żadnej aktywności nie ma jeszcze terminu powtórki (historia zwinięta
+    # do agregatów dziennych to też aktywność - listy mogą być wtedy puste)
+    active = (zestaw['days_completed'] or zestaw['historia_nauki']
+              or zestaw.get('historia_nauki_dni') or zestaw.get('dni_ukonczone_archiwum'))
+    if not zestaw.get('next_review_date') or not active:
+        zestaw['next_review_date'] = None
+    for karta in zestaw['karty']:
+        karta.complete()
+
+
+def _v2_history_rollups(zestaw):
+    """v1 -> v2: puste agregaty dzienne starszej historii (patrz history.py)."""
+    for key in ('historia_nauki_dni', 'historia_testow_dni'):
+        if not isinstance(zestaw.get(key), dict):
+            zestaw[key] = {}
+    if not isinstance(zestaw.get('dni_ukonczone_archiwum'), int):
+        zestaw['dni_ukonczone_archiwum'] = 0
+
+
+def _v3_srs_state(zestaw):
+    """v2 -> v3: stan SM-2 kart (łatwość, odstęp) wyprowadzony z dotychczasowych statystyk."""
+    for karta in zestaw['karty']:
+        ensure_state(karta.statystyki)
+        karta.complete()
+
+
+def _v4_card_ids(zestaw):
+    """v3 -> v4: stałe identyfikatory kart i dziennik zsynchronizowanych sesji nauki."""
+    seen = set()
+    for position, karta in enumerate(zestaw['karty']):
+        if not karta.id or karta.id in seen:
+            karta.id = derived_card_id(zestaw.get('id'), position)
+        seen.add(karta.id)
+    if not isinstance(zestaw.get('sesje_zsynchronizowane'), list):
+        zestaw['sesje_zsynchronizowane'] = []
+
+
+# (wersja docelowa, krok) - w kolejności rosnących wersji
+MIGRATIONS = (
+    (1, _v1_complete_records),
+    (2, _v2_history_rollups),
+    (3, _v3_srs_state),
+    (4, _v4_card_ids),
+)
+
+
+def normalize_set(zestaw, version=0):
+    """Karty -> obiekty Card i migracje od `version` do SCHEMA_VERSION, w miejscu."""
+    load_set_cards(zestaw)
+    for target, step in MIGRATIONS:
+        if version < target:
+            step(zestaw)
+    return zestaw
+
+
+def document_version(document):
+    """Wersja schematu dokumentu sharda (0 dla starych dokumentów i samej listy)."""
+    if isinstance(document, dict):
+        version = document.get('schema_version', 0)
+        if isinstance(version, int):
+            return version
+    return 0
+
+
+def _compact_all(sets_data):
+    """Mutacja dla update_sets: kompaktowanie historii wszystkich zestawów sharda."""
+    today = datetime.now(timezone.utc).date()
+    for set_id in [zestaw.get('id') for zestaw in sets_data]:
+        compact_history(sets_data.edit(set_id), today)
+    return True
+
+
+def migrate_all():
+    """Przepisz wszystkie shardy backendu JSON w bieżącej wersji schematu (ze skompaktowaną historią)."""
+    import storage
+
+    storage.migrate_legacy_sets()
+    authors = storage.list_set_authors()
+    # Zawsze backend JSON (dokumenty z wersją), niezależnie od STORAGE_BACKEND
+    store = storage.DataStore()
+    failed = [author for author in authors if not store.update_sets(author, _compact_all)]
+    store.shutdown()
+    print(f"Zapisano {len(authors) - len(failed)} shardów w wersji schematu {SCHEMA_VERSION}")
+    if failed:
+        print(f"OSTRZEŻENIE: Nie udało się zapisać shardów: {', '.join(failed)}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Migracje schematu zestawów.')
+    parser.add_argument('command', choices=['migrate'], help='migrate: zapisz wszystkie shardy w bieżącej wersji')
+    parser.parse_args()
+    migrate_all()
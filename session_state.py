@@ -0,0 +1,85 @@
+"""Zwarty stan sesji nauki/testu w ciasteczku sesji Flaska.
+
+Zamiast list kolejności i wyników sesja trzyma ziarno RNG, z którego kolejność jest
+odtwarzana deterministycznie, odcisk zestawu kart (wykrycie zmian zestawu w trakcie
+sesji) i wyniki jako spakowane bitsety. Ziarno i odcisk mają stały rozmiar, ale bitset
+ma bit na każdy indeks karty: zamiast list O(N) elementów stan zajmuje O(N/8) bajtów
+(w base64 ok. N/6 znaków na bitset). Ciasteczko sesji Flaska mieści ok. 4 KB, więc
+dwa bitsety nauki zbliżają się do limitu przy ok. 10 000 kart w zestawie.
+"""
+import base64
+import random
+import zlib
+
+
+def new_seed():
+    """Nowe, niezerowe ziarno sesji (0 oznacza kolejność bez losowania)."""
+    return random.getrandbits(31) or 1
+
+
+def shuffled(order, seed):
+    """Kopia `order` przetasowana deterministycznie ziarnem; seed 0 - bez zmian kolejności."""
+    order = list(order)
+    if seed:
+        random.Random(seed).shuffle(order)
+    return order
+
+
+_MASK64 = (1 << 64) - 1
+
+
+def _mix(seed, round_no, value):
+    """Funkcja rundy permutacji: mieszanie 64-bitowe (splitmix64) ziarna, numeru rundy i wartości."""
+    x = (seed * 0x9E3779B97F4A7C15 + round_no * 0xD1B54A32D192ED03 + value) & _MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return x ^ (x >> 31)
+
+
+def permuted_index(seed, index, size):
+    """Element `index` deterministycznej permutacji range(size) wyznaczonej ziarnem.
+
+    Pozwala wziąć i-ty element losowej próbki bez budowania całej permutacji: sieć
+    Feistela na najmniejszej parzystej liczbie bitów obejmującej `size`, a wyniki
+    spoza zakresu są permutowane ponownie (cycle walking, średnio < 4 kroki).
+    Różne indeksy dają różne elementy, więc pierwsze k indeksów to próbka bez powtórzeń.
+    """
+    half_bits = max(1, ((size - 1).bit_length() + 1) // 2)
+    mask = (1 << half_bits) - 1
+    value = index
+    while True:
+        left, right = value >> half_bits, value & mask
+        for round_no in range(4):
+            left, right = right, left ^ (_mix(seed, round_no, right) & mask)
+        value = (left << half_bits) | right
+        if value < size:
+            return value
+
+
+def fingerprint(card_ids):
+    """Krótki odcisk listy identyfikatorów kart (zmiana zestawu = inny odcisk)."""
+    return format(zlib.crc32('\n'.join(card_ids).encode('utf-8')), '08x')
+
+
+def bits_to_str(value):
+    """Bitset (int) -> tekst base64 do sesji; pusty bitset to ''."""
+    if not value:
+        return ''
+    raw = value.to_bytes((value.bit_length() + 7) // 8, 'little')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def bits_from_str(text):
+    """Tekst z bits_to_str -> bitset (int); błędne wartości dają pusty bitset."""
+    if not text or not isinstance(text, str):
+        return 0
+    try:
+        raw = base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+    except (ValueError, TypeError):
+        return 0
+    return int.from_bytes(raw, 'little')
+
+
+def bit(value, index):
+    """Czy bit `index` bitsetu jest ustawiony."""
+    return bool(value >> index & 1)
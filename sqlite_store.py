@@ -0,0 +1,831 @@
+"""Backend SQLite dla warstwy danych (STORAGE_BACKEND=sqlite).
+
+Te same rekordy co w plikach JSON, ale w znormalizowanych tabelach: users, sets, cards,
+card_stats, learn_history i test_history. Baza działa w trybie WAL (odczyty z wielu
+workerów Gunicorna nie blokują zapisu), a każda mutacja wykonuje się w transakcji
+BEGIN IMMEDIATE na aktualnych danych (snapshot w pamięci, jeśli jego wersja zgadza się
+z tabelą shard_versions). Zamiast przepisywać cały dokument, zapisywane są tylko
+zmienione wiersze - np. statystyki jednej karty to jeden UPDATE.
+
+`SqliteDataStore` ma ten sam interfejs co `storage.DataStore`, więc blueprinty
+korzystają z niego przez `storage.store` bez zmian.
+
+Import danych z backendu JSON (users.json + shardy sets/<login>.json):
+    python sqlite_store.py import [--db ścieżka]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import storage
+from cards import Card
+from config import SQLITE_PATH
+from due_index import DueIndexes
+from schema import SCHEMA_VERSION as SET_SCHEMA_VERSION, normalize_set
+from storage import RequestSnapshots, ShardDraft
+from valid_cards import ValidCardsCache
+
+
+# Wersja układu tabel (PRAGMA user_version); kroki DB_MIGRATIONS niżej
+SCHEMA_VERSION = 4
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    login TEXT PRIMARY KEY,
+    haslo TEXT,
+    data_utworzenia TEXT,
+    extra TEXT
+);
+
+CREATE TABLE IF NOT EXISTS sets (
+    id TEXT PRIMARY KEY,
+    autor TEXT NOT NULL,
+    pozycja INTEGER NOT NULL,
+    nazwa TEXT,
+    data_utworzenia TEXT,
+    data_ostatniej_nauki TEXT,
+    next_review_date TEXT,
+    days_completed TEXT,
+    ostatnie_wyniki TEXT,
+    extra TEXT,
+    schema_version INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_sets_autor ON sets (autor, pozycja);
+
+CREATE TABLE IF NOT EXISTS cards (
+    set_id TEXT NOT NULL REFERENCES sets (id) ON DELETE CASCADE,
+    pozycja INTEGER NOT NULL,
+    tekst TEXT,
+    odpowiedz TEXT,
+    extra TEXT,
+    id TEXT,
+    PRIMARY KEY (set_id, pozycja)
+);
+
+CREATE TABLE IF NOT EXISTS card_stats (
+    set_id TEXT NOT NULL,
+    pozycja INTEGER NOT NULL,
+    pokazane NUMERIC,
+    rozumiem NUMERIC,
+    nie_rozumiem NUMERIC,
+    procent_sukcesu NUMERIC,
+    streak_rozumiem NUMERIC,
+    streak_nie_rozumiem NUMERIC,
+    opanowana NUMERIC,
+    sessions_ok_streak NUMERIC,
+    fail_streak_sessions NUMERIC,
+    last_seen_date TEXT,
+    total_sessions_ok NUMERIC,
+    next_due TEXT,
+    leech NUMERIC,
+    extra TEXT,
+    ease_factor NUMERIC,
+    interval_days NUMERIC,
+    PRIMARY KEY (set_id, pozycja),
+    FOREIGN KEY (set_id, pozycja) REFERENCES cards (set_id, pozycja) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS idx_card_stats_next_due ON card_stats (next_due);
+
+CREATE TABLE IF NOT EXISTS learn_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    set_id TEXT NOT NULL REFERENCES sets (id) ON DELETE CASCADE,
+    data TEXT,
+    timestamp TEXT,
+    zrozumiane NUMERIC,
+    niezrozumiane NUMERIC,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_learn_history_set ON learn_history (set_id, id);
+
+CREATE TABLE IF NOT EXISTS test_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    set_id TEXT NOT NULL REFERENCES sets (id) ON DELETE CASCADE,
+    data TEXT,
+    timestamp TEXT,
+    poprawne NUMERIC,
+    lacznie NUMERIC,
+    procent NUMERIC,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_test_history_set ON test_history (set_id, id);
+
+CREATE TABLE IF NOT EXISTS shard_versions (
+    autor TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_shard_versions_version ON shard_versions (version);
+"""
+
+# Kolumny tabel w kolejności zapisu; pola rekordu spoza listy trafiają do kolumny extra (JSON)
+USER_COLUMNS = ('haslo', 'data_utworzenia')
+SET_COLUMNS = ('nazwa', 'data_utworzenia', 'data_ostatniej_nauki', 'next_review_date',
+               'days_completed', 'ostatnie_wyniki')
+SET_JSON_COLUMNS = ('days_completed', 'ostatnie_wyniki')
+SET_NESTED = ('id', 'autor', 'karty', 'historia_nauki', 'historia_testow')
+CARD_COLUMNS = ('tekst', 'odpowiedz', 'id')
+STATS_COLUMNS = ('pokazane', 'rozumiem', 'nie_rozumiem', 'procent_sukcesu', 'streak_rozumiem',
+                 'streak_nie_rozumiem', 'opanowana', 'sessions_ok_streak', 'fail_streak_sessions',
+                 'last_seen_date', 'total_sessions_ok', 'next_due', 'leech', 'ease_factor', 'interval_days')
+STATS_BOOL_COLUMNS = ('opanowana', 'leech')
+LEARN_COLUMNS = ('data', 'timestamp', 'zrozumiane', 'niezrozumiane')
+TEST_COLUMNS = ('data', 'timestamp', 'poprawne', 'lacznie', 'procent')
+HISTORY_TABLES = (
+    ('historia_nauki', 'learn_history', LEARN_COLUMNS),
+    ('historia_testow', 'test_history', TEST_COLUMNS),
+)
+
+
+def _add_column(conn, table, column, declaration):
+    """ALTER TABLE ADD COLUMN, jeśli kolumny jeszcze nie ma (nowa baza ma ją już w SCHEMA)."""
+    if column not in {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+
+def _db_v2_set_schema_version(conn):
+    """v1 -> v2: wersja schematu zestawu w wierszu (NULL - wiersz sprzed wersjonowania, wersja 0)."""
+    _add_column(conn, 'sets', 'schema_version', 'INTEGER')
+
+
+def _move_from_extra(conn, table, columns):
+    """Przenieś pola `columns` z JSON kolumny extra do ich własnych kolumn."""
+    moved = []
+    for rowid, extra in conn.execute(f"SELECT rowid, extra FROM {table} WHERE extra IS NOT NULL").fetchall():
+        record = json.loads(extra)
+        if not any(column in record for column in columns):
+            continue
+        values = tuple(record.pop(column, None) for column in columns)
+        moved.append(values + (json.dumps(record, ensure_ascii=False, sort_keys=True) if record else None, rowid))
+    assignments = ', '.join(f'{column} = ?' for column in columns)
+    conn.executemany(f"UPDATE {table} SET {assignments}, extra = ? WHERE rowid = ?", moved)
+
+
+def _db_v3_card_columns(conn):
+    """v2 -> v3: id karty i stan SM-2 (ease_factor, interval_days) jako kolumny zamiast pól extra."""
+    _add_column(conn, 'cards', 'id', 'TEXT')
+    _add_column(conn, 'card_stats', 'ease_factor', 'NUMERIC')
+    _add_column(conn, 'card_stats', 'interval_days', 'NUMERIC')
+    _move_from_extra(conn, 'cards', ('id',))
+    _move_from_extra(conn, 'card_stats', ('ease_factor', 'interval_days'))
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_cards_id ON cards (id)")
+
+
+def _db_v4_shard_versions(conn):
+    """v3 -> v4: wersje shardów autorów (shard_versions); brak wiersza to wersja 0."""
+    conn.execute("CREATE TABLE IF NOT EXISTS shard_versions (autor TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_shard_versions_version ON shard_versions (version)")
+
+
+# (wersja docelowa, krok) - migracje układu tabel istniejącej bazy
+DB_MIGRATIONS = (
+    (2, _db_v2_set_schema_version),
+    (3, _db_v3_card_columns),
+    (4, _db_v4_shard_versions),
+)
+
+
+def _split(record, columns, json_columns=(), skip=()):
+    """Rekord -> krotka wartości kolumn (w kolejności `columns`) + JSON pozostałych pól."""
+    values = []
+    for column in columns:
+        value = record.get(column)
+        if column in json_columns and value is not None:
+            value = json.dumps(value, ensure_ascii=False)
+        values.append(value)
+    extra = {k: v for k, v in record.items() if k not in columns and k not in skip}
+    values.append(json.dumps(extra, ensure_ascii=False, sort_keys=True) if extra else None)
+    return tuple(values)
+
+
+def _join(values, columns, json_columns=(), omit_null=False):
+    """Odwrotność _split: wartości kolumn + extra -> słownik rekordu."""
+    record = {}
+    for column, value in zip(columns, values):
+        if value is None and omit_null:
+            continue
+        if column in json_columns and value is not None:
+            value = json.loads(value)
+        record[column] = value
+    extra = values[len(columns)]
+    if extra:
+        record.update(json.loads(extra))
+    return record
+
+
+def _placeholders(count):
+    return ', '.join('?' * count)
+
+
+def _set_rows(zestaw):
+    """Wiersze wszystkich tabel dla jednego zestawu - porównywane przed i po mutacji.
+
+    Zestaw w pamięci jest zawsze w bieżącej wersji schematu - ostatnia wartość wiersza 'set'.
+    """
+    karty = [k.to_dict() for k in zestaw.get('karty') or [] if isinstance(k, Card)]
+    rows = {
+        'set': _split(zestaw, SET_COLUMNS, SET_JSON_COLUMNS, SET_NESTED) + (SET_SCHEMA_VERSION,),
+        'cards': [_split(k, CARD_COLUMNS, skip=('statystyki',)) for k in karty],
+        'stats': [
+            _split(k['statystyki'], STATS_COLUMNS) if isinstance(k.get('statystyki'), dict) else None
+            for k in karty
+        ],
+    }
+    for key, _, columns in HISTORY_TABLES:
+        rows[key] = [_split(w, columns) for w in zestaw.get(key) or [] if isinstance(w, dict)]
+    return rows
+
+
+def _insert_cards(conn, set_id, rows):
+    conn.executemany(
+        f"INSERT INTO cards (set_id, pozycja, {', '.join(CARD_COLUMNS)}, extra) "
+        f"VALUES (?, ?, {_placeholders(len(CARD_COLUMNS) + 1)})",
+        [(set_id, pozycja) + card for pozycja, card in enumerate(rows['cards'])],
+    )
+    conn.executemany(
+        f"INSERT INTO card_stats (set_id, pozycja, {', '.join(STATS_COLUMNS)}, extra) "
+        f"VALUES (?, ?, {_placeholders(len(STATS_COLUMNS) + 1)})",
+        [(set_id, pozycja) + stats for pozycja, stats in enumerate(rows['stats']) if stats is not None],
+    )
+
+
+def _insert_history(conn, table, columns, set_id, entries):
+    conn.executemany(
+        f"INSERT INTO {table} (set_id, {', '.join(columns)}, extra) "
+        f"VALUES (?, {_placeholders(len(columns) + 1)})",
+        [(set_id,) + entry for entry in entries],
+    )
+
+
+def _insert_set(conn, author, pozycja, set_id, rows):
+    conn.execute(
+        f"INSERT INTO sets (id, autor, pozycja, {', '.join(SET_COLUMNS)}, extra, schema_version) "
+        f"VALUES (?, ?, ?, {_placeholders(len(SET_COLUMNS) + 2)})",
+        (set_id, author, pozycja) + rows['set'],
+    )
+    _insert_cards(conn, set_id, rows)
+    for key, table, columns in HISTORY_TABLES:
+        _insert_history(conn, table, columns, set_id, rows[key])
+
+
+def _update_set(conn, set_id, old_pozycja, old, pozycja, new):
+    """Zapisz tylko to, co się zmieniło między dwoma wersjami zestawu."""
+    if old_pozycja != pozycja or old['set'] != new['set']:
+        assignments = ', '.join(f'{column} = ?' for column in SET_COLUMNS + ('extra', 'schema_version'))
+        conn.execute(f"UPDATE sets SET pozycja = ?, {assignments} WHERE id = ?",
+                     (pozycja,) + new['set'] + (set_id,))
+
+    if old['cards'] != new['cards']:
+        # Zmieniona treść lub liczba kart (edycja zestawu) - karty zapisywane od nowa
+        conn.execute("DELETE FROM cards WHERE set_id = ?", (set_id,))
+        _insert_cards(conn, set_id, new)
+    else:
+        for card_pozycja, (old_stats, new_stats) in enumerate(zip(old['stats'], new['stats'])):
+            if old_stats == new_stats:
+                continue
+            if new_stats is None:
+                conn.execute("DELETE FROM card_stats WHERE set_id = ? AND pozycja = ?", (set_id, card_pozycja))
+            else:
+                conn.execute(
+                    f"INSERT OR REPLACE INTO card_stats (set_id, pozycja, {', '.join(STATS_COLUMNS)}, extra) "
+                    f"VALUES (?, ?, {_placeholders(len(STATS_COLUMNS) + 1)})",
+                    (set_id, card_pozycja) + new_stats,
+                )
+
+    for key, table, columns in HISTORY_TABLES:
+        old_entries, new_entries = old[key], new[key]
+        if new_entries[:len(old_entries)] == old_entries:
+            # Typowy przypadek: historia tylko dopisywana na końcu
+            _insert_history(conn, table, columns, set_id, new_entries[len(old_entries):])
+        else:
+            conn.execute(f"DELETE FROM {table} WHERE set_id = ?", (set_id,))
+            _insert_history(conn, table, columns, set_id, new_entries)
+
+
+def _write_shard_diff(conn, author, base, sets_data, rewrite=()):
+    """Zapisz różnicę między shardem sprzed mutacji (`base`) a po niej.
+
+    Mutacje działają na ShardDraft (copy-on-write), więc zestaw, który jest w obu listach
+    tym samym obiektem, nie zmienił się - wiersze są porównywane tylko dla zestawów
+    zmienionych. Zestawy z `rewrite` (wiersze w starszej wersji schematu) są zapisywane od nowa.
+    """
+    before = {zestaw.get('id'): (pozycja, zestaw) for pozycja, zestaw in enumerate(base)}
+    seen = set()
+    for pozycja, zestaw in enumerate(sets_data):
+        set_id = zestaw.get('id')
+        if set_id in seen:
+            print(f"OSTRZEŻENIE: Powtórzone id zestawu {set_id} u {author} - pominięto")
+            continue
+        seen.add(set_id)
+        if set_id in rewrite:
+            conn.execute("DELETE FROM sets WHERE id = ?", (set_id,))
+        elif set_id in before:
+            old_pozycja, old = before[set_id]
+            if old is zestaw:
+                if old_pozycja != pozycja:
+                    conn.execute("UPDATE sets SET pozycja = ? WHERE id = ?", (pozycja, set_id))
+            else:
+                _update_set(conn, set_id, old_pozycja, _set_rows(old), pozycja, _set_rows(zestaw))
+            continue
+        _insert_set(conn, author, pozycja, set_id, _set_rows(zestaw))
+    for set_id in before.keys() - seen:
+        conn.execute("DELETE FROM sets WHERE id = ?", (set_id,))
+
+
+def _shard_version(conn, author):
+    row = conn.execute("SELECT version FROM shard_versions WHERE autor = ?", (author,)).fetchone()
+    return row[0] if row else 0
+
+
+def _bump_shard_version(conn, author):
+    """Nowa wersja sharda autora (w transakcji zapisu): kolejna wartość licznika wspólnego dla bazy.
+
+    Wspólny licznik pozwala innym workerom znaleźć zmienione shardy jednym zapytaniem (version > ostatnio widziana).
+    """
+    version = conn.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM shard_versions").fetchone()[0]
+    conn.execute("INSERT OR REPLACE INTO shard_versions (autor, version) VALUES (?, ?)", (author, version))
+    return version
+
+
+def _load_author_sets(conn, author, stale=None):
+    """Złóż shard autora (lista zestawów jak w JSON) z tabel.
+
+    Wiersze zapisane w starszej wersji schematu zestawu są migrowane od swojej wersji;
+    ich id trafiają do zbioru `stale` (jeśli podano), aby zapis mógł je przepisać.
+    """
+    sets_data = []
+    by_id = {}
+    versions = {}
+    for row in conn.execute(
+        f"SELECT id, {', '.join(SET_COLUMNS)}, extra, schema_version FROM sets WHERE autor = ? ORDER BY pozycja",
+        (author,),
+    ):
+        zestaw = {'id': row[0], 'autor': author}
+        zestaw.update(_join(row[1:-1], SET_COLUMNS, SET_JSON_COLUMNS, omit_null=True))
+        # Pola, których wiersz nie odtworzy: puste listy historii (brak wierszy) i brak terminu (NULL)
+        zestaw['karty'] = []
+        for key, _, _ in HISTORY_TABLES:
+            zestaw[key] = []
+        zestaw.setdefault('next_review_date', None)
+        sets_data.append(zestaw)
+        by_id[row[0]] = zestaw
+        versions[row[0]] = row[-1] or 0
+    if not sets_data:
+        return sets_data
+
+    stats_select = ', '.join(f'st.{column}' for column in STATS_COLUMNS)
+    card_count = len(CARD_COLUMNS) + 1
+    for row in conn.execute(
+        f"SELECT c.set_id, {', '.join(f'c.{column}' for column in CARD_COLUMNS)}, c.extra, "
+        f"st.set_id IS NOT NULL, {stats_select}, st.extra "
+        "FROM cards c JOIN sets s ON s.id = c.set_id "
+        "LEFT JOIN card_stats st ON st.set_id = c.set_id AND st.pozycja = c.pozycja "
+        "WHERE s.autor = ? ORDER BY c.set_id, c.pozycja",
+        (author,),
+    ):
+        karta = _join(row[1:1 + card_count], CARD_COLUMNS)
+        if row[1 + card_count]:
+            # Puste kolumny to pola nieobecne w rekordzie - CardStats nada im wartości domyślne
+            stats = _join(row[2 + card_count:], STATS_COLUMNS, omit_null=True)
+            for column in STATS_BOOL_COLUMNS:
+                if stats.get(column) is not None:
+                    stats[column] = bool(stats[column])
+            karta['statystyki'] = stats
+        by_id[row[0]]['karty'].append(Card.from_dict(karta))
+
+    for key, table, columns in HISTORY_TABLES:
+        for row in conn.execute(
+            f"SELECT h.set_id, {', '.join(f'h.{column}' for column in columns)}, h.extra "
+            f"FROM {table} h JOIN sets s ON s.id = h.set_id WHERE s.autor = ? ORDER BY h.id",
+            (author,),
+        ):
+            by_id[row[0]][key].append(_join(row[1:], columns))
+    # Migracje tylko od wersji zapisanej w wierszu - wiersz w bieżącej wersji jest kompletny
+    for zestaw in sets_data:
+        version = versions[zestaw['id']]
+        normalize_set(zestaw, version)
+        if stale is not None and version < SET_SCHEMA_VERSION:
+            stale.add(zestaw['id'])
+    return sets_data
+
+
+def _user_from_row(row):
+    user = {'login': row[0]}
+    user.update(_join(row[1:], USER_COLUMNS, omit_null=True))
+    return user
+
+
+def _user_row(user):
+    return _split(user, USER_COLUMNS, skip=('login',))
+
+
+def _insert_user(conn, user):
+    conn.execute(
+        f"INSERT INTO users (login, {', '.join(USER_COLUMNS)}, extra) VALUES (?, {_placeholders(len(USER_COLUMNS) + 1)})",
+        (user.get('login'),) + _user_row(user),
+    )
+
+
+def _update_user_row(conn, login, row):
+    assignments = ', '.join(f'{column} = ?' for column in USER_COLUMNS + ('extra',))
+    conn.execute(f"UPDATE users SET {assignments} WHERE login = ?", row + (login,))
+
+
+def _select_user(conn, login):
+    return conn.execute(
+        f"SELECT login, {', '.join(USER_COLUMNS)}, extra FROM users WHERE login = ?", (login,)
+    ).fetchone()
+
+
+def _load_users(conn):
+    return [_user_from_row(row) for row in conn.execute(
+        f"SELECT login, {', '.join(USER_COLUMNS)}, extra FROM users ORDER BY rowid"
+    )]
+
+
+class SqliteDataStore:
+    """DataStore nad SQLite - ten sam interfejs co storage.DataStore.
+
+    Dane w pamięci są ważne, dopóki inne połączenie nie zmieni bazy (PRAGMA data_version).
+    Wtedy lista użytkowników jest wczytywana ponownie, a z shardów autorów porzucane są
+    tylko te, których wersja w shard_versions się zmieniła.
+    Zapisy nie potrzebują optimistic lockingu: BEGIN IMMEDIATE szereguje piszących.
+    Jak w storage.DataStore shardy są niezmiennymi snapshotami przypiętymi do żądania.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self.users_by_login = {}
+        self.sets_by_author = {}
+        self.sets_by_id = {}
+        self._shard_ids = {}
+        self._shard_versions = {}  # autor -> wersja opublikowanego snapshotu (shard_versions)
+        self._stale_sets = {}  # autor -> id zestawów snapshotu zapisanych w starszej wersji schematu
+        self._seen_version = 0  # najwyższa wersja sharda uwzględniona przez _check_external_changes
+        self._index_lock = threading.Lock()
+        self._snapshots = RequestSnapshots()
+        self._due_indexes = DueIndexes()
+        self._valid_cards = ValidCardsCache()
+        self.reload_counters = {
+            'users': {'reloads': 0, 'skipped': 0},
+            'sets': {'reloads': 0, 'skipped': 0},
+        }
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        self._migrate_db()
+        self._seen_version = conn.execute("SELECT COALESCE(MAX(version), 0) FROM shard_versions").fetchone()[0]
+        self.users = _load_users(conn)
+        self._reindex_users()
+        self._users_loaded = True
+
+    def _conn(self):
+        """Połączenie per wątek (i per proces - po forku workera otwierane od nowa)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("PRAGMA foreign_keys = ON")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+            self._local.data_version = None
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @contextmanager
+    def _read_transaction(self):
+        """Spójny odczyt kilku zapytań (wersja sharda i jego wiersze z jednego stanu bazy)."""
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            yield conn
+        finally:
+            conn.execute("COMMIT")
+
+    def _migrate_db(self):
+        """Dostosuj układ tabel istniejącej bazy do SCHEMA_VERSION (kroki DB_MIGRATIONS)."""
+        with self._transaction() as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for target, step in DB_MIGRATIONS:
+                if version < target:
+                    step(conn)
+            if version < SCHEMA_VERSION:
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _check_external_changes(self):
+        """Porzuć dane w pamięci zmienione przez inne połączenie: użytkowników i shardy o nowszej wersji."""
+        conn = self._conn()
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._local.data_version:
+            return
+        self._local.data_version = version
+        self._users_loaded = False
+        # Tylko shardy zapisane od ostatniego sprawdzenia (indeks po version) - nie wszystkie
+        seen = self._seen_version
+        changed = conn.execute(
+            "SELECT autor, version FROM shard_versions WHERE version > ?", (seen,)
+        ).fetchall()
+        if not changed:
+            return
+        dropped = []
+        with self._index_lock:
+            for author, shard_version in changed:
+                known = self._shard_versions.get(author)
+                if known is not None and known < shard_version:
+                    self._forget_shard(author)
+                    dropped.append(author)
+            self._seen_version = max(self._seen_version, max(v for _, v in changed))
+        for author in dropped:
+            self._due_indexes.drop(author)
+            self._valid_cards.drop(author)
+
+    def _forget_shard(self, author):
+        """Usuń snapshot autora z indeksów (wywoływane pod _index_lock)."""
+        self.sets_by_author.pop(author, None)
+        self._shard_versions.pop(author, None)
+        self._stale_sets.pop(author, None)
+        for set_id, zestaw in (self._shard_ids.pop(author, None) or {}).items():
+            if self.sets_by_id.get(set_id) is zestaw:
+                del self.sets_by_id[set_id]
+
+    # ------------------------------------------------------------------
+    # Użytkownicy
+    # ------------------------------------------------------------------
+
+    def reload_users(self):
+        self._check_external_changes()
+        skipped = self._users_loaded
+        if not skipped:
+            self.users = _load_users(self._conn())
+            self._reindex_users()
+            self._users_loaded = True
+        self._count_reload('users', skipped)
+
+    def _reindex_users(self):
+        self.users_by_login = {u.get('login'): u for u in self.users}
+
+    def get_user(self, login):
+        """Świeży odczyt jednego wiersza - bez wczytywania całej tabeli users."""
+        row = _select_user(self._conn(), login)
+        if row is None:
+            with self._index_lock:
+                current = self.users_by_login.pop(login, None)
+                if current is not None:
+                    self.users.remove(current)
+            return None
+        user = _user_from_row(row)
+        self._replace_user(user)
+        return user
+
+    def update_user(self, login, fn):
+        """Zastosuj fn(user) do jednego użytkownika (jeden wiersz); zwraca zapisanego użytkownika lub None."""
+        try:
+            with self._transaction() as conn:
+                row = _select_user(conn, login)
+                if row is None:
+                    return None
+                user = _user_from_row(row)
+                fn(user)
+                _update_user_row(conn, login, _user_row(user))
+        except sqlite3.Error as e:
+            print(f"Warning: zapis użytkownika {login} do SQLite nie powiódł się: {e}")
+            return None
+        self._replace_user(user)
+        return user
+
+    def add_user(self, user):
+        """Dodaj użytkownika; False, jeśli login jest już zajęty lub zapis się nie powiódł."""
+        try:
+            with self._transaction() as conn:
+                _insert_user(conn, user)
+        except sqlite3.IntegrityError:
+            return False
+        except sqlite3.Error as e:
+            print(f"Warning: zapis użytkownika do SQLite nie powiódł się: {e}")
+            return False
+        self._replace_user(user)
+        return True
+
+    def _replace_user(self, user):
+        login = user.get('login')
+        with self._index_lock:
+            current = self.users_by_login.get(login)
+            if current is not None:
+                self.users[self.users.index(current)] = user
+            else:
+                self.users.append(user)
+            self.users_by_login[login] = user
+
+    # ------------------------------------------------------------------
+    # Zestawy
+    # ------------------------------------------------------------------
+
+    def reload_sets(self, author):
+        """Zwróć zestawy autora i przypnij je do żądania; z bazy tylko wtedy, gdy kopia w pamięci może być nieaktualna."""
+        self._check_external_changes()
+        with self._index_lock:
+            sets_data = self.sets_by_author.get(author)
+            by_id = self._shard_ids.get(author)
+        skipped = sets_data is not None
+        if not skipped:
+            seen = self._seen_version
+            stale = set()
+            with self._read_transaction() as conn:
+                version = _shard_version(conn, author)
+                sets_data = _load_author_sets(conn, author, stale)
+            sets_data, by_id = self._set_shard(author, sets_data, version, stale, seen)
+        self._count_reload('sets', skipped)
+        self._snapshots.pin(author, sets_data, by_id)
+        return sets_data
+
+    def read_sets(self, author):
+        """Zestawy dla widoków tylko do odczytu - sprawdzenie PRAGMA data_version jest tanie, więc jak reload_sets."""
+        return self.reload_sets(author)
+
+    def _set_shard(self, author, sets_data, version, stale, seen):
+        """Opublikuj snapshot sharda w wersji `version`; zwraca (zestawy, indeks id).
+
+        `seen` to _seen_version sprzed odczytu/zapisu. Jeśli w międzyczasie sprawdzenie zmian
+        przetworzyło nowsze wersje, mogło pominąć tego autora (nie było go w pamięci) - wtedy
+        snapshot służy tylko bieżącemu żądaniu, a następne wczyta shard z bazy. Starszy snapshot
+        niż opublikowany (równoległy zapis innego wątku) też nie jest publikowany.
+        """
+        by_id = {zestaw.get('id'): zestaw for zestaw in sets_data}
+        published = False
+        with self._index_lock:
+            known = self._shard_versions.get(author)
+            if self._seen_version > seen:
+                self._forget_shard(author)
+            elif known is None or known <= version:
+                self.sets_by_id.update(by_id)
+                for set_id, zestaw in (self._shard_ids.get(author) or {}).items():
+                    if set_id not in by_id and self.sets_by_id.get(set_id) is zestaw:
+                        del self.sets_by_id[set_id]
+                self.sets_by_author[author] = sets_data
+                self._shard_ids[author] = by_id
+                self._shard_versions[author] = version
+                self._stale_sets[author] = frozenset(stale)
+                published = True
+        if not published:
+            self._due_indexes.drop(author)
+            self._valid_cards.drop(author)
+            return sets_data, by_id
+        self._snapshots.repin(author, sets_data, by_id)
+        self._valid_cards.retain(author, sets_data)
+        return sets_data, by_id
+
+    def _count_reload(self, kind, skipped):
+        with self._index_lock:
+            self.reload_counters[kind]['reloads'] += 1
+            if skipped:
+                self.reload_counters[kind]['skipped'] += 1
+
+    def user_sets(self, author):
+        """Zestawy autora ze snapshotu przypiętego do żądania (tylko do odczytu - zmiany przez update_*)."""
+        pinned = self._snapshots.sets(author)
+        if pinned is not None:
+            return pinned
+        return self.reload_sets(author)
+
+    def get_set(self, set_id):
+        """Zestaw o danym id (O(1)) - najpierw z przypiętych snapshotów; właściciela sprawdza wywołujący."""
+        zestaw = self._snapshots.find(set_id)
+        if zestaw is not None:
+            return zestaw
+        return self.sets_by_id.get(set_id)
+
+    def due_index(self, author):
+        """Indeks terminów powtórek (due_index.DueIndex) snapshotu autora przypiętego do żądania."""
+        return self._due_indexes.get(author, self.user_sets(author))
+
+    def valid_cards(self, zestaw):
+        """Projekcja poprawnych kart (valid_cards.ValidCards) zestawu z opublikowanego snapshotu."""
+        return self._valid_cards.get(zestaw)
+
+    def end_request(self):
+        """Zwolnij snapshoty przypięte do bieżącego żądania (teardown_request w app.py)."""
+        self._snapshots.clear()
+
+    def update_sets(self, author, mutation):
+        """Zastosuj mutation(sets_data) do aktualnych zestawów autora w jednej transakcji.
+
+        sets_data to ShardDraft, jak w storage.DataStore.update_sets (zmiana zestawu przez edit(set_id)).
+        Bazą jest snapshot w pamięci, jeśli jego wersja zgadza się z shard_versions w transakcji;
+        w przeciwnym razie shard jest wczytywany z bazy.
+
+        Zapisywane są tylko różnice (wiersz zestawu, zmienione statystyki kart, nowe wpisy historii)
+        i tylko dla zestawów zmienionych przez mutację. Zwraca True, jeśli zmiana została zapisana
+        (lub nie była potrzebna).
+        """
+        seen = self._seen_version
+        try:
+            with self._transaction() as conn:
+                version = _shard_version(conn, author)
+                with self._index_lock:
+                    base = self.sets_by_author.get(author) if self._shard_versions.get(author) == version else None
+                    stale = self._stale_sets.get(author, frozenset())
+                loaded = base is None
+                if loaded:
+                    stale = set()
+                    base = _load_author_sets(conn, author, stale)
+                sets_data = ShardDraft(base)
+                changed = mutation(sets_data)
+                if changed:
+                    # Zestawy w starszej wersji schematu zapisywane w całości (z wynikiem migracji)
+                    _write_shard_diff(conn, author, base, sets_data, rewrite=stale)
+                    version = _bump_shard_version(conn, author)
+                    stale = ()
+        except sqlite3.Error as e:
+            print(f"Warning: zapis zestawów {author} do SQLite nie powiódł się: {e}")
+            return False
+        if changed:
+            self._set_shard(author, list(sets_data), version, stale, seen)
+        elif loaded:
+            self._set_shard(author, base, version, stale, seen)
+        return True
+
+    def update_set(self, author, set_id, fn):
+        """Zastosuj fn(zestaw) do zestawu autora i zapisz; zwraca zapisany zestaw lub None."""
+        committed = {}
+
+        def mutation(sets_data):
+            zestaw = sets_data.edit(set_id)
+            if zestaw is None:
+                return False
+            fn(zestaw)
+            committed['zestaw'] = zestaw
+            return True
+
+        if not self.update_sets(author, mutation):
+            return None
+        return committed.get('zestaw')
+
+    def add_set(self, zestaw):
+        normalize_set(zestaw)
+
+        def mutation(sets_data):
+            if any(s.get('id') == zestaw.get('id') for s in sets_data):
+                return False
+            sets_data.append(zestaw)
+            return True
+
+        return self.update_sets(zestaw['autor'], mutation)
+
+    def remove_set(self, author, set_id):
+        def mutation(sets_data):
+            zestaw = next((s for s in sets_data if s.get('id') == set_id), None)
+            if zestaw is None:
+                return False
+            sets_data.remove(zestaw)
+            return True
+
+        return self.update_sets(author, mutation)
+
+
+def import_json(db_path):
+    """Zaimportuj dane z backendu JSON (lokalnie lub z GCS, wg USE_CLOUD_STORAGE) do bazy SQLite.
+
+    Import jest idempotentny: użytkownicy i zestawy zaimportowanych autorów są w bazie
+    zastępowani wersją z JSON. Stary monolityczny sets.json jest najpierw dzielony na shardy.
+    """
+    storage.migrate_legacy_users()
+    storage.migrate_legacy_sets()
+    users = storage.load_all_users()
+    authors = set(storage.list_set_authors()) | {u.get('login') for u in users if u.get('login')}
+
+    target = SqliteDataStore(db_path)
+    sets_count = 0
+    with target._transaction() as conn:
+        for user in users:
+            conn.execute("DELETE FROM users WHERE login = ?", (user.get('login'),))
+            _insert_user(conn, user)
+        for author in sorted(authors):
+            # Nieudany odczyt przerywa import (wycofanie transakcji) zamiast skasować zestawy autora
+            sets_data, _ = storage.load_sets(author, strict=True)
+            conn.execute("DELETE FROM sets WHERE autor = ?", (author,))
+            for zestaw in sets_data:
+                conn.execute("DELETE FROM sets WHERE id = ?", (zestaw.get('id'),))
+            _write_shard_diff(conn, author, [], sets_data)
+            _bump_shard_version(conn, author)
+            sets_count += len(sets_data)
+    print(f"Zaimportowano {len(users)} użytkowników i {sets_count} zestawów ({len(authors)} autorów) do {db_path}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Narzędzia backendu SQLite.')
+    parser.add_argument('command', choices=['import'], help='import: przenieś dane z plików JSON/GCS do bazy')
+    parser.add_argument('--db', default=SQLITE_PATH, help=f'ścieżka bazy (domyślnie {SQLITE_PATH})')
+    args = parser.parse_args()
+    import_json(args.db)
@@ -0,0 +1,122 @@
+"""Silnik powtórek SM-2: współczynnik łatwości i odstęp per karta.
+
+Stan karty to (ease_factor, interval_days, powtórzenia), gdzie powtórzenia to
+sessions_ok_streak - liczba kolejnych udanych sesji. Odpowiedź jest oceną 0-5
+(SM-2); binarne wyniki nauki mapowane są na GRADE_PASS / GRADE_FAIL.
+
+review_batch liczy nowy stan całej sesji naraz na równoległych listach (kolumnach)
+i nie zależy od Flaska ani modelu kart - można go testować w izolacji.
+schedule_cards to cienka warstwa przenosząca stan z/do obiektów Card.
+"""
+from datetime import date, timedelta
+
+DEFAULT_EASE = 2.5
+MIN_EASE = 1.3
+# Ocena >= PASS_THRESHOLD to udana odpowiedź (powtórzenia + 1), niższa zeruje serię
+PASS_THRESHOLD = 3
+# Binarne wyniki nauki: "rozumiem" / "nie rozumiem"
+GRADE_PASS = 4
+GRADE_FAIL = 2
+
+# Zmiana współczynnika łatwości dla oceny q: 0.1 - (5 - q) * (0.08 + (5 - q) * 0.02)
+EASE_DELTA = tuple(0.1 - (5 - q) * (0.08 + (5 - q) * 0.02) for q in range(6))
+
+
+def grade_of(result):
+    """Wynik sesji (True/False/ocena 0-5/None) -> ocena SM-2 lub None (karta pominięta)."""
+    if result is True:
+        return GRADE_PASS
+    if result is False:
+        return GRADE_FAIL
+    if isinstance(result, int) and 0 <= result <= 5:
+        return result
+    return None
+
+
+def review_batch(eases, intervals, repetitions, grades):
+    """Nowy stan SM-2 dla całej sesji: (eases, intervals, repetitions) po ocenach `grades`.
+
+    Wszystkie argumenty to listy tej samej długości; ocena None pozostawia stan karty
+    bez zmian. Funkcja jest czysta - zwraca nowe listy, nie modyfikuje argumentów.
+    """
+    new_eases = list(eases)
+    new_intervals = list(intervals)
+    new_repetitions = list(repetitions)
+    ease_delta = EASE_DELTA
+    for i, grade in enumerate(grades):
+        if grade is None:
+            continue
+        ease = eases[i]
+        if grade >= PASS_THRESHOLD:
+            reps = repetitions[i]
+            if reps == 0:
+                new_intervals[i] = 1
+            elif reps == 1:
+                new_intervals[i] = 6
+            else:
+                new_intervals[i] = max(1, round(intervals[i] * ease))
+            new_repetitions[i] = reps + 1
+        else:
+            new_intervals[i] = 1
+            new_repetitions[i] = 0
+        ease += ease_delta[grade]
+        new_eases[i] = ease if ease > MIN_EASE else MIN_EASE
+    return new_eases, new_intervals, new_repetitions
+
+
+def initial_state(stats):
+    """(ease_factor, interval_days) wyprowadzone ze statystyk karty sprzed silnika SM-2.
+
+    Łatwość odpowiada przebiegowi SM-2 z ocenami binarnymi: każde "nie rozumiem"
+    obniża ją o EASE_DELTA[GRADE_FAIL], "rozumiem" jej nie zmienia. Odstęp to różnica
+    next_due - last_seen_date, a bez tych dat - stary harmonogram 1/6/16 dni wg serii.
+    """
+    ease = max(MIN_EASE, round(DEFAULT_EASE + EASE_DELTA[GRADE_FAIL] * (stats.nie_rozumiem or 0), 2))
+    interval = None
+    if stats.next_due and stats.last_seen_date:
+        try:
+            interval = (date.fromisoformat(stats.next_due) - date.fromisoformat(stats.last_seen_date)).days
+        except (TypeError, ValueError):
+            interval = None
+    if interval is None or interval < 0:
+        streak = stats.sessions_ok_streak or 0
+        interval = 0 if streak == 0 else 1 if streak == 1 else 6 if streak == 2 else 16
+    return ease, interval
+
+
+def ensure_state(stats):
+    """Uzupełnij brakujący stan SM-2 karty (migracja / karty sprzed silnika), w miejscu."""
+    if stats.ease_factor is None or stats.interval_days is None:
+        stats.ease_factor, stats.interval_days = initial_state(stats)
+
+
+def schedule_cards(karty, grades, today):
+    """Nanieś oceny sesji (per indeks karty) na stan SM-2 kart i ustaw next_due."""
+    graded = [i for i, grade in enumerate(grades) if grade is not None and i < len(karty)]
+    if not graded:
+        return
+    stats = [karty[i].statystyki for i in graded]
+    for s in stats:
+        ensure_state(s)
+    eases, intervals, repetitions = review_batch(
+        [s.ease_factor for s in stats],
+        [s.interval_days for s in stats],
+        [s.sessions_ok_streak for s in stats],
+        [grades[i] for i in graded],
+    )
+    # Odstępy w sesji powtarzają się - data ISO liczona raz na odstęp
+    due_dates = {}
+    for s, ease, interval, reps in zip(stats, eases, intervals, repetitions):
+        s.ease_factor = round(ease, 2)
+        s.interval_days = interval
+        s.sessions_ok_streak = reps
+        due = due_dates.get(interval)
+        if due is None:
+            due = due_dates[interval] = (today + timedelta(days=interval)).isoformat()
+        s.next_due = due
+
+
+def earliest_due(karty):
+    """Najwcześniejszy next_due kart zestawu (ISO) lub None - termin powtórki całego zestawu."""
+    dates = [karta.statystyki.next_due for karta in karty if karta.statystyki.next_due]
+    return min(dates) if dates else None
@@ -1,20 +1,74 @@
-from google.cloud import storage
-from google.api_core import exceptions as gcp_exceptions
+import atexit
+import copy
+import gzip
+import hashlib
+import hmac
+import importlib
+import io
 import os
 import json
+import random
+import signal
+import tempfile
 import time
+import threading
 import traceback
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import quote, unquote
 
+try:
+    import fcntl
+except ImportError:  # Windows - zapis nadal atomowy, ale bez blokad między procesami
+    fcntl = None
+
+from cards import card_to_json
 from config import (
     cipher,
     USE_CLOUD_STORAGE,
     USERS_FILE,
     SETS_FILE,
+    SETS_DIR,
     BUCKET_NAME,
     USERS_FILE_NAME,
+    USERS_DIR,
+    USERS_PREFIX,
+    LOGIN_HASH_KEY,
     SETS_FILE_NAME,
+    SETS_PREFIX,
+    SNAPSHOT_CACHE_MAX_ENTRIES,
+    SNAPSHOT_CACHE_MAX_BYTES,
+    STREAM_LOAD_MIN_BYTES,
+    WRITE_MAX_RETRIES,
+    WRITE_BACKOFF_BASE,
+    WRITE_BEHIND,
+    WRITE_BEHIND_INTERVAL_MS,
+    SNAPSHOT_WATCH_INTERVAL_MS,
+    STORAGE_BACKEND,
+    SQLITE_PATH,
+    STORAGE_FORMAT,
 )
+from due_index import DueIndexes
+from schema import SCHEMA_VERSION, document_version, normalize_set
+from valid_cards import ValidCardsCache
+
+
+class _LazyModule:
+    """Moduł importowany dopiero przy pierwszym użyciu atrybutu.
+
+    SDK Google Cloud ładuje się kilkaset ms - w trybie lokalnym nie jest potrzebne wcale,
+    a w trybie cloud dopiero przy pierwszym dostępie do danych, nie przy starcie procesu.
+    """
+
+    def __init__(self, name):
+        self._name = name
 
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self._name), attr)
+
+
+storage = _LazyModule('google.cloud.storage')
+gcp_exceptions = _LazyModule('google.api_core.exceptions')
 
 _gcs_client = None
 
@@ -24,327 +78,1696 @@ def get_storage_client():
         _gcs_client = storage.Client()
     return _gcs_client
 
-def load_users():
-    """Wczytaj użytkowników - z GCS (produkcja) lub lokalnie (development).
-    Zwraca tuple: (users_data, generation) dla GCS lub (users_data, None) dla lokalnego."""
-    if not USE_CLOUD_STORAGE:
-        # Wersja lokalna - pliki na dysku
-        if not os.path.exists(USERS_FILE):
-            return ([], None)
-        try:
-            with open(USERS_FILE, 'rb') as f:
-                encrypted_data = f.read()
-                if not encrypted_data:
-                    return ([], None)
-                decrypted_data = cipher.decrypt(encrypted_data)
-                data = json.loads(decrypted_data.decode('utf-8'))
-
-                if isinstance(data, dict) and 'users' in data and isinstance(data['users'], list):
-                    return (data['users'], None)
-                if isinstance(data, dict):
-                    migrated = []
-                    for login, info in data.items():
-                        item = {
-                            'login': login,
-                            'haslo': info.get('haslo') or info.get('password'),
-                            'data_utworzenia': info.get('data_utworzenia')
-                        }
-                        migrated.append(item)
-                    return (migrated, None)
-                if isinstance(data, list):
-                    return (data, None)
-                return ([], None)
-        except (OSError, IOError) as e:
-            print(f"Błąd I/O podczas wczytywania użytkowników (lokalnie): {e}")
-            return ([], None)
-        except (json.JSONDecodeError, UnicodeDecodeError) as e:
-            print(f"Błąd dekodowania danych użytkowników (lokalnie): {e}")
-            return ([], None)
-        except Exception as e:
-            print(f"Błąd podczas wczytywania użytkowników (lokalnie): {e}")
-            traceback.print_exc()
-            return ([], None)
+class WriteConflict(Exception):
+    """Zapis odrzucony przez optimistic locking - blob ma nowszą generację niż oczekiwana."""
 
-    # Wersja cloud - Google Cloud Storage
+
+class ShardLoadError(Exception):
+    """Shard nie dał się wczytać (błąd I/O lub dekodowania) - jego treść i generacja są nieznane."""
+
+
+def _backoff(attempt):
+    """Losowy (jittered) wykładniczy odstęp przed ponowieniem zapisu po konflikcie."""
+    time.sleep(random.uniform(0, WRITE_BACKOFF_BASE * (2 ** attempt)))
+
+
+def _download_blob(blob_name, known_generation=None):
+    """Pobierz blob jednym żądaniem (generacja odczytywana z nagłówków odpowiedzi).
+
+    Jeśli podano known_generation, pobranie jest warunkowe (if_generation_not_match):
+    gdy blob się nie zmienił, zwraca (None, known_generation) bez przesyłania treści.
+    Nieistniejący blob daje (b'', 0).
+    """
+    blob = get_storage_client().bucket(BUCKET_NAME).blob(blob_name)
     try:
-        client = get_storage_client()
-        bucket = client.bucket(BUCKET_NAME)
-        blob = bucket.blob(USERS_FILE_NAME)
+        if known_generation is not None:
+            data = blob.download_as_bytes(if_generation_not_match=known_generation)
+        else:
+            data = blob.download_as_bytes()
+    except gcp_exceptions.NotModified:
+        return (None, known_generation)
+    except gcp_exceptions.NotFound:
+        if known_generation == 0:
+            return (None, 0)
+        return (b'', 0)
+    return (data, blob.generation)
+
 
-        if not blob.exists():
-            print(f"Plik {USERS_FILE_NAME} nie istnieje w bucket {BUCKET_NAME}")
-            return ([], None)
+def _stream_blob(blob_name, known_generation, parse, parse_stream):
+    """Pobierz i sparsuj blob, duże bloby strumieniowo: (wartość albo None przy 304, generacja, rozmiar).
 
-        # Pobierz dane wraz z generacją
-        blob.reload()
-        encrypted_data = blob.download_as_bytes()
+    Najpierw metadane (warunkowo względem known_generation - przy braku zmian to jedyne
+    żądanie), potem treść dokładnie tej generacji: mały blob jednym pobraniem, duży
+    (STREAM_LOAD_MIN_BYTES) czytany porcjami przez parse_stream. Nieistniejący blob daje ([], 0, 0).
+    """
+    blob = get_storage_client().bucket(BUCKET_NAME).blob(blob_name)
+    for attempt in range(WRITE_MAX_RETRIES):
+        try:
+            if known_generation is not None:
+                blob.reload(if_generation_not_match=known_generation)
+            else:
+                blob.reload()
+        except gcp_exceptions.NotModified:
+            return (None, known_generation, 0)
+        except gcp_exceptions.NotFound:
+            return ([], 0, 0)
         generation = blob.generation
+        size = blob.size or 0
+        try:
+            if size < STREAM_LOAD_MIN_BYTES:
+                data = blob.download_as_bytes(if_generation_match=generation)
+                return (parse(data) if data else [], generation, len(data))
+            # Surowe bajty (także przy Content-Encoding: gzip) - format rozpoznaje parse_stream
+            with blob.open('rb', if_generation_match=generation, raw_download=True) as f:
+                return (parse_stream(f), generation, size)
+        except (gcp_exceptions.PreconditionFailed, gcp_exceptions.NotFound):
+            # Blob zmienił się między metadanymi a treścią - od nowa, bez warunku
+            known_generation = None
+            _backoff(attempt)
+    raise WriteConflict(blob_name)
 
-        if not encrypted_data:
-            return ([], generation)
 
-        decrypted_data = cipher.decrypt(encrypted_data)
-        data = json.loads(decrypted_data.decode('utf-8'))
+class SnapshotCache:
+    """LRU cache sparsowanych snapshotów: (nazwa bloba/pliku, generacja) -> zwalidowana lista.
 
-        # Obsługa formatu: {"users": [...]}
-        if isinstance(data, dict) and 'users' in data and isinstance(data['users'], list):
-            users_list = data['users']
-            # Walidacja: upewnij się że każdy element to słownik
-            valid_users = []
-            for item in users_list:
-                if isinstance(item, dict):
-                    valid_users.append(item)
-                else:
-                    print(f"OSTRZEŻENIE: Nieprawidłowy format użytkownika: {item}")
-            return (valid_users, generation)
-
-        # Obsługa starego formatu: {"login": {"haslo": ..., "data_utworzenia": ...}, ...}
-        if isinstance(data, dict):
-            migrated = []
-            for login, info in data.items():
-                item = {
-                    'login': login,
-                    'haslo': info.get('haslo') or info.get('password'),
-                    'data_utworzenia': info.get('data_utworzenia')
-                }
-                migrated.append(item)
-            return (migrated, generation)
-
-        # Jeśli już lista
-        if isinstance(data, list):
-            return (data, generation)
-
-        return ([], generation)
+    Ograniczony liczbą wpisów i sumą rozmiarów surowych danych. Dla jednej nazwy trzymana
+    jest tylko najnowsza generacja. Zwracane obiekty są współdzielone między wątkami i traktowane
+    jako niezmienne snapshoty - zmiany idą przez kopię (ShardDraft, kopia rekordu użytkownika).
+    """
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # (name, generation) -> (value, size)
+        self._latest = {}  # name -> generation
+        self._lock = threading.Lock()
+        self.on_evict = None  # opcjonalny callback(name) po wyrzuceniu wpisu z cache
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def latest_generation(self, name):
+        return self._latest.get(name)
+
+    def latest_size(self, name):
+        """Rozmiar surowych danych najnowszej generacji w cache (None, jeśli brak wpisu)."""
+        with self._lock:
+            entry = self._entries.get((name, self._latest.get(name)))
+            return entry[1] if entry else None
+
+    def get(self, name, generation):
+        with self._lock:
+            entry = self._entries.get((name, generation))
+            if entry is None:
+                return None
+            self._entries.move_to_end((name, generation))
+            return entry[0]
+
+    def count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def put(self, name, generation, value, size):
+        evicted = []
+        with self._lock:
+            self._drop(name)
+            self._entries[(name, generation)] = (value, size)
+            self._latest[name] = generation
+            self.total_bytes += size
+            # Usuwaj najdawniej używane, ale nigdy właśnie wstawionego wpisu
+            while len(self._entries) > 1 and (
+                len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes
+            ):
+                (old_name, _), (_, old_size) = self._entries.popitem(last=False)
+                self._latest.pop(old_name, None)
+                self.total_bytes -= old_size
+                self.evictions += 1
+                evicted.append(old_name)
+        # Callback poza blokadą cache - może sięgać po blokady DataStore
+        if self.on_evict is not None:
+            for old_name in evicted:
+                self.on_evict(old_name)
+
+    def invalidate(self, name):
+        with self._lock:
+            self._drop(name)
+
+    def _drop(self, name):
+        if name not in self._latest:
+            return
+        entry = self._entries.pop((name, self._latest.pop(name)), None)
+        if entry is not None:
+            self.total_bytes -= entry[1]
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'bytes': self.total_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+_snapshot_cache = SnapshotCache(SNAPSHOT_CACHE_MAX_ENTRIES, SNAPSHOT_CACHE_MAX_BYTES)
+
+
+def _load_cached_blob(blob_name, known_generation, parse, parse_stream=None):
+    """Zwróć (sparsowana_lista, generacja) dla bloba, parsując go tylko dla nowej generacji.
+
+    Pobranie jest warunkowe względem znanej generacji (podanej lub najnowszej z cache);
+    przy 304 wynik pochodzi z cache bez ponownego dekodowania. Z parse_stream blob
+    o nieznanym rozmiarze lub dużym (STREAM_LOAD_MIN_BYTES) jest parsowany strumieniowo.
+    """
+    if known_generation is None:
+        known_generation = _snapshot_cache.latest_generation(blob_name)
+    if parse_stream is not None:
+        size_hint = _snapshot_cache.latest_size(blob_name)
+        if size_hint is None or size_hint >= STREAM_LOAD_MIN_BYTES:
+            value, generation, size = _stream_blob(blob_name, known_generation, parse, parse_stream)
+            if value is None:
+                cached = _snapshot_cache.get(blob_name, generation)
+                if cached is not None:
+                    _snapshot_cache.count(hit=True)
+                    return (cached, generation)
+                value, generation, size = _stream_blob(blob_name, None, parse, parse_stream)
+            _snapshot_cache.count(hit=False)
+            _snapshot_cache.put(blob_name, generation, value, size)
+            return (value, generation)
+    data, generation = _download_blob(blob_name, known_generation)
+    if data is None:
+        cached = _snapshot_cache.get(blob_name, generation)
+        if cached is not None:
+            _snapshot_cache.count(hit=True)
+            return (cached, generation)
+        # Wpis wypadł z cache - potrzebne pełne pobranie
+        data, generation = _download_blob(blob_name)
+    _snapshot_cache.count(hit=False)
+    value = parse(data) if data else []
+    _snapshot_cache.put(blob_name, generation, value, len(data))
+    return (value, generation)
+
+
+def snapshot_cache_stats():
+    return _snapshot_cache.stats()
+
+
+# ----------------------------------------------------------------------
+# Pliki lokalne: wersja pliku (mtime_ns, inode, rozmiar) pełni rolę generacji GCS -
+# 0 oznacza brak pliku. Zapis jest atomowy (plik tymczasowy + fsync + os.replace),
+# więc każdy zapis daje nowy inode, a czytelnik nigdy nie widzi połowy pliku.
+# ----------------------------------------------------------------------
+
+def _stat_version(st):
+    return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+
+def file_version(path):
+    """Wersja lokalnego pliku albo 0, gdy pliku nie ma."""
+    try:
+        return _stat_version(os.stat(path))
+    except FileNotFoundError:
+        return 0
+
+
+@contextmanager
+def _file_lock(path):
+    """Blokada doradcza fcntl na <path>.lock - szereguje zapisy pliku między procesami i wątkami."""
+    if fcntl is None:
+        yield
+        return
+    with open(path + '.lock', 'a') as lock:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+
+def _fsync_dir(directory):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return  # np. Windows - katalogu nie da się otworzyć do fsync
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _replace_file(path, payload, expected_generation=None):
+    """Zapisz plik atomowo i zwróć jego nową wersję.
+
+    Sprawdzenie wersji i podmiana odbywają się pod blokadą pliku, więc workery na jednej
+    maszynie nie nadpisują sobie zmian: jeśli plik ma inną wersję niż expected_generation
+    (0 = plik nie może jeszcze istnieć), zgłaszany jest WriteConflict. None = bez sprawdzania.
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    with _file_lock(path):
+        if expected_generation is not None and file_version(path) != expected_generation:
+            raise WriteConflict(path)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+                version = _stat_version(os.fstat(f.fileno()))
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        _fsync_dir(directory)
+    return version
+
+
+def _load_cached_file(path, parse, parse_stream=None):
+    """Lokalny odpowiednik _load_cached_blob: (sparsowana_wartość, wersja pliku).
+
+    Niezmieniony plik (ta sama wersja) pochodzi z cache po jednym stat, bez odczytu
+    i parsowania. Wersja nowego snapshotu pochodzi z fstat otwartego pliku, więc
+    zawsze odpowiada przeczytanej treści. Duże pliki (STREAM_LOAD_MIN_BYTES) są
+    parsowane przez parse_stream, jeśli podano.
+    """
+    version = file_version(path)
+    if version == 0:
+        return ([], 0)
+    cached = _snapshot_cache.get(path, version)
+    if cached is not None:
+        _snapshot_cache.count(hit=True)
+        return (cached, version)
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return ([], 0)
+    with f:
+        st = os.fstat(f.fileno())
+        version = _stat_version(st)
+        if parse_stream is not None and st.st_size >= STREAM_LOAD_MIN_BYTES:
+            value, size = parse_stream(f), st.st_size
+        else:
+            data = f.read()
+            value, size = (parse(data) if data else []), len(data)
+    _snapshot_cache.count(hit=False)
+    _snapshot_cache.put(path, version, value, size)
+    return (value, version)
+
+
+# ----------------------------------------------------------------------
+# Format zapisu: nagłówek "MN1 json\n" + JSON bez wcięć, opcjonalnie w gzip/zstd.
+# Odczyt rozpoznaje format po magicznych bajtach, więc stare pliki (czysty JSON
+# z wcięciami) i nowe mogą leżeć obok siebie.
+# ----------------------------------------------------------------------
+
+FORMAT_HEADER = b'MN1 '
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+_zstd_missing_reported = False
+
+
+def _zstd():
+    """Opcjonalny pakiet zstandard (importowany dopiero, gdy jest potrzebny)."""
+    global _zstd_missing_reported
+    try:
+        import zstandard
+    except ImportError:
+        if not _zstd_missing_reported:
+            _zstd_missing_reported = True
+            print("OSTRZEŻENIE: brak pakietu zstandard - format zstd niedostępny, zapis w formacie gzip")
+        return None
+    return zstandard
+
+
+def encode_document(document, fmt=None):
+    """Serializuj dokument w formacie STORAGE_FORMAT.
+
+    Zwraca (payload, content_encoding) - content_encoding to 'gzip' dla formatu gzip
+    (GCS dekompresuje wtedy blob przy pobraniu), w pozostałych przypadkach None.
+    """
+    fmt = fmt or STORAGE_FORMAT
+    if fmt == 'json':
+        # Stary format: czysty JSON z wcięciami, bez nagłówka
+        return json.dumps(document, indent=2, ensure_ascii=False, default=card_to_json).encode('utf-8'), None
+    body = FORMAT_HEADER + b'json\n' + json.dumps(
+        document, ensure_ascii=False, separators=(',', ':'), default=card_to_json
+    ).encode('utf-8')
+    if fmt == 'zstd':
+        zstandard = _zstd()
+        if zstandard is not None:
+            return zstandard.ZstdCompressor(level=9).compress(body), None
+        fmt = 'gzip'
+    if fmt == 'gzip':
+        return gzip.compress(body, compresslevel=6, mtime=0), 'gzip'
+    return body, None
+
+
+def decode_document(data):
+    """Odczytaj dokument zapisany przez encode_document (dowolny format, także stary JSON).
+
+    Pusty plik daje None.
+    """
+    if data[:2] == GZIP_MAGIC:
+        data = gzip.decompress(data)
+    elif data[:4] == ZSTD_MAGIC:
+        zstandard = _zstd()
+        if zstandard is None:
+            raise ValueError("Dane w formacie zstd, ale pakiet zstandard nie jest zainstalowany")
+        data = zstandard.ZstdDecompressor().decompress(data)
+    if data.startswith(FORMAT_HEADER):
+        header, _, data = data.partition(b'\n')
+        if header != FORMAT_HEADER + b'json':
+            raise ValueError(f"Nieobsługiwany nagłówek formatu: {header[:40]!r}")
+    data_str = data.decode('utf-8')
+    if not data_str.strip():
+        return None
+    return json.loads(data_str)
+
+
+_STREAM_CHUNK = 1 << 20
+
+
+def open_document_stream(raw):
+    """Strumień tekstowy dokumentu zapisanego przez encode_document, bez wczytywania całości.
+
+    raw to binarny obiekt plikowy (plik, BlobReader); format jest rozpoznawany
+    po magicznych bajtach i nagłówku, jak w decode_document.
+    """
+    if not hasattr(raw, 'peek'):
+        raw = io.BufferedReader(raw, _STREAM_CHUNK)
+    magic = raw.peek(len(ZSTD_MAGIC))[:len(ZSTD_MAGIC)]
+    if magic[:2] == GZIP_MAGIC:
+        raw = gzip.GzipFile(fileobj=raw, mode='rb')
+    elif magic == ZSTD_MAGIC:
+        zstandard = _zstd()
+        if zstandard is None:
+            raise ValueError("Dane w formacie zstd, ale pakiet zstandard nie jest zainstalowany")
+        raw = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw), _STREAM_CHUNK)
+    if raw.peek(len(FORMAT_HEADER)).startswith(FORMAT_HEADER):
+        header = raw.readline().rstrip(b'\n')
+        if header != FORMAT_HEADER + b'json':
+            raise ValueError(f"Nieobsługiwany nagłówek formatu: {header[:40]!r}")
+    return io.TextIOWrapper(raw, encoding='utf-8')
+
+
+class StreamingJsonList:
+    """Elementy listy z dokumentu JSON {klucz: [...]} (lub samej listy) czytane po jednym.
+
+    Każdy element jest parsowany osobno (json.JSONDecoder.raw_decode), a przeczytany
+    tekst jest od razu zwalniany - w pamięci jest tylko bieżący element i porcja danych,
+    nie cały dokument jako bajty i tekst naraz. Pola dokumentu przed listą (np.
+    schema_version) są dostępne w `fields` już w trakcie iteracji.
+    """
+
+    def __init__(self, text):
+        self.fields = {}
+        self._text = text
+        self._decoder = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self, size=_STREAM_CHUNK):
+        chunk = self._text.read(size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self):
+        """Pierwszy znak po białych znakach ('' na końcu danych)."""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in ' \t\n\r':
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError(f"Niepoprawny dokument JSON: oczekiwano {char!r}")
+        self._pos += 1
+
+    def _value(self):
+        self._peek()
+        size = _STREAM_CHUNK
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+                # Element niekompletny - doczytaj (porcje rosną, żeby nie parsować go w kółko)
+                self._fill(size)
+                size *= 2
+                continue
+            # Liczba lub literał na końcu bufora mogą mieć ciąg dalszy w kolejnej porcji
+            if end == len(self._buf) and not self._eof and self._fill(size):
+                continue
+            self._pos = end
+            return value
+
+    def _array(self):
+        self._expect('[')
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self._value()
+            if self._peek() != ',':
+                self._expect(']')
+                return
+            self._pos += 1
+
+    def items(self, key):
+        first = self._peek()
+        if first == '[':
+            yield from self._array()
+        elif first == '{':
+            self._pos += 1
+            if self._peek() == '}':
+                return
+            while True:
+                name = self._value()
+                self._expect(':')
+                if name == key and self._peek() == '[':
+                    yield from self._array()
+                    return
+                self.fields[name] = self._value()
+                if self._peek() != ',':
+                    self._expect('}')
+                    return
+                self._pos += 1
+
+
+def _content_type(content_encoding):
+    if content_encoding is None and STORAGE_FORMAT == 'zstd' and _zstd() is not None:
+        return 'application/zstd'
+    return 'application/json'
+
+
+def _upload(blob, payload, content_type, content_encoding, expected_generation):
+    blob.content_encoding = content_encoding
+    # Użyj if_generation_match dla optymistic locking
+    if expected_generation is not None:
+        blob.upload_from_string(payload, content_type=content_type, if_generation_match=expected_generation)
+    else:
+        blob.upload_from_string(payload, content_type=content_type)
+
+
+def _parse_users_document(data):
+    """Wyciągnij listę użytkowników z odszyfrowanego dokumentu (obsługuje stare formaty)."""
+    # Obsługa formatu: {"users": [...]}
+    if isinstance(data, dict) and 'users' in data and isinstance(data['users'], list):
+        # Walidacja: upewnij się że każdy element to słownik
+        valid_users = []
+        for item in data['users']:
+            if isinstance(item, dict):
+                valid_users.append(item)
+            else:
+                print(f"OSTRZEŻENIE: Nieprawidłowy format użytkownika: {item}")
+        return valid_users
+
+    # Obsługa starego formatu: {"login": {"haslo": ..., "data_utworzenia": ...}, ...}
+    if isinstance(data, dict):
+        migrated = []
+        for login, info in data.items():
+            migrated.append({
+                'login': login,
+                'haslo': info.get('haslo') or info.get('password'),
+                'data_utworzenia': info.get('data_utworzenia')
+            })
+        return migrated
+
+    # Jeśli już lista
+    if isinstance(data, list):
+        return data
+    return []
+
+
+def _decode_users_blob(encrypted_data):
+    """Stary format: cała lista użytkowników w jednym zaszyfrowanym users.json (tylko migracja)."""
+    return _parse_users_document(decode_document(cipher.decrypt(encrypted_data)))
+
+
+# ----------------------------------------------------------------------
+# Rekordy użytkowników: każdy użytkownik to osobny, szyfrowany plik/blob
+# users/<HMAC-SHA256(login)>.bin. Login nie jest widoczny w nazwie, a logowanie
+# czyta i odszyfrowuje jeden mały rekord zamiast całej listy.
+# ----------------------------------------------------------------------
+
+def user_record_name(login):
+    """Nazwa rekordu użytkownika: HMAC loginu kluczem LOGIN_HASH_KEY."""
+    digest = hmac.new(LOGIN_HASH_KEY, login.encode('utf-8'), hashlib.sha256).hexdigest()
+    return f"{digest}.bin"
+
+
+def _user_record_path(login):
+    return os.path.join(USERS_DIR, user_record_name(login))
+
+
+def _user_record_blob_name(login):
+    return USERS_PREFIX + user_record_name(login)
+
+
+def _decode_user_record(data):
+    user = decode_document(cipher.decrypt(data))
+    return user if isinstance(user, dict) and user.get('login') else None
+
+
+def _encode_user_record(user):
+    # Kompresja (jeśli włączona) przed szyfrowaniem - po nim dane są nieściśliwe
+    payload, _ = encode_document(user)
+    return cipher.encrypt(payload)
+
+
+def _user_record_cache_name(login):
+    return _user_record_blob_name(login) if USE_CLOUD_STORAGE else _user_record_path(login)
+
+
+def load_user(login, known_generation=None):
+    """Wczytaj rekord jednego użytkownika - z GCS (produkcja) lub lokalnie (development).
+    Zwraca tuple: (user albo None, generation); generacja 0 dla nieistniejącego rekordu
+    (lokalnie generacją jest wersja pliku). Niezmieniony rekord (ta sama generacja)
+    pochodzi z cache bez odszyfrowywania."""
+    if not USE_CLOUD_STORAGE:
+        # Wersja lokalna - pliki na dysku
+        try:
+            user, generation = _load_cached_file(_user_record_path(login), _decode_user_record)
+        except Exception as e:
+            print(f"Błąd podczas wczytywania użytkownika (lokalnie): {e}")
+            traceback.print_exc()
+            return (None, None)
+        return (user if user and user.get('login') == login else None, generation)
+
+    # Wersja cloud - Google Cloud Storage (warunkowe pobranie + cache odszyfrowanych rekordów)
+    try:
+        user, generation = _load_cached_blob(_user_record_blob_name(login), known_generation, _decode_user_record)
     except Exception as e:
-        print(f"Błąd podczas wczytywania użytkowników (cloud): {e}")
+        print(f"Błąd podczas wczytywania użytkownika (cloud): {e}")
         traceback.print_exc()
-        return ([], None)
+        return (None, None)
+    return (user if user and user.get('login') == login else None, generation)
+
 
-def save_users(users_data, expected_generation=None, max_retries=3):
-    """Zapisz użytkowników - do GCS (produkcja) lub lokalnie (development).
+def save_user(user, expected_generation=None):
+    """Zapisz rekord jednego użytkownika - do GCS (produkcja) lub lokalnie (development).
 
     Args:
-        users_data: dane do zapisania
-        expected_generation: oczekiwana generacja dla optymistic locking (tylko GCS)
-        max_retries: maksymalna liczba prób w przypadku konfliktu
+        user: rekord użytkownika (z polem 'login')
+        expected_generation: oczekiwana generacja dla optymistic locking; 0 = rekord
+            nie może jeszcze istnieć (rejestracja - działa także lokalnie)
 
     Returns:
-        True jeśli zapis się powiódł, False w przeciwnym razie
+        (True, nowa_generacja) jeśli zapis się powiódł, (False, None) w przeciwnym razie.
+
+    Raises:
+        WriteConflict: rekord zmienił się od odczytu expected_generation (lub już istnieje przy 0)
     """
+    login = user.get('login')
     if not USE_CLOUD_STORAGE:
-        # Wersja lokalna - pliki na dysku
+        # Wersja lokalna - atomowa podmiana pliku, wersja sprawdzana pod blokadą
+        path = _user_record_path(login)
         try:
-            wrapper = {'users': users_data}
-            json_data = json.dumps(wrapper, indent=2, ensure_ascii=False).encode('utf-8')
-            encrypted_data = cipher.encrypt(json_data)
-            with open(USERS_FILE, 'wb') as f:
-                f.write(encrypted_data)
-            return True
-        except (OSError, IOError) as e:
-            print(f"Błąd I/O podczas zapisywania użytkowników (lokalnie): {e}")
-            return False
+            payload = _encode_user_record(user)
+            generation = _replace_file(path, payload, expected_generation)
+            _snapshot_cache.put(path, generation, user, len(payload))
+            return (True, generation)
+        except WriteConflict:
+            raise
         except Exception as e:
-            print(f"Błąd podczas zapisywania użytkowników (lokalnie): {e}")
-            return False
+            print(f"Błąd podczas zapisywania użytkownika (lokalnie): {e}")
+            return (False, None)
+
+    # Wersja cloud - Google Cloud Storage
+    blob_name = _user_record_blob_name(login)
+    try:
+        payload = _encode_user_record(user)
+        blob = get_storage_client().bucket(BUCKET_NAME).blob(blob_name)
+        _upload(blob, payload, 'application/octet-stream', None, expected_generation)
+        # Zapisany rekord staje się aktualnym snapshotem - kolejny odczyt skończy się na 304
+        _snapshot_cache.put(blob_name, blob.generation, user, len(payload))
+        return (True, blob.generation)
+    except gcp_exceptions.PreconditionFailed:
+        raise WriteConflict(blob_name)
+    except Exception as e:
+        print(f"Błąd podczas zapisywania użytkownika (cloud): {e}")
+        return (False, None)
+
+
+def load_all_users():
+    """Wszystkie rekordy użytkowników (tylko dla operacji na wszystkich kontach, np. powiadomień).
+    W GCS generacje pochodzą z listingu - niezmienione rekordy nie są pobierane ani odszyfrowywane."""
+    users = []
+    if not USE_CLOUD_STORAGE:
+        if not os.path.isdir(USERS_DIR):
+            return users
+        for name in sorted(os.listdir(USERS_DIR)):
+            if not name.endswith('.bin'):
+                continue
+            try:
+                user, _ = _load_cached_file(os.path.join(USERS_DIR, name), _decode_user_record)
+            except Exception as e:
+                print(f"Błąd podczas wczytywania rekordu {name} (lokalnie): {e}")
+                continue
+            if user:
+                users.append(user)
+        return users
+
+    for blob in get_storage_client().list_blobs(BUCKET_NAME, prefix=USERS_PREFIX):
+        user = _snapshot_cache.get(blob.name, blob.generation)
+        if user is not None:
+            _snapshot_cache.count(hit=True)
+        else:
+            try:
+                user, _ = _load_cached_blob(blob.name, None, _decode_user_record)
+            except Exception as e:
+                print(f"Błąd podczas wczytywania rekordu {blob.name} (cloud): {e}")
+                continue
+        if user:
+            users.append(user)
+    return users
+
 
-    # Wersja cloud - Google Cloud Storage z retry logic
-    for attempt in range(max_retries):
+def migrate_legacy_users():
+    """Jednorazowa migracja zaszyfrowanego users.json ({"users": [...]}) do rekordów per użytkownik.
+
+    Rekordy są tworzone tylko, jeśli jeszcze nie istnieją, więc migracja jest idempotentna
+    i bezpieczna przy równoległym starcie workerów. Po udanym przeniesieniu stary plik
+    zostaje przemianowany na users.json.migrated. Błąd odszyfrowania przerywa migrację
+    bez zmian (plik zostaje na miejscu).
+    """
+    try:
+        if not USE_CLOUD_STORAGE:
+            if not os.path.exists(USERS_FILE):
+                return
+            with open(USERS_FILE, 'rb') as f:
+                data = f.read()
+        else:
+            data, generation = _download_blob(USERS_FILE_NAME)
+            if generation == 0:
+                return
+        legacy_users = _decode_users_blob(data) if data else []
+    except Exception as e:
+        print(f"Błąd podczas migracji użytkowników - users.json pozostaje bez zmian: {e}")
+        return
+
+    complete = True
+    for user in legacy_users:
+        if not user.get('login'):
+            continue
         try:
-            wrapper = {'users': users_data}
-            json_data = json.dumps(wrapper, indent=2, ensure_ascii=False).encode('utf-8')
-            encrypted_data = cipher.encrypt(json_data)
+            saved, _ = save_user(user, expected_generation=0)
+            complete = complete and saved
+        except WriteConflict:
+            pass  # rekord już istnieje (inny worker lub wcześniejsza, przerwana migracja)
+    if not complete:
+        print("Migracja użytkowników niekompletna - stary plik pozostaje na miejscu")
+        return
 
-            client = get_storage_client()
-            bucket = client.bucket(BUCKET_NAME)
+    try:
+        if not USE_CLOUD_STORAGE:
+            try:
+                os.replace(USERS_FILE, USERS_FILE + '.migrated')
+            except FileNotFoundError:
+                return  # inny worker już skończył migrację
+        else:
+            bucket = get_storage_client().bucket(BUCKET_NAME)
             blob = bucket.blob(USERS_FILE_NAME)
+            bucket.copy_blob(blob, bucket, USERS_FILE_NAME + '.migrated')
+            try:
+                blob.delete()
+            except gcp_exceptions.NotFound:
+                pass  # inny worker już skończył migrację
+        print(f"Zmigrowano {len(legacy_users)} użytkowników do rekordów w {USERS_PREFIX if USE_CLOUD_STORAGE else USERS_DIR + '/'}")
+    except Exception as e:
+        print(f"Błąd podczas zamykania migracji użytkowników: {e}")
 
-            # Użyj if_generation_match dla optymistic locking
-            if expected_generation is not None:
-                blob.upload_from_string(
-                    encrypted_data,
-                    content_type='application/octet-stream',
-                    if_generation_match=expected_generation
-                )
-            else:
-                blob.upload_from_string(encrypted_data, content_type='application/octet-stream')
 
-            return True
+def shard_file_name(author):
+    """Nazwa pliku/bloba z zestawami danego autora (login zakodowany bezpiecznie dla ścieżek)."""
+    return f"{quote(author, safe='')}.json"
 
-        except gcp_exceptions.PreconditionFailed:
-            # Konflikt - ktoś inny zmodyfikował plik
-            print(f"Konflikt przy zapisie użytkowników (próba {attempt + 1}/{max_retries})")
-            if attempt < max_retries - 1:
-                time.sleep(0.1 * (attempt + 1))  # Exponential backoff
-                continue
-            else:
-                print("Nie udało się zapisać użytkowników po wszystkich próbach")
-                return False
 
-        except Exception as e:
-            print(f"Błąd podczas zapisywania użytkowników (cloud): {e}")
-            return False
+def _shard_path(author):
+    return os.path.join(SETS_DIR, shard_file_name(author))
 
-    return False
 
-def load_sets():
-    """Wczytaj zestawy fiszek - z GCS (produkcja) lub lokalnie (development).
-    Zwraca tuple: (sets_data, generation) dla GCS lub (sets_data, None) dla lokalnego."""
+def _shard_blob_name(author):
+    return SETS_PREFIX + shard_file_name(author)
+
+
+def _parse_sets_document(data):
+    """Wyciągnij listę zestawów z dokumentu {"sets": [...]} (lub samej listy), pomijając niepoprawne wpisy.
+
+    Zestawy ze starszej wersji schematu są migrowane (raz, przy wczytaniu snapshotu).
+    """
+    if isinstance(data, dict) and 'sets' in data and isinstance(data['sets'], list):
+        sets_list = data['sets']
+    elif isinstance(data, list):
+        sets_list = data
+    else:
+        return []
+    # Walidacja: upewnij się że każdy element to słownik; karty -> obiekty Card
+    version = document_version(data)
+    valid_sets = []
+    for item in sets_list:
+        if isinstance(item, dict):
+            valid_sets.append(normalize_set(item, version))
+        else:
+            print(f"OSTRZEŻENIE: Nieprawidłowy format zestawu: {type(item)} - {item}")
+    return valid_sets
+
+
+def _stream_sets(raw):
+    """Strumieniowy odpowiednik _decode_sets_blob: zestawy parsowane i walidowane po jednym."""
+    valid_sets = []
+    reader = StreamingJsonList(open_document_stream(raw))
+    for item in reader.items('sets'):
+        if isinstance(item, dict):
+            # schema_version jest zapisywane przed listą zestawów
+            valid_sets.append(normalize_set(item, document_version(reader.fields)))
+        else:
+            print(f"OSTRZEŻENIE: Nieprawidłowy format zestawu: {type(item)} - {item}")
+    return valid_sets
+
+
+def _decode_sets_blob(data):
+    document = decode_document(data)
+    if document is None:
+        return []
+    return _parse_sets_document(document)
+
+
+def load_sets(author, known_generation=None, strict=False):
+    """Wczytaj shard z zestawami jednego autora - z GCS (produkcja) lub lokalnie (development).
+    Zwraca tuple: (sets_data, generation); lokalnie generacją jest wersja pliku (mtime/inode/rozmiar).
+    Dla nieistniejącego sharda generacja wynosi 0 (zapis utworzy go tylko, jeśli nadal nie istnieje).
+    Niezmieniony shard (ta sama generacja) jest zwracany z cache bez ponownego parsowania.
+    Błąd odczytu daje ([], None), a przy strict=True - ShardLoadError (ścieżki zapisu nie mogą
+    potraktować nieudanego odczytu jak pustego sharda)."""
     if not USE_CLOUD_STORAGE:
-        # Wersja lokalna - pliki na dysku
-        if not os.path.exists(SETS_FILE):
-            return ([], None)
+        # Wersja lokalna - pliki na dysku (jeden stat, jeśli plik się nie zmienił)
         try:
-            with open(SETS_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                if isinstance(data, dict) and 'sets' in data and isinstance(data['sets'], list):
-                    return (data['sets'], None)
-                if isinstance(data, list):
-                    return (data, None)
-                return ([], None)
+            return _load_cached_file(_shard_path(author), _decode_sets_blob, _stream_sets)
         except (OSError, IOError) as e:
             print(f"Błąd I/O podczas wczytywania zestawów (lokalnie): {e}")
-            return ([], None)
+            error = e
         except (json.JSONDecodeError, UnicodeDecodeError) as e:
             print(f"Błąd dekodowania danych zestawów (lokalnie): {e}")
-            return ([], None)
+            error = e
         except Exception as e:
             print(f"Błąd podczas wczytywania zestawów (lokalnie): {e}")
             traceback.print_exc()
-            return ([], None)
+            error = e
+    else:
+        # Wersja cloud - Google Cloud Storage (warunkowe pobranie + cache sparsowanych snapshotów)
+        try:
+            return _load_cached_blob(_shard_blob_name(author), known_generation, _decode_sets_blob, _stream_sets)
+        except Exception as e:
+            print(f"Błąd podczas wczytywania zestawów (cloud): {e}")
+            traceback.print_exc()
+            error = e
+    if strict:
+        raise ShardLoadError(author) from error
+    return ([], None)
+
+def save_sets(author, sets_data, expected_generation=None):
+    """Zapisz shard z zestawami jednego autora - do GCS (produkcja) lub lokalnie (development).
+
+    Args:
+        author: login autora (właściciel sharda)
+        sets_data: zestawy autora do zapisania
+        expected_generation: oczekiwana generacja dla optymistic locking (tylko GCS)
+
+    Returns:
+        (True, nowa_generacja) jeśli zapis się powiódł, (False, None) w przeciwnym razie.
+        Zapisany shard trafia do cache snapshotów jako aktualna wersja - nie trzeba go ponownie wczytywać.
+
+    Raises:
+        WriteConflict: ktoś inny (także inny worker na tej samej maszynie) zmodyfikował shard
+            od czasu odczytu expected_generation
+    """
+    if not USE_CLOUD_STORAGE:
+        # Wersja lokalna - atomowa podmiana pliku, wersja sprawdzana pod blokadą
+        try:
+            payload, _ = encode_document({'schema_version': SCHEMA_VERSION, 'sets': sets_data})
+            path = _shard_path(author)
+            generation = _replace_file(path, payload, expected_generation)
+            _snapshot_cache.put(path, generation, sets_data, len(payload))
+            return (True, generation)
+        except WriteConflict:
+            raise
+        except (OSError, IOError) as e:
+            print(f"Błąd I/O podczas zapisywania zestawów (lokalnie): {e}")
+            return (False, None)
+        except Exception as e:
+            print(f"Błąd podczas zapisywania zestawów (lokalnie): {e}")
+            return (False, None)
 
     # Wersja cloud - Google Cloud Storage
     try:
+        payload, content_encoding = encode_document({'schema_version': SCHEMA_VERSION, 'sets': sets_data})
         client = get_storage_client()
         bucket = client.bucket(BUCKET_NAME)
-        blob = bucket.blob(SETS_FILE_NAME)
+        blob = bucket.blob(_shard_blob_name(author))
+        _upload(blob, payload, _content_type(content_encoding), content_encoding, expected_generation)
 
-        if not blob.exists():
-            print(f"Plik {SETS_FILE_NAME} nie istnieje w bucket {BUCKET_NAME}")
-            return ([], None)
+        # Generacja z odpowiedzi na upload - zapisany shard staje się aktualnym snapshotem
+        _snapshot_cache.put(blob.name, blob.generation, sets_data, len(payload))
+        return (True, blob.generation)
 
-        # Pobierz dane wraz z generacją (dla optymistic locking)
-        blob.reload()
-        data_str = blob.download_as_text()
-        generation = blob.generation
+    except gcp_exceptions.PreconditionFailed:
+        # Konflikt - ktoś inny zmodyfikował shard; ponowienie z tą samą generacją nie ma sensu
+        raise WriteConflict(_shard_blob_name(author))
 
-        if not data_str.strip():
-            return ([], generation)
-
-        data = json.loads(data_str)
-        if isinstance(data, dict) and 'sets' in data and isinstance(data['sets'], list):
-            sets_list = data['sets']
-            # Walidacja: upewnij się że każdy element to słownik
-            valid_sets = []
-            for item in sets_list:
-                if isinstance(item, dict):
-                    valid_sets.append(item)
-                else:
-                    print(f"OSTRZEŻENIE: Nieprawidłowy format zestawu: {type(item)} - {item}")
-            return (valid_sets, generation)
-        if isinstance(data, list):
-            # Walidacja dla formatu bez wrappera
-            valid_sets = []
-            for item in data:
-                if isinstance(item, dict):
-                    valid_sets.append(item)
-                else:
-                    print(f"OSTRZEŻENIE: Nieprawidłowy format zestawu: {type(item)} - {item}")
-            return (valid_sets, generation)
-        return ([], generation)
     except Exception as e:
-        print(f"Błąd podczas wczytywania zestawów (cloud): {e}")
-        traceback.print_exc()
-        return ([], None)
+        print(f"Błąd podczas zapisywania zestawów (cloud): {e}")
+        return (False, None)
 
-def save_sets(sets_data, expected_generation=None, max_retries=3):
-    """Zapisz zestawy fiszek - do GCS (produkcja) lub lokalnie (development).
 
-    Args:
-        sets_data: dane do zapisania
-        expected_generation: oczekiwana generacja dla optymistic locking (tylko GCS)
-        max_retries: maksymalna liczba prób w przypadku konfliktu
+def _group_sets_by_author(sets_data):
+    grouped = {}
+    for zestaw in sets_data:
+        author = zestaw.get('autor')
+        if not author:
+            print(f"OSTRZEŻENIE: Zestaw bez autora pominięty przy migracji: {zestaw.get('id', '?')}")
+            continue
+        grouped.setdefault(author, []).append(zestaw)
+    return grouped
 
-    Returns:
-        True jeśli zapis się powiódł, False w przeciwnym razie
+
+def _merge_into_shard(author, legacy_sets):
+    """Dopisz zestawy ze starego pliku do sharda autora (pomijając id, które już tam są)."""
+    for attempt in range(WRITE_MAX_RETRIES):
+        try:
+            current, generation = load_sets(author, strict=True)
+        except ShardLoadError:
+            return False
+        known_ids = {s.get('id') for s in current}
+        missing = [s for s in legacy_sets if s.get('id') not in known_ids]
+        if not missing:
+            return True
+        try:
+            saved, _ = save_sets(author, current + missing, generation)
+            return saved
+        except WriteConflict:
+            _backoff(attempt)
+    return False
+
+
+def migrate_legacy_sets():
+    """Jednorazowa migracja monolitycznego sets.json ({"sets": [...]}) do shardów per autor.
+
+    Migracja jest idempotentna (zestawy dopisywane po id), więc równoległy start kilku
+    workerów jest bezpieczny. Po udanym podziale stary plik zostaje przemianowany
+    na sets.json.migrated, a kolejne starty kończą się na jednym sprawdzeniu istnienia pliku.
     """
     if not USE_CLOUD_STORAGE:
-        # Wersja lokalna - pliki na dysku
+        if not os.path.exists(SETS_FILE):
+            return
         try:
-            wrapper = {'sets': sets_data}
-            with open(SETS_FILE, 'w', encoding='utf-8') as f:
-                json.dump(wrapper, f, indent=2, ensure_ascii=False)
-            return True
-        except (OSError, IOError) as e:
-            print(f"Błąd I/O podczas zapisywania zestawów (lokalnie): {e}")
-            return False
+            with open(SETS_FILE, 'rb') as f:
+                legacy_sets = _stream_sets(f)
         except Exception as e:
-            print(f"Błąd podczas zapisywania zestawów (lokalnie): {e}")
-            return False
+            print(f"Błąd podczas migracji zestawów (lokalnie): {e}")
+            return
+        grouped = _group_sets_by_author(legacy_sets)
+        if all(_merge_into_shard(author, author_sets) for author, author_sets in grouped.items()):
+            try:
+                os.replace(SETS_FILE, SETS_FILE + '.migrated')
+            except FileNotFoundError:
+                return  # inny worker już skończył migrację
+            print(f"Zmigrowano {len(legacy_sets)} zestawów do {len(grouped)} shardów w {SETS_DIR}/")
+        return
 
-    # Wersja cloud - Google Cloud Storage z retry logic
-    for attempt in range(max_retries):
+    try:
+        legacy_sets, generation, _ = _stream_blob(SETS_FILE_NAME, None, _decode_sets_blob, _stream_sets)
+        if generation == 0:
+            return
+        bucket = get_storage_client().bucket(BUCKET_NAME)
+        blob = bucket.blob(SETS_FILE_NAME)
+        grouped = _group_sets_by_author(legacy_sets)
+        if not all(_merge_into_shard(author, author_sets) for author, author_sets in grouped.items()):
+            print("Migracja zestawów niekompletna - stary plik pozostaje na miejscu")
+            return
+        bucket.copy_blob(blob, bucket, SETS_FILE_NAME + '.migrated')
         try:
-            wrapper = {'sets': sets_data}
-            client = get_storage_client()
-            bucket = client.bucket(BUCKET_NAME)
-            blob = bucket.blob(SETS_FILE_NAME)
-
-            # Użyj if_generation_match dla optymistic locking
-            if expected_generation is not None:
-                blob.upload_from_string(
-                    json.dumps(wrapper, ensure_ascii=False, indent=2),
-                    content_type='application/json',
-                    if_generation_match=expected_generation
-                )
-            else:
-                blob.upload_from_string(
-                    json.dumps(wrapper, ensure_ascii=False, indent=2),
-                    content_type='application/json'
-                )
+            blob.delete()
+        except gcp_exceptions.NotFound:
+            pass  # inny worker już skończył migrację
+        print(f"Zmigrowano {len(legacy_sets)} zestawów do {len(grouped)} shardów w {SETS_PREFIX}")
+    except Exception as e:
+        print(f"Błąd podczas migracji zestawów (cloud): {e}")
+        traceback.print_exc()
 
-            return True
 
-        except gcp_exceptions.PreconditionFailed:
-            # Konflikt - ktoś inny zmodyfikował plik
-            print(f"Konflikt przy zapisie zestawów (próba {attempt + 1}/{max_retries})")
-            if attempt < max_retries - 1:
-                time.sleep(0.1 * (attempt + 1))  # Exponential backoff
+
+def list_set_authors():
+    """Loginy autorów, dla których istnieje shard z zestawami (lokalnie lub w GCS)."""
+    suffix = '.json'
+    if not USE_CLOUD_STORAGE:
+        if not os.path.isdir(SETS_DIR):
+            return []
+        names = os.listdir(SETS_DIR)
+    else:
+        blobs = get_storage_client().list_blobs(BUCKET_NAME, prefix=SETS_PREFIX)
+        names = [blob.name[len(SETS_PREFIX):] for blob in blobs]
+    return sorted(unquote(name[:-len(suffix)]) for name in names if name.endswith(suffix) and '/' not in name)
+
+
+def shard_generations():
+    """Generacje wszystkich shardów w GCS jednym listowaniem: autor -> generacja."""
+    suffix = '.json'
+    generations = {}
+    for blob in get_storage_client().list_blobs(BUCKET_NAME, prefix=SETS_PREFIX):
+        name = blob.name[len(SETS_PREFIX):]
+        if name.endswith(suffix) and '/' not in name:
+            generations[unquote(name[:-len(suffix)])] = blob.generation
+    return generations
+
+
+def local_shard_version(author):
+    """Wersja lokalnego pliku sharda (generacja w trybie lokalnym), 0 gdy pliku nie ma."""
+    return file_version(_shard_path(author))
+
+class ShardDraft(list):
+    """Robocza kopia sharda, na której działają mutacje (copy-on-write).
+
+    Lista jest płytką kopią opublikowanego snapshotu - dodanie lub usunięcie zestawu
+    nie zmienia snapshotu czytanego przez inne wątki. Zestaw, który mutacja zmienia,
+    trzeba pobrać przez edit(set_id): przy pierwszym dostępie jest kopiowany głęboko
+    i podmieniany w drafcie. Zestawów zwracanych przez iterację nie wolno modyfikować.
+    """
+
+    def __init__(self, snapshot):
+        super().__init__(snapshot)
+        self._owned = set()
+
+    def edit(self, set_id):
+        """Zestaw o danym id do modyfikacji (prywatna kopia draftu) lub None."""
+        for i, zestaw in enumerate(self):
+            if zestaw.get('id') == set_id:
+                if id(zestaw) not in self._owned:
+                    zestaw = copy.deepcopy(zestaw)
+                    self[i] = zestaw
+                    self._owned.add(id(zestaw))
+                return zestaw
+        return None
+
+
+class RequestSnapshots:
+    """Shardy przypięte do bieżącego żądania (wątku) - spójny widok danych przez całe żądanie.
+
+    Pierwsze reload_sets/user_sets autora przypina opublikowany snapshot; kolejne odczyty
+    w tym samym żądaniu widzą ten sam snapshot, nawet jeśli inny wątek opublikował w tym
+    czasie nowszy. Publikacja z tego samego wątku (własny zapis) podmienia przypięcie.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _pins(self):
+        pins = getattr(self._local, 'pins', None)
+        if pins is None:
+            pins = self._local.pins = {}
+        return pins
+
+    def pin(self, author, sets_data, by_id):
+        self._pins()[author] = (sets_data, by_id)
+
+    def repin(self, author, sets_data, by_id):
+        pins = self._pins()
+        if author in pins:
+            pins[author] = (sets_data, by_id)
+
+    def sets(self, author):
+        entry = self._pins().get(author)
+        return entry[0] if entry else None
+
+    def find(self, set_id):
+        for _, by_id in self._pins().values():
+            zestaw = by_id.get(set_id)
+            if zestaw is not None:
+                return zestaw
+        return None
+
+    def clear(self):
+        self._local.pins = {}
+
+
+class WriteBehindFlusher:
+    """Wątek w tle, który zapisuje oczekujące zmiany zestawów (tryb write-behind).
+
+    Pierwsza mutacja po okresie ciszy budzi wątek; czeka on `interval` sekund, zbierając
+    kolejne mutacje, i wywołuje `flush()` - każdy zmieniony shard jest wysyłany raz,
+    niezależnie od liczby mutacji z tego okna. Wątek startuje leniwie, więc po forku
+    workera Gunicorna powstaje w procesie, który faktycznie obsługuje żądania.
+    """
+
+    def __init__(self, flush, interval):
+        self._flush = flush
+        self.interval = interval
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.mutations_flushed = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+
+    def notify(self):
+        """Zasygnalizuj nowe mutacje (uruchamia wątek, jeśli jeszcze nie działa)."""
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait()
+            self._wake.clear()
+            # Okno zbierania: mutacje z tego czasu trafią do jednego uploadu na shard
+            self._stopped.wait(self.interval)
+            try:
+                self._flush()
+            except Exception as e:
+                print(f"Błąd wątku write-behind: {e}")
+                traceback.print_exc()
+
+    @property
+    def stopped(self):
+        return self._stopped.is_set()
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def record(self, mutations, latency, ok):
+        with self._stats_lock:
+            self.flushes += 1
+            if not ok:
+                self.failed_flushes += 1
+                return
+            self.mutations_flushed += mutations
+            self.last_latency = latency
+            self.max_latency = max(self.max_latency, latency)
+            self.total_latency += latency
+
+    def stats(self):
+        with self._stats_lock:
+            succeeded = self.flushes - self.failed_flushes
+            return {
+                'flushes': self.flushes,
+                'failed_flushes': self.failed_flushes,
+                'mutations_flushed': self.mutations_flushed,
+                'last_flush_ms': round(self.last_latency * 1000, 1),
+                'max_flush_ms': round(self.max_latency * 1000, 1),
+                'avg_flush_ms': round(self.total_latency * 1000 / succeeded, 1) if succeeded else 0.0,
+            }
+
+
+class GenerationWatcher:
+    """Wątek w tle, który odświeża wczytane shardy poza ścieżką żądania.
+
+    Co `interval` sekund wywołuje `poll()` - sprawdzenie wersji shardów obecnych w pamięci
+    (w GCS jedno listowanie z generacjami, lokalnie mtime/inode pliku) i podmianę zmienionych
+    na świeże snapshoty. Wątek startuje leniwie, przy pierwszym wczytanym shardzie.
+    """
+
+    def __init__(self, poll, interval):
+        self._poll = poll
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.polls = 0
+        self.failed_polls = 0
+        self.refreshed = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+
+    def start(self):
+        with self._thread_lock:
+            if self._stopped.is_set() or (self._thread is not None and self._thread.is_alive()):
+                return
+            self._thread = threading.Thread(target=self._run, name='generation-watcher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            started = time.monotonic()
+            try:
+                refreshed = self._poll()
+            except Exception as e:
+                print(f"Błąd watchera generacji: {e}")
+                with self._stats_lock:
+                    self.polls += 1
+                    self.failed_polls += 1
                 continue
-            else:
-                print("Nie udało się zapisać zestawów po wszystkich próbach")
-                return False
+            latency = time.monotonic() - started
+            with self._stats_lock:
+                self.polls += 1
+                self.refreshed += refreshed
+                self.last_latency = latency
+                self.max_latency = max(self.max_latency, latency)
 
-        except Exception as e:
-            print(f"Błąd podczas zapisywania zestawów (cloud): {e}")
-            return False
+    def stop(self, timeout=None):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
 
-    return False
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'polls': self.polls,
+                'failed_polls': self.failed_polls,
+                'refreshed': self.refreshed,
+                'last_poll_ms': round(self.last_latency * 1000, 1),
+                'max_poll_ms': round(self.max_latency * 1000, 1),
+            }
 
 
 class DataStore:
+    """Dane aplikacji współdzielone przez wątki workera (gthread).
+
+    Shardy zestawów są publikowane jako niezmienne snapshoty: żądanie czyta snapshot
+    przypięty na początku (RequestSnapshots), a zapis buduje nową wersję na kopii
+    (ShardDraft) i podmienia ją w indeksach dopiero po udanym zapisie.
+    """
+
     def __init__(self):
-        self.users, self.users_generation = load_users()
-        self.sets, self.sets_generation = load_sets()
+        # Indeksy: login -> użytkownik, autor -> lista zestawów (shard), id -> zestaw
+        self.users_by_login = {}
+        self.sets_by_author = {}
+        self.sets_by_id = {}
+        self._shard_ids = {}  # autor -> {id: zestaw} opublikowanego snapshotu
+        self._index_lock = threading.Lock()
+        self._snapshots = RequestSnapshots()
+        self._due_indexes = DueIndexes()
+        self._valid_cards = ValidCardsCache()
+        migrate_legacy_users()
+        migrate_legacy_sets()
+        # Sparsowane shardy żyją w ograniczonym cache snapshotów; indeksy zestawów trzymają
+        # tylko shardy obecne w cache (wyrzucenie z cache zdejmuje je z indeksów).
+        self.sets_generations = {}
+        self._author_by_cache_name = {}
+        _snapshot_cache.on_evict = self._forget_shard
+        # Write-behind: autor -> mutacje już nałożone na shard w pamięci, ale jeszcze niezapisane
+        self._pending_sets = {}
+        self._set_locks = {}
+        self._flusher = WriteBehindFlusher(self.flush_sets, WRITE_BEHIND_INTERVAL_MS / 1000) if WRITE_BEHIND else None
+        self._watcher = (
+            GenerationWatcher(self._poll_generations, SNAPSHOT_WATCH_INTERVAL_MS / 1000)
+            if SNAPSHOT_WATCH_INTERVAL_MS > 0 else None
+        )
+        # Liczniki przeładowań: 'skipped' = generacja bez zmian, pominięto pobranie i parsowanie
+        self.reload_counters = {
+            'users': {'reloads': 0, 'skipped': 0},
+            'sets': {'reloads': 0, 'skipped': 0},
+        }
+
+    @property
+    def users(self):
+        """Użytkownicy wczytani do pamięci (pełna lista po reload_users)."""
+        return list(self.users_by_login.values())
 
     def reload_users(self):
-        if USE_CLOUD_STORAGE:
-            self.users, self.users_generation = load_users()
+        """Wczytaj wszystkie rekordy użytkowników - tylko dla operacji na wszystkich kontach."""
+        self.users_by_login = {u.get('login'): u for u in load_all_users()}
+        self._count_reload('users', False)
 
-    def reload_sets(self):
-        if USE_CLOUD_STORAGE:
-            self.sets, self.sets_generation = load_sets()
+    def get_user(self, login):
+        """Świeży rekord użytkownika: jeden mały odczyt (w GCS warunkowy względem znanej generacji,
+        lokalnie jeden stat, jeśli plik się nie zmienił)."""
+        if not login:
+            return None
+        previous_generation = _snapshot_cache.latest_generation(_user_record_cache_name(login))
+        user, generation = load_user(login)
+        self._count_reload('users', previous_generation is not None and generation == previous_generation)
+        if user is None:
+            self.users_by_login.pop(login, None)
+        else:
+            self.users_by_login[login] = user
+        return user
 
-    def save_and_reload_users(self):
-        if not save_users(self.users, self.users_generation):
-            print('Warning: save_users failed, skipping reload')
-            return
-        self.users, self.users_generation = load_users()
+    def _set_lock(self, author):
+        lock = self._set_locks.get(author)
+        if lock is None:
+            lock = self._set_locks.setdefault(author, threading.RLock())
+        return lock
+
+    def reload_sets(self, author):
+        """Przeładuj shard autora, przypnij go do bieżącego żądania i zwróć jego zestawy.
+
+        W GCS pobranie jest warunkowe względem znanej generacji sharda - jeśli się
+        nie zmieniła, shard pochodzi z cache snapshotów bez pobierania i parsowania
+        (lokalnie tak samo, po jednym stat pliku - zapisy innych workerów są widoczne od razu).
+        """
+        return self._pin(author, self._refresh_shard(author))
+
+    def read_sets(self, author):
+        """Zestawy autora dla widoków tylko do odczytu.
+
+        Przy działającym watcherze generacji (SNAPSHOT_WATCH_INTERVAL_MS) z pamięci, bez
+        sprawdzania storage - nieaktualne najwyżej o interwał watchera. Bez watchera jak reload_sets.
+        """
+        if self._watcher is None:
+            return self.reload_sets(author)
+        return self.user_sets(author)
+
+    def _refresh_shard(self, author, strict=False):
+        """Najnowszy snapshot sharda. Shard z niezapisanymi zmianami (write-behind) nie jest
+        nadpisywany; jeśli trzeba go wczytać od nowa, oczekujące mutacje są nakładane ponownie.
+        Nieudany odczyt daje pustą listę tylko dla bieżącego żądania (strict=True - ShardLoadError)."""
+        with self._set_lock(author):
+            pending = self._pending_sets.get(author)
+            if pending and author in self.sets_by_author:
+                return self.sets_by_author[author]
+            try:
+                sets_data = self._load_shard(author)
+            except ShardLoadError:
+                if strict:
+                    raise
+                return []
+            if pending:
+                draft = ShardDraft(sets_data)
+                for mutation in pending:
+                    mutation(draft)
+                sets_data = list(draft)
+                self._set_shard(author, sets_data, self.sets_generations.get(author))
+            return sets_data
+
+    def _pin(self, author, sets_data):
+        with self._index_lock:
+            by_id = self._shard_ids.get(author) if self.sets_by_author.get(author) is sets_data else None
+        if by_id is None:
+            # Snapshot zdążył zniknąć z indeksów (wyrzucenie z cache) - indeks tylko dla żądania
+            by_id = {zestaw.get('id'): zestaw for zestaw in sets_data}
+        self._snapshots.pin(author, sets_data, by_id)
+        return sets_data
+
+    def end_request(self):
+        """Zwolnij snapshoty przypięte do bieżącego żądania (teardown_request w app.py)."""
+        self._snapshots.clear()
+
+    def _load_shard(self, author):
+        previous_generation = self.sets_generations.get(author)
+        # Nieudany odczyt nie jest publikowany - pusty snapshot bez generacji stałby się bazą zapisu
+        sets_data, generation = load_sets(author, previous_generation, strict=True)
+        self._set_shard(author, sets_data, generation)
+        self._count_reload('sets', previous_generation is not None and generation == previous_generation)
+        return sets_data
+
+    def _set_shard(self, author, sets_data, generation):
+        """Opublikuj snapshot sharda autora; indeks id jest przebudowywany tylko dla nowego snapshotu."""
+        with self._index_lock:
+            self.sets_generations[author] = generation
+            if self.sets_by_author.get(author) is not sets_data:
+                by_id = {zestaw.get('id'): zestaw for zestaw in sets_data}
+                # Najpierw nowe wpisy, potem usunięcie nieaktualnych - odczyt bez blokady nie trafi na lukę
+                self.sets_by_id.update(by_id)
+                self._forget_author_sets(author, keep=by_id)
+                self.sets_by_author[author] = sets_data
+                self._shard_ids[author] = by_id
+                self._author_by_cache_name[self._shard_cache_name(author)] = author
+            by_id = self._shard_ids[author]
+        self._snapshots.repin(author, sets_data, by_id)
+        self._valid_cards.retain(author, sets_data)
+        if self._watcher is not None:
+            self._watcher.start()
+
+    def _poll_generations(self):
+        """Krok watchera: podmień shardy w pamięci, których wersja w storage się zmieniła.
+
+        Shardy z niezapisanymi zmianami (write-behind) są pomijane - ich zapis i tak
+        sprawdza generację. Zwraca liczbę odświeżonych shardów.
+        """
+        with self._index_lock:
+            authors = list(self.sets_by_author)
+            known = dict(self.sets_generations)
+        current = shard_generations() if USE_CLOUD_STORAGE else None
+        refreshed = 0
+        for author in authors:
+            version = current.get(author, 0) if current is not None else local_shard_version(author)
+            if version == known.get(author) or author in self._pending_sets:
+                continue
+            self._refresh_shard(author)
+            refreshed += 1
+        return refreshed
+
+    def _forget_author_sets(self, author, keep=()):
+        self.sets_by_author.pop(author, None)
+        for set_id, zestaw in (self._shard_ids.pop(author, None) or {}).items():
+            if set_id not in keep and self.sets_by_id.get(set_id) is zestaw:
+                del self.sets_by_id[set_id]
+
+    def _forget_shard(self, cache_name):
+        """Callback cache snapshotów: wyrzucony shard znika z indeksów, chyba że czeka na zapis."""
+        author = self._author_by_cache_name.get(cache_name)
+        if author is not None and author not in self._pending_sets:
+            self._drop_shard(author)
+
+    def _drop_shard(self, author):
+        with self._index_lock:
+            self._author_by_cache_name.pop(self._shard_cache_name(author), None)
+            self._forget_author_sets(author)
+            self.sets_generations.pop(author, None)
+        self._due_indexes.drop(author)
+        self._valid_cards.drop(author)
+
+    def _count_reload(self, kind, skipped):
+        with self._index_lock:
+            self.reload_counters[kind]['reloads'] += 1
+            if skipped:
+                self.reload_counters[kind]['skipped'] += 1
+
+    def _shard_cache_name(self, author):
+        return _shard_blob_name(author) if USE_CLOUD_STORAGE else _shard_path(author)
+
+    def user_sets(self, author):
+        """Zestawy autora ze snapshotu przypiętego do żądania (tylko do odczytu - zmiany przez update_*)."""
+        pinned = self._snapshots.sets(author)
+        if pinned is not None:
+            return pinned
+        sets_data = self.sets_by_author.get(author)
+        if sets_data is None:
+            sets_data = self._refresh_shard(author)
+        return self._pin(author, sets_data)
+
+    def get_set(self, set_id):
+        """Zestaw o danym id (O(1)) - najpierw z przypiętych snapshotów; właściciela sprawdza wywołujący."""
+        zestaw = self._snapshots.find(set_id)
+        if zestaw is not None:
+            return zestaw
+        return self.sets_by_id.get(set_id)
+
+    def due_index(self, author):
+        """Indeks terminów powtórek (due_index.DueIndex) snapshotu autora przypiętego do żądania."""
+        return self._due_indexes.get(author, self.user_sets(author))
+
+    def valid_cards(self, zestaw):
+        """Projekcja poprawnych kart (valid_cards.ValidCards) zestawu z opublikowanego snapshotu."""
+        return self._valid_cards.get(zestaw)
+
+    # ------------------------------------------------------------------
+    # Zapisy jako mutacje: przy konflikcie generacji przeładuj świeży snapshot,
+    # zastosuj mutację ponownie i ponów zapis (z losowym odstępem).
+    # ------------------------------------------------------------------
+
+    def update_sets(self, author, mutation):
+        """Zastosuj mutation(sets_data) do sharda autora i zapisz go.
+
+        sets_data to ShardDraft: zestawy można dodawać i usuwać, a zmieniany zestaw
+        trzeba pobrać przez sets_data.edit(set_id). Mutacja zwraca True, jeśli coś
+        zmieniła (wtedy shard jest zapisywany); musi dać się bezpiecznie zastosować
+        ponownie do świeżo wczytanego sharda po konflikcie.
+        Zwraca True, jeśli zmiana została zapisana (lub nie była potrzebna).
+
+        W trybie write-behind (WRITE_BEHIND) mutacja jest nakładana tylko na kopię
+        w pamięci, a zapis wykonuje wątek w tle - True oznacza wtedy przyjęcie zmiany.
+        """
+        with self._set_lock(author):
+            if self._flusher is None:
+                return self._commit_sets(author, [mutation])
+            try:
+                draft = ShardDraft(self._refresh_shard(author, strict=True))
+            except ShardLoadError:
+                return False
+            if mutation(draft):
+                # Niezapisana wersja staje się snapshotem w pamięci; generacja zostaje stara
+                self._set_shard(author, list(draft), self.sets_generations.get(author))
+                self._pending_sets.setdefault(author, []).append(mutation)
+                self._flusher.notify()
+            return True
+
+    def _commit_sets(self, author, mutations, applied=False):
+        """Zapisz shard z nałożonymi mutacjami i opublikuj go jako nowy snapshot.
+
+        Mutacje działają na kopii (ShardDraft), więc opublikowany snapshot nie zmienia się
+        do chwili udanego zapisu. Po konflikcie wczytywany jest świeży shard, a mutacje
+        są nakładane ponownie. `applied=True` oznacza, że mutacje są już w snapshocie
+        w pamięci (flush write-behind).
+        """
+        with self._index_lock:
+            base = self.sets_by_author.get(author)
+            base_generation = self.sets_generations.get(author)
+        for attempt in range(WRITE_MAX_RETRIES):
+            if base_generation is None:
+                # Snapshot bez znanej generacji nie może być bazą zapisu (zapis byłby bezwarunkowy)
+                base = None
+            if applied and attempt == 0 and base is not None:
+                sets_data = base
+            else:
+                if base is None:
+                    try:
+                        base, base_generation = load_sets(author, base_generation, strict=True)
+                    except ShardLoadError:
+                        print(f"Nie zapisano zestawów {author}: shard nie dał się wczytać")
+                        return False
+                draft = ShardDraft(base)
+                # Lista, nie generator - każda mutacja musi zostać nałożona
+                if not any([mutation(draft) for mutation in mutations]):
+                    return True
+                sets_data = list(draft)
+            try:
+                saved, generation = save_sets(author, sets_data, base_generation)
+            except WriteConflict:
+                print(f"Konflikt przy zapisie zestawów {author} (próba {attempt + 1}/{WRITE_MAX_RETRIES})")
+                base = None
+                _backoff(attempt)
+                continue
+            if not saved:
+                break
+            self._set_shard(author, sets_data, generation)
+            return True
+        print(f'Warning: save_sets failed for {author}')
+        self._discard_shard(author)
+        return False
+
+    def _discard_shard(self, author):
+        """Kopia w pamięci mogła zostać zmieniona - wymuś pełne pobranie przy kolejnym dostępie."""
+        _snapshot_cache.invalidate(self._shard_cache_name(author))
+        self._drop_shard(author)
 
-    def save_and_reload_sets(self):
-        if not save_sets(self.sets, self.sets_generation):
-            print('Warning: save_sets failed, skipping reload')
+    def flush_sets(self):
+        """Zapisz wszystkie shardy z oczekującymi zmianami (write-behind); jeden upload na shard.
+
+        Nieudany zapis zostawia mutacje w kolejce - zostaną nałożone na świeży shard
+        przy kolejnym dostępie i zapisane w następnym cyklu.
+        """
+        for author in list(self._pending_sets):
+            with self._set_lock(author):
+                batch = self._pending_sets.get(author)
+                if not batch:
+                    continue
+                started = time.monotonic()
+                ok = self._commit_sets(author, batch, applied=True)
+                self._flusher.record(len(batch), time.monotonic() - started, ok)
+                if ok:
+                    del self._pending_sets[author]
+                else:
+                    print(f"Write-behind: nie zapisano {len(batch)} zmian zestawów {author}, ponowienie w kolejnym cyklu")
+        if self._pending_sets and not self._flusher.stopped:
+            self._flusher.notify()
+
+    def write_behind_stats(self):
+        """Metryki write-behind: głębokość kolejki i czasy flushy (None, gdy tryb wyłączony)."""
+        if self._flusher is None:
+            return None
+        pending = dict(self._pending_sets)
+        return {
+            'pending_shards': len(pending),
+            'pending_mutations': sum(len(batch) for batch in pending.values()),
+            **self._flusher.stats(),
+        }
+
+    def watcher_stats(self):
+        """Metryki watchera generacji (None, gdy wyłączony)."""
+        if self._watcher is None:
+            return None
+        return {'watched_shards': len(self.sets_by_author), **self._watcher.stats()}
+
+    def shutdown(self):
+        """Zatrzymaj wątki w tle i zapisz wszystko, co czeka w kolejce write-behind."""
+        if self._watcher is not None:
+            self._watcher.stop(timeout=SNAPSHOT_WATCH_INTERVAL_MS / 1000 + 5)
+        if self._flusher is None:
             return
-        self.sets, self.sets_generation = load_sets()
+        self._flusher.stop(timeout=WRITE_BEHIND_INTERVAL_MS / 1000 + 5)
+        self.flush_sets()
+
+    def update_set(self, author, set_id, fn):
+        """Zastosuj fn(zestaw) do zestawu autora i zapisz; zwraca zapisany zestaw lub None."""
+        committed = {}
+
+        def mutation(sets_data):
+            zestaw = sets_data.edit(set_id)
+            if zestaw is None:
+                return False
+            fn(zestaw)
+            committed['zestaw'] = zestaw
+            return True
+
+        if not self.update_sets(author, mutation):
+            return None
+        return committed.get('zestaw')
+
+    def add_set(self, zestaw):
+        # Nowy zestaw od razu w bieżącej wersji schematu (komplet pól)
+        normalize_set(zestaw)
+
+        def mutation(sets_data):
+            if any(s.get('id') == zestaw.get('id') for s in sets_data):
+                return False
+            sets_data.append(zestaw)
+            return True
+
+        return self.update_sets(zestaw['autor'], mutation)
+
+    def remove_set(self, author, set_id):
+        def mutation(sets_data):
+            zestaw = next((s for s in sets_data if s.get('id') == set_id), None)
+            if zestaw is None:
+                return False
+            sets_data.remove(zestaw)
+            return True
+
+        return self.update_sets(author, mutation)
+
+    def update_user(self, login, fn):
+        """Zastosuj fn(user) do rekordu użytkownika i zapisz; zwraca zapisanego użytkownika lub None.
+
+        Przy konflikcie generacji rekord jest wczytywany ponownie, a fn nakładana od nowa.
+        """
+        for attempt in range(WRITE_MAX_RETRIES):
+            user, generation = load_user(login)
+            if user is None:
+                return None
+            # Rekord z cache jest współdzielony między wątkami - fn dostaje własną kopię
+            user = copy.deepcopy(user)
+            fn(user)
+            try:
+                saved, _ = save_user(user, generation)
+            except WriteConflict:
+                print(f"Konflikt przy zapisie użytkownika (próba {attempt + 1}/{WRITE_MAX_RETRIES})")
+                _snapshot_cache.invalidate(_user_record_cache_name(login))
+                _backoff(attempt)
+                continue
+            if not saved:
+                break
+            self.users_by_login[login] = user
+            return user
+        print('Warning: save_user failed')
+        _snapshot_cache.invalidate(_user_record_cache_name(login))
+        return None
+
+    def add_user(self, user):
+        """Dodaj użytkownika; False, jeśli login jest już zajęty lub zapis się nie powiódł."""
+        try:
+            saved, _ = save_user(user, expected_generation=0)
+        except WriteConflict:
+            return False
+        if saved:
+            self.users_by_login[user.get('login')] = user
+        return saved
+
+def _create_store():
+    if STORAGE_BACKEND == 'sqlite':
+        from sqlite_store import SqliteDataStore
+        return SqliteDataStore(SQLITE_PATH)
+    return DataStore()
+
+
+class _LazyStore:
+    """Pośrednik do DataStore tworzonego przy pierwszym użyciu, a nie przy imporcie modułu.
+
+    Dzięki temu import aplikacji (i start instancji Cloud Run) nie czeka na pobranie
+    danych z GCS - płaci za nie pierwsze żądanie, które faktycznie ich potrzebuje,
+    albo wcześniej endpoint /warmup.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._instance is not None
+
+    def load(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+        return self._instance
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+
+store = _LazyStore(_create_store)
+
+
+def warm_up():
+    """Utwórz store (z importem SDK w trybie cloud) przed pierwszym żądaniem; zwraca czas w ms."""
+    started = time.perf_counter()
+    store.load()
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+def _flush_loaded_store():
+    # Store, który nigdy nie został użyty, nie ma czego zapisywać - nie twórz go przy wyjściu
+    if store.loaded and isinstance(store.load(), DataStore):
+        store.shutdown()
+
+
+def _install_shutdown_flush():
+    """Zapisz kolejkę write-behind przy wyjściu procesu i na SIGTERM (Cloud Run, Gunicorn).
+
+    Poprzedni handler SIGTERM (np. Gunicorna) jest wywoływany po zapisie.
+    """
+    atexit.register(_flush_loaded_store)
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def handle_sigterm(signum, frame):
+        _flush_loaded_store()
+        if callable(previous):
+            previous(signum, frame)
+        elif previous != signal.SIG_IGN:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            os.kill(os.getpid(), signal.SIGTERM)
+
+    try:
+        signal.signal(signal.SIGTERM, handle_sigterm)
+    except ValueError:
+        # signal.signal działa tylko w głównym wątku - zostaje atexit
+        print("OSTRZEŻENIE: nie można zarejestrować handlera SIGTERM dla write-behind")
 
 
-store = DataStore()
+if WRITE_BEHIND and STORAGE_BACKEND != 'sqlite':
+    # Rejestracja przy imporcie - signal.signal działa tylko w głównym wątku
+    _install_shutdown_flush()
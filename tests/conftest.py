@@ -0,0 +1,5 @@
+"""Moduły aplikacji są płaskie w katalogu głównym repozytorium - dodaj go do sys.path."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
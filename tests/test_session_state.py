@@ -0,0 +1,23 @@
+"""Testy zwartego stanu sesji (session_state.py) - bez Flaska."""
+import pytest
+
+from session_state import bits_from_str, bits_to_str, permuted_index
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 16, 17, 100, 1025])
+def test_permuted_index_is_a_permutation(size):
+    for seed in (1, 12345, 2 ** 31 - 1):
+        assert sorted(permuted_index(seed, i, size) for i in range(size)) == list(range(size))
+
+
+def test_permuted_index_depends_on_seed():
+    first = [permuted_index(1, i, 1000) for i in range(10)]
+    assert first == [permuted_index(1, i, 1000) for i in range(10)]
+    assert first != [permuted_index(2, i, 1000) for i in range(10)]
+
+
+def test_bits_round_trip():
+    value = 1 << 0 | 1 << 7 | 1 << 300
+    assert bits_from_str(bits_to_str(value)) == value
+    assert bits_to_str(0) == ''
+    assert bits_from_str('!!') == 0
@@ -0,0 +1,104 @@
+"""Testy silnika SM-2 (srs.py) - bez Flaska i storage."""
+import pytest
+
+from cards import CardStats
+from srs import DEFAULT_EASE, GRADE_FAIL, GRADE_PASS, MIN_EASE, grade_of, initial_state, review_batch
+
+
+def _stats(**fields):
+    stats = CardStats()
+    for name, value in fields.items():
+        setattr(stats, name, value)
+    return stats
+
+
+# ---------------------------------------------------------------------------
+# review_batch
+# ---------------------------------------------------------------------------
+
+def test_review_batch_intervals_by_repetitions():
+    eases, intervals, reps = review_batch([2.5, 2.5, 2.5, 2.0], [0, 1, 6, 10], [0, 1, 2, 5], [4, 4, 4, 4])
+    assert intervals == [1, 6, 15, 20]
+    assert reps == [1, 2, 3, 6]
+    assert eases == pytest.approx([2.5, 2.5, 2.5, 2.0])
+
+
+def test_review_batch_ease_changes_with_grade():
+    eases, _, _ = review_batch([2.5, 2.5, 2.5], [0, 0, 0], [0, 0, 0], [5, 3, 2])
+    assert eases == pytest.approx([2.6, 2.36, 2.18])
+
+
+def test_review_batch_failure_resets_interval_and_repetitions():
+    eases, intervals, reps = review_batch([2.5], [30], [5], [GRADE_FAIL])
+    assert intervals == [1]
+    assert reps == [0]
+    assert eases == pytest.approx([2.18])
+
+
+def test_review_batch_ease_floor():
+    eases, _, _ = review_batch([1.4, MIN_EASE], [6, 6], [3, 3], [0, 1])
+    assert eases == [MIN_EASE, MIN_EASE]
+
+
+def test_review_batch_none_grade_keeps_state():
+    eases, intervals, reps = review_batch([2.1, 2.5], [6, 1], [2, 1], [None, GRADE_PASS])
+    assert (eases[0], intervals[0], reps[0]) == (2.1, 6, 2)
+    assert (intervals[1], reps[1]) == (6, 2)
+
+
+def test_review_batch_does_not_mutate_inputs():
+    eases, intervals, reps, grades = [2.5, 1.5], [6, 1], [2, 0], [5, 0]
+    review_batch(eases, intervals, reps, grades)
+    assert (eases, intervals, reps, grades) == ([2.5, 1.5], [6, 1], [2, 0], [5, 0])
+
+
+# ---------------------------------------------------------------------------
+# grade_of
+# ---------------------------------------------------------------------------
+
+@pytest.mark.parametrize('result, grade', [
+    (True, GRADE_PASS),
+    (False, GRADE_FAIL),
+    (0, 0),
+    (3, 3),
+    (5, 5),
+    (6, None),
+    (-1, None),
+    (None, None),
+    ('4', None),
+    (4.0, None),
+])
+def test_grade_of(result, grade):
+    assert grade_of(result) == grade
+
+
+# ---------------------------------------------------------------------------
+# initial_state (migracja kart sprzed silnika SM-2)
+# ---------------------------------------------------------------------------
+
+def test_initial_state_interval_from_dates():
+    ease, interval = initial_state(_stats(next_due='2025-01-17', last_seen_date='2025-01-01', sessions_ok_streak=3))
+    assert interval == 16
+    assert ease == DEFAULT_EASE
+
+
+def test_initial_state_ease_from_failures():
+    ease, _ = initial_state(_stats(nie_rozumiem=2))
+    assert ease == pytest.approx(1.86)
+    ease, _ = initial_state(_stats(nie_rozumiem=10))
+    assert ease == MIN_EASE
+
+
+@pytest.mark.parametrize('streak, interval', [(0, 0), (1, 1), (2, 6), (3, 16), (7, 16)])
+def test_initial_state_streak_fallback(streak, interval):
+    assert initial_state(_stats(sessions_ok_streak=streak))[1] == interval
+
+
+def test_initial_state_negative_interval_falls_back_to_streak():
+    stats = _stats(next_due='2025-01-01', last_seen_date='2025-01-10', sessions_ok_streak=2)
+    assert initial_state(stats)[1] == 6
+
+
+def test_initial_state_malformed_dates_fall_back_to_streak():
+    stats = _stats(next_due='jutro', last_seen_date='2025-01-10', sessions_ok_streak=1)
+    assert initial_state(stats)[1] == 1
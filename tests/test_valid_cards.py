@@ -0,0 +1,45 @@
+"""Testy projekcji poprawnych kart testu (valid_cards.py) - bez Flaska i storage."""
+from cards import Card
+from valid_cards import ValidCardsCache
+
+
+def _set(set_id, *pairs, author='ala'):
+    return {'id': set_id, 'autor': author, 'karty': [Card(q, a) for q, a in pairs]}
+
+
+def test_projection_skips_blank_cards_and_strips_text():
+    cache = ValidCardsCache()
+    entry = cache.get(_set('s1', (' a ', '1'), ('', '2'), ('b', '  '), ('c', ' 3')))
+    assert entry.indices == [0, 3]
+    assert entry.questions == ['a', 'c']
+    assert entry.answers == ['1', '3']
+    assert len(entry) == 2
+
+
+def test_same_set_object_reuses_projection():
+    cache = ValidCardsCache()
+    zestaw = _set('s1', ('a', '1'))
+    assert cache.get(zestaw) is cache.get(zestaw)
+    # Nowa wersja zestawu (copy-on-write) to nowy obiekt - projekcja jest przebudowywana
+    changed = dict(zestaw, karty=zestaw['karty'] + [Card('b', '2')])
+    assert len(cache.get(changed)) == 2
+
+
+def test_retain_releases_sets_missing_from_published_snapshot():
+    cache = ValidCardsCache()
+    kept, edited, removed = _set('s1', ('a', '1')), _set('s2', ('b', '2')), _set('s3', ('c', '3'))
+    for zestaw in (kept, edited, removed):
+        cache.get(zestaw)
+    cache.retain('ala', [kept, dict(edited)])
+    assert set(cache._by_author['ala']) == {'s1'}
+    assert cache._by_author['ala']['s1'].zestaw is kept
+
+
+def test_drop_and_clear_release_author_projections():
+    cache = ValidCardsCache()
+    cache.get(_set('s1', ('a', '1')))
+    cache.get(_set('s2', ('b', '2'), author='ola'))
+    cache.drop('ala')
+    assert set(cache._by_author) == {'ola'}
+    cache.clear()
+    assert not cache._by_author
@@ -0,0 +1,80 @@
+"""Projekcja poprawnych kart zestawu (niepuste pytanie i odpowiedź) dla trybu testu.
+
+Projekcja jest budowana leniwie dla zestawu z opublikowanego snapshotu sharda
+(DataStore.valid_cards) i trzymana tylko tak długo, jak ten snapshot: publikacja
+nowego snapshotu autora zwalnia projekcje zestawów, których już w nim nie ma,
+a wyrzucenie sharda z pamięci - wszystkie projekcje autora. Snapshoty są
+copy-on-write, więc zestaw niezmieniony przez mutację zachowuje swoją projekcję.
+"""
+import threading
+
+from session_state import fingerprint
+
+
+class ValidCards:
+    """Poprawne karty jednej wersji zestawu: indeksy w `karty` i przycięte teksty.
+
+    Pozycja *i* opisuje i-tą poprawną kartę: ``indices[i]`` to jej indeks
+    w ``zestaw['karty']``, ``questions[i]`` / ``answers[i]`` - przycięty tekst.
+    """
+
+    __slots__ = ('zestaw', 'indices', 'questions', 'answers', 'fingerprint')
+
+    def __init__(self, zestaw):
+        self.zestaw = zestaw
+        self.indices = []
+        self.questions = []
+        self.answers = []
+        ids = []
+        for i, karta in enumerate(zestaw['karty']):
+            pair = karta.test_pair()
+            if pair is not None:
+                self.indices.append(i)
+                self.questions.append(pair[0])
+                self.answers.append(pair[1])
+                ids.append(karta.id)
+        self.fingerprint = fingerprint(ids)
+
+    def __len__(self):
+        return len(self.indices)
+
+
+class ValidCardsCache:
+    """autor -> {id zestawu: ValidCards} zestawów opublikowanych snapshotów (wspólne dla wątków)."""
+
+    def __init__(self):
+        self._by_author = {}
+        self._lock = threading.Lock()
+
+    def get(self, zestaw):
+        author = zestaw.get('autor')
+        set_id = zestaw.get('id')
+        with self._lock:
+            entry = self._by_author.get(author, {}).get(set_id)
+        if entry is not None and entry.zestaw is zestaw:
+            return entry
+        # Budowa poza blokadą; równoległe budowy tej samej wersji zestawu dają ten sam wynik
+        entry = ValidCards(zestaw)
+        with self._lock:
+            self._by_author.setdefault(author, {})[set_id] = entry
+        return entry
+
+    def retain(self, author, sets_data):
+        """Po publikacji snapshotu: zostaw tylko projekcje zestawów, które w nim są (te same obiekty)."""
+        with self._lock:
+            entries = self._by_author.get(author)
+            if not entries:
+                return
+            current = {id(zestaw) for zestaw in sets_data}
+            for set_id in [set_id for set_id, entry in entries.items() if id(entry.zestaw) not in current]:
+                del entries[set_id]
+            if not entries:
+                del self._by_author[author]
+
+    def drop(self, author):
+        with self._lock:
+            self._by_author.pop(author, None)
+
+    def clear(self):
+        with self._lock:
+            self._by_author.clear()